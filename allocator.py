@@ -0,0 +1,84 @@
+import ipaddress
+
+class PoolExhausted(ValueError):
+    pass
+
+class SubnetPool:
+    # Subnets of one prefix length carved out of a network, tracked by index: subnet i
+    # starts at base + i * step. Indices at or above `next` were never handed out, freed
+    # ones sit on a stack, so allocate and free are O(1) and the state is a few integers.
+    def __init__(self, network: str, prefixlen: int):
+        self.network = ipaddress.ip_network(network)
+        if prefixlen < self.network.prefixlen or prefixlen > self.network.max_prefixlen:
+            raise ValueError(f"/{prefixlen} subnets do not fit in {self.network}")
+        self.prefixlen = prefixlen
+        self.base = int(self.network.network_address)
+        self.step = 1 << (self.network.max_prefixlen - prefixlen)
+        self.size = 1 << (prefixlen - self.network.prefixlen)
+        self.next = 0
+        self.freed: list[int] = []
+        self.freed_set: set[int] = set()
+
+    def available(self) -> int:
+        return self.size - self.next + len(self.freed)
+
+    def reserve(self, count: int):
+        # fail before a build starts rather than partway through it.
+        if count > self.available():
+            raise PoolExhausted(f"{self.network} has {self.available()} free /{self.prefixlen} subnets, {count} needed")
+
+    def allocate(self) -> int:
+        if len(self.freed) != 0:
+            index = self.freed.pop()
+            self.freed_set.discard(index)
+            return index
+        self.reserve(1)
+        self.next += 1
+        return self.next - 1
+
+    def allocate_many(self, count: int) -> list[int] | range:
+        self.reserve(count)
+        if len(self.freed) == 0:
+            self.next += count
+            return range(self.next - count, self.next)
+        return [self.allocate() for _ in range(count)]
+
+    def free(self, index: int):
+        if index < 0 or index >= self.next or index in self.freed_set:
+            raise ValueError(f"subnet {index} of {self.network} is not allocated")
+        self.freed.append(index)
+        self.freed_set.add(index)
+
+    def index_of(self, subnet: str) -> int:
+        subnet = ipaddress.ip_network(subnet)
+        if subnet.prefixlen != self.prefixlen or not subnet.subnet_of(self.network):
+            raise ValueError(f"{subnet} is not a /{self.prefixlen} subnet of {self.network}")
+        return (int(subnet.network_address) - self.base) // self.step
+
+    def subnet(self, index: int) -> ipaddress.IPv4Network | ipaddress.IPv6Network:
+        if index < 0 or index >= self.size:
+            raise IndexError(f"subnet {index} is outside {self.network}")
+        return ipaddress.ip_network((self.base + index * self.step, self.prefixlen))
+
+    def p2p(self, index: int) -> tuple[ipaddress.IPv4Interface | ipaddress.IPv6Interface, ...]:
+        # both ends of a point-to-point subnet; /31 and /127 use both addresses (RFC 3021, RFC 6164).
+        if self.step < 2:
+            raise ValueError(f"/{self.prefixlen} subnets have no room for two ends")
+        if index < 0 or index >= self.next or index in self.freed_set:
+            raise IndexError(f"subnet {index} of {self.network} is not allocated")
+        start = self.base + index * self.step
+        if self.step > 2:
+            start += 1
+        return (ipaddress.ip_interface((start, self.prefixlen)),
+                ipaddress.ip_interface((start + 1, self.prefixlen)))
+
+    def to_dict(self) -> dict:
+        return {"network": str(self.network), "prefixlen": self.prefixlen, "next": self.next, "freed": list(self.freed)}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "SubnetPool":
+        pool = cls(state["network"], state["prefixlen"])
+        pool.next = state["next"]
+        pool.freed = list(state["freed"])
+        pool.freed_set = set(pool.freed)
+        return pool
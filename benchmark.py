@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import pathlib
+import tempfile
+import contextlib
+import argparse
+import platform
+import threading
+import subprocess
+import traceback
+import dockernet
+import instrument
+import resources
+import convergence
+
+# Builds and tears down a fat-tree at every size and records, per size: wall time of every
+# phase, peak host memory, how many processes were spawned and the memory of every
+# container. --config-only renders configs and snapshot only and needs no docker.
+SAMPLE_INTERVAL = 0.2
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+def host_memory_used() -> int:
+    info = {}
+    with open("/proc/meminfo") as f:
+        for line in f:
+            key, value = line.split(":", 1)
+            info[key] = int(value.split()[0]) * 1024
+    return info["MemTotal"] - info["MemAvailable"]
+
+def forks() -> int:
+    # processes created on the whole host since boot, docker's own runc and shims included.
+    with open("/proc/stat") as f:
+        for line in f:
+            if line.startswith("processes "):
+                return int(line.split()[1])
+    return 0
+
+class MemorySampler:
+    # polls host memory in the background and keeps the peak.
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.baseline = host_memory_used()
+        self.peak = self.baseline
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, host_memory_used())
+
+    def __enter__(self) -> "MemorySampler":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, host_memory_used())
+
+def container_rss(pid: int) -> int | None:
+    # the container's cgroup covers every process in it; VmRSS of its init is the fallback.
+    try:
+        with open(f"/proc/{pid}/cgroup") as f:
+            for line in f:
+                if line.startswith("0::"):
+                    current = f"{CGROUP_ROOT}{line[3:].strip()}/memory.current"
+                    if os.path.exists(current):
+                        with open(current) as m:
+                            return int(m.read())
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def containers_rss() -> dict[str, int]:
+    rss = {}
+    for name, node in dockernet.running_nodes().items():
+        if node["pid"] is not None and (value := container_rss(node["pid"])) is not None:
+            rss[name] = value
+    return rss
+
+def phases() -> dict[str, float]:
+    return {name: op["total"] for name, op in instrument.summary()["operations"].items() if op["category"] == "phase"}
+
+@contextlib.contextmanager
+def scratch_configs(fattree):
+    # fattree renders into a temporary directory, so a fabric already running from .config
+    # keeps its config directories; they would be pruned to the benchmark's size.
+    saved = fattree.config_dir, fattree.snapshot_dir, fattree.TOPO_FILE
+    with tempfile.TemporaryDirectory(prefix="dockernet-benchmark-") as scratch:
+        fattree.config_dir = pathlib.Path(scratch, ".config")
+        fattree.snapshot_dir = str(pathlib.Path(scratch, "snapshot"))
+        fattree.TOPO_FILE = str(fattree.config_dir / "fattree.json")
+        try:
+            yield
+        finally:
+            fattree.config_dir, fattree.snapshot_dir, fattree.TOPO_FILE = saved
+
+def run_size(num_pods: int, num_leafs_per_pod: int, workers: int, config_only: bool) -> dict:
+    import fattree
+    with scratch_configs(fattree):
+        return measure_size(fattree, num_pods, num_leafs_per_pod, workers, config_only)
+
+def measure_size(fattree, num_pods: int, num_leafs_per_pod: int, workers: int, config_only: bool) -> dict:
+    if not config_only:
+        dockernet.clean_networks(workers)
+    instrument.reset()
+    forks_before = forks()
+    result: dict = {"num_pods": num_pods, "num_leafs_per_pod": num_leafs_per_pod, "workers": workers}
+    with MemorySampler() as sampler:
+        start = time.perf_counter()
+        topo = fattree.fattree(num_pods, num_leafs_per_pod, config_only=config_only, workers=workers)
+        result["build"] = round(time.perf_counter() - start, 3)
+        result["devices"] = len(topo["devices"]) + len(topo["hosts"])
+        result["links"] = len(topo["links"])
+        if not config_only:
+            rss = containers_rss()
+            start = time.perf_counter()
+            dockernet.clean_networks(workers)
+            result["teardown"] = round(time.perf_counter() - start, 3)
+            result["container_rss"] = {
+                "count": len(rss),
+                "mean": sum(rss.values()) // len(rss) if len(rss) != 0 else 0,
+                "max": max(rss.values(), default=0),
+                "total": sum(rss.values()),
+                "by_container": rss,
+            }
+    stats = instrument.summary()["operations"]
+    result["phases"] = {name: round(seconds, 3) for name, seconds in phases().items()}
+    result["host_memory"] = {"baseline": sampler.baseline, "peak": sampler.peak, "delta": sampler.peak - sampler.baseline}
+    result["subprocesses"] = sum(op["count"] for op in stats.values() if op["category"] == "subprocess")
+    result["docker_api_calls"] = sum(op["count"] for op in stats.values() if op["category"] == "api")
+    result["forks"] = forks() - forks_before
+    return result
+
+def revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def benchmark(sizes: list[tuple[int, int]], workers: int = dockernet.WORKERS, config_only: bool = False) -> dict:
+    results = []
+    for num_pods, num_leafs_per_pod in sizes:
+        print(f"=== {num_pods} pods x {num_leafs_per_pod} leafs per pod")
+        results.append(run_size(num_pods, num_leafs_per_pod, workers, config_only))
+    return {
+        "revision": revision(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config_only": config_only,
+        "backend": dockernet.netlink.BACKEND,
+        "host": {"cpus": os.cpu_count(), "python": platform.python_version()},
+        "results": results,
+    }
+
+def format_results(report: dict, baseline: dict | None = None) -> str:
+    # with a baseline, build and teardown are followed by the ratio to the same size there.
+    previous = {(r["num_pods"], r["num_leafs_per_pod"]): r for r in (baseline or {}).get("results", [])}
+    lines = [f"{'pods':>5} {'leafs':>5} {'devices':>8} {'links':>7} {'build':>15} {'teardown':>15} {'peak mem':>10} {'spawns':>7} {'forks':>7} {'rss/ctr':>9}"]
+    for r in report["results"]:
+        old = previous.get((r["num_pods"], r["num_leafs_per_pod"]), {})
+        cells = []
+        for key in ["build", "teardown"]:
+            if key not in r:
+                cells.append(f"{'-':>15}")
+            elif old.get(key):
+                cells.append(f"{r[key]:>7.2f}s x{r[key] / old[key]:<5.2f}")
+            else:
+                cells.append(f"{r[key]:>7.2f}s{'':6}")
+        rss = r.get("container_rss", {}).get("mean", 0)
+        lines.append(f"{r['num_pods']:>5} {r['num_leafs_per_pod']:>5} {r['devices']:>8} {r['links']:>7} {cells[0]} {cells[1]} "
+                     f"{r['host_memory']['delta'] / 2**20:>8.1f}MB {r['subprocesses']:>7} {r['forks']:>7} {rss / 2**20:>7.1f}MB")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="benchmark.py", description="build and tear down fattree at every size")
+    parser.add_argument("sizes", nargs="+", metavar="PODSxLEAFS", type=convergence.parse_size)
+    parser.add_argument("-j", "--workers", type=int, default=dockernet.WORKERS)
+    parser.add_argument("-c", "--config-only", action="store_true", help="render configs only, without docker")
+    parser.add_argument("-o", "--output", help="write the results as JSON")
+    parser.add_argument("-b", "--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("-r", "--resources", help="sample CPU, memory and traffic of every node and write the series as JSON")
+    args = parser.parse_args()
+    if not args.config_only and os.geteuid() != 0:
+        exit("benchmark.py should be run as root")
+    sampler = resources.start() if args.resources is not None else None
+    try:
+        report = benchmark(args.sizes, args.workers, args.config_only)
+    except:
+        traceback.print_exc()
+        if not args.config_only:
+            dockernet.clean_networks()
+        sys.exit(1)
+    finally:
+        if sampler is not None:
+            resources.stop()
+            sampler.export(args.resources)
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print(format_results(report, baseline))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
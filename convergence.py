@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+import sys
+import json
+import time
+import argparse
+import subprocess
+import instrument
+import traceback
+import dockernet
+
+# Every router is polled with one exec per round for its BGP session states and RIB
+# size. Routing counts as converged once every session is established and no router's
+# state has changed for STABLE_POLLS rounds in a row; the time to converge is when the
+# state last changed, not when that was noticed.
+POLL_INTERVAL = 1.0
+STABLE_POLLS = 3
+TIMEOUT = 300
+STATE_MARKER = "__dockernet_rib__"
+
+def routers() -> list[str]:
+    # FRR devices: everything running that is neither a host nor a bare namespace.
+    return sorted(name for name, node in dockernet.running_nodes().items()
+                  if name not in dockernet.hosts and node["image"] != dockernet.NETNS_IMAGE)
+
+def parse_state(output: str) -> dict[str, int]:
+    summary, _, rib = output.partition(STATE_MARKER)
+    peers: dict = {}
+    try:
+        for family in json.loads(summary).values():
+            if isinstance(family, dict):
+                peers.update(family.get("peers", {}))
+    except json.JSONDecodeError:
+        pass
+    try:
+        routes = json.loads(rib).get("routesTotal", 0)
+    except json.JSONDecodeError:
+        routes = 0
+    return {
+        "peers": len(peers),
+        "established": sum(1 for peer in peers.values() if peer.get("state") == "Established"),
+        "prefixes": sum(peer.get("pfxRcd", 0) for peer in peers.values()),
+        "routes": routes,
+    }
+
+def router_state(name: str, timeout: float = 10) -> dict[str, int]:
+    script = f"vtysh -c 'show bgp summary json'; echo {STATE_MARKER}; vtysh -c 'show ip route summary json'"
+    try:
+        output = instrument.run(dockernet.device_command(name, "sh", "-c", script),
+                                capture_output=True, text=True, timeout=timeout).stdout
+    except subprocess.TimeoutExpired:
+        output = ""
+    return parse_state(output)
+
+def poll(names: list[str], workers: int = dockernet.WORKERS) -> dict[str, dict[str, int]]:
+    return dict(zip(names, dockernet.run_map(router_state, names, workers)))
+
+def wait_converged(names: list[str] | None = None, interval: float = POLL_INTERVAL, stable: int = STABLE_POLLS,
+                   timeout: float = TIMEOUT, workers: int = dockernet.WORKERS) -> dict:
+    names = routers() if names is None else names
+    start = time.perf_counter()
+    last: dict[str, dict[str, int]] | None = None
+    changed_at = 0.0
+    unchanged = 0
+    polls = 0
+    while True:
+        round_start = time.perf_counter()
+        state = poll(names, workers)
+        now = time.perf_counter() - start
+        polls += 1
+        if state != last:
+            last = state
+            changed_at = now
+            unchanged = 0
+        else:
+            unchanged += 1
+        sessions = sum(s["peers"] for s in state.values())
+        established = sum(s["established"] for s in state.values())
+        converged = sessions != 0 and established == sessions and unchanged >= stable
+        if converged or now >= timeout:
+            break
+        time.sleep(max(0.0, interval - (time.perf_counter() - round_start)))
+
+    result = {
+        "converged": converged,
+        "seconds": round(changed_at, 3) if converged else None,
+        "elapsed": round(now, 3),
+        "polls": polls,
+        "routers": len(names),
+        "sessions": sessions,
+        "established": established,
+        "routes": sum(s["routes"] for s in state.values()),
+    }
+    if converged:
+        print(f"converged in {changed_at:.2f}s: {established} sessions, {result['routes']} routes on {len(names)} routers")
+    else:
+        print(f"not converged after {now:.2f}s: {established} of {sessions} sessions established")
+    return result
+
+def parse_size(size: str) -> tuple[int, int]:
+    pods, leafs = size.lower().split("x")
+    return int(pods), int(leafs)
+
+def benchmark(sizes: list[tuple[int, int]], workers: int = dockernet.WORKERS, interval: float = POLL_INTERVAL,
+              stable: int = STABLE_POLLS, timeout: float = TIMEOUT) -> list[dict]:
+    import fattree
+    results: list[dict] = []
+    for num_pods, num_leafs_per_pod in sizes:
+        print(f"=== {num_pods} pods x {num_leafs_per_pod} leafs per pod")
+        start = time.perf_counter()
+        topo = fattree.fattree(num_pods, num_leafs_per_pod, workers=workers)
+        build = time.perf_counter() - start
+        result = wait_converged([device["name"] for device in topo["devices"]], interval, stable, timeout, workers)
+        results.append({"num_pods": num_pods, "num_leafs_per_pod": num_leafs_per_pod, "build": round(build, 3), **result})
+    dockernet.clean_networks(workers)
+    return results
+
+def format_results(results: list[dict]) -> str:
+    lines = [f"{'pods':>5} {'leafs':>5} {'routers':>8} {'sessions':>9} {'routes':>8} {'build':>8} {'converge':>9}"]
+    for r in results:
+        converge = f"{r['seconds']:.2f}s" if r["converged"] else "timeout"
+        lines.append(f"{r['num_pods']:>5} {r['num_leafs_per_pod']:>5} {r['routers']:>8} {r['sessions']:>9} {r['routes']:>8} {r['build']:>7.2f}s {converge:>9}")
+    return "\n".join(lines)
+
+def add_poll_args(parser: argparse.ArgumentParser):
+    parser.add_argument("-j", "--workers", type=int, default=dockernet.WORKERS)
+    parser.add_argument("-i", "--interval", type=float, default=POLL_INTERVAL)
+    parser.add_argument("-s", "--stable", type=int, default=STABLE_POLLS)
+    parser.add_argument("-t", "--timeout", type=float, default=TIMEOUT)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="convergence.py", description="run fattree at every size and time BGP convergence")
+    parser.add_argument("sizes", nargs="+", metavar="PODSxLEAFS", type=parse_size)
+    parser.add_argument("-o", "--output", help="also write the results as JSON")
+    add_poll_args(parser)
+    args = parser.parse_args()
+    try:
+        results = benchmark(args.sizes, args.workers, args.interval, args.stable, args.timeout)
+        print(format_results(results))
+        if args.output is not None:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=1)
+    except:
+        traceback.print_exc()
+        dockernet.clean_networks()
+        sys.exit(1)
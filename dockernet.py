@@ -1,33 +1,90 @@
 #!/usr/bin/env python3
 import subprocess
+import sys
+import argparse
+import csv
+import io
+import json
+import re
+import fnmatch
+import shlex
 import docker
+import docker.errors
 import docker.types
 import ipaddress
 import traceback
-import shutil
 import pathlib
 import os
+import time
+import netlink
+import instrument
+import store
 from cmd import Cmd
+from concurrent.futures import ThreadPoolExecutor
 PREFIX = "dn-"
 PROMPT = "dn> "
-NETNS_DIR = "/var/run/netns"
+NETNS_DIR = netlink.NETNS_DIR
+WORKERS = min(32, (os.cpu_count() or 1) * 4)
+# image name that backs a device with a bare network namespace instead of a container.
+NETNS_IMAGE = "netns"
+FRR_CONFIG_DIR = "/etc/frr"
+# every container and network dockernet creates carries this label, so teardown
+# can filter on the daemon side and never touches other workloads.
+LABEL = "dockernet.prefix"
+OWNER = f"{LABEL}={PREFIX}"
 
-client = docker.from_env()
+try:
+    client = docker.from_env(max_pool_size=WORKERS)
+except docker.errors.DockerException:
+    # offline work such as snapshot export needs no daemon; anything that emulates will fail on first use.
+    client = None
+instrument.node_prefix = PREFIX
+if client is not None:
+    client.api.hooks["response"].append(instrument.docker_hook)
+
+def remove_container(container):
+    try:
+        container.remove(force=True)
+    except docker.errors.NotFound:
+        pass
+
+def remove_netns_entry(entry: pathlib.Path):
+    # namespace-only devices are bind mounts and must be unmounted by `ip netns`.
+    if entry.is_symlink():
+        entry.unlink(missing_ok=True)
+    else:
+        instrument.run(["ip", "netns", "del", entry.name])
+
+# called first by clean_networks, for what other modules set up beyond the default daemon.
+cleanup_hooks: list = []
+
+@instrument.timed
+def clean_networks(workers: int = WORKERS):
+    start = time.perf_counter()
+    for hook in cleanup_hooks:
+        hook(workers)
+    print("Cleaning devices...")
+    import pool
+    # claimed pool containers go back to the pool, idle ones are left alone.
+    containers = [c for c in client.containers.list(all=True, filters={"label": OWNER}) if c.name.startswith(PREFIX)]
+    run_map(lambda c: pool.release(c) if pool.is_pooled(c) else remove_container(c), containers, workers)
 
-def clean_networks():
     print("Cleaning peripheral files")
+    # only our own entries go; the directory itself stays, as `ip netns add` may have turned it into a mount point.
+    entries = []
     if pathlib.Path(NETNS_DIR).exists():
-        shutil.rmtree(NETNS_DIR)
-    print("Cleaning devices...")
-    for container in client.containers.list():
-        if container.name.startswith(PREFIX):
-            container.kill()
-    
+        entries = [entry for entry in pathlib.Path(NETNS_DIR).iterdir() if entry.name.startswith(PREFIX)]
+    forget_all_nodes()
+    run_map(remove_netns_entry, entries, workers)
+    netns_devices.clear()
+
     print("Cleaning networks...")
-    for network in client.networks.list():
-        if network.name.startswith(PREFIX):
-            network.remove()
+    networks = client.networks.list(filters={"label": OWNER})
+    run_map(lambda network: network.remove(), networks, workers)
+    store.reset(PREFIX)
+    print(f"removed {len(containers)} containers, {len(entries)} namespaces and {len(networks)} networks in {time.perf_counter() - start:.2f}s")
 
+@instrument.timed
 def create_network(name: str, subnet: ipaddress.IPv4Network):
     network_name = PREFIX + name
     client.networks.create(
@@ -36,13 +93,43 @@ def create_network(name: str, subnet: ipaddress.IPv4Network):
         ipam=docker.types.IPAMConfig(pool_configs=[
             docker.types.IPAMPool(subnet=str(subnet))
         ]),
+        labels={LABEL: PREFIX},
         internal=True)
+    store.record_network(name, str(subnet))
 
-def create_device(name: str, image_name: str, network: str, *args):
+netns_devices: set[str] = set()
+
+@instrument.timed
+def start_netns(name: str, network: str):
+    if network != "none":
+        raise ValueError(f"{name}: namespace-only devices cannot join network {network}")
+    forget_node(name)
+    instrument.run(["ip", "netns", "add", PREFIX + name], check=True)
+    netns_devices.add(name)
+    store.record_node(name, image=NETNS_IMAGE, network=network, args=[], config=None)
+    cache_node(name, None)
+    batch = netlink.LinkBatch()
+    batch.up(PREFIX + name, "lo")
+    batch.commit_namespace(PREFIX + name)
+    print(f"{name} -> {network} (netns)")
+
+@instrument.timed
+def start_device(name: str, image_name: str, network: str, *args):
+    if image_name == NETNS_IMAGE:
+        start_netns(name, network)
+        return
+    config = next((arg.rsplit(":", 1)[0] for arg in args if arg.endswith(f":{FRR_CONFIG_DIR}")), None)
+    store.record_node(name, image=image_name, network=network, args=list(args), config=config)
+    import pool
+    if pool.claim(name, image_name, network, *args):
+        return
+    run_container(["docker"], name, image_name, network, *args)
+    print(f"{name} -> {network}")
+
+def run_container(docker_cli: list[str], name: str, image_name: str, network: str, *args):
     container_name = PREFIX + name
     network_name = "none"  if network == "none" else PREFIX + network
-    pathlib.Path(NETNS_DIR).mkdir(parents=True, exist_ok=True)
-    subprocess.run(["docker",
+    instrument.run([*docker_cli,
                     "run",
                     "-dit",
                     "--rm",
@@ -51,12 +138,173 @@ def create_device(name: str, image_name: str, network: str, *args):
                     "--network",
                     network_name,
                     "--privileged",
+                    "--label",
+                    OWNER,
                     *args,
                     image_name], stdout=subprocess.DEVNULL)
+
+# pid (None for namespace-only devices) and open netns descriptor of every registered device;
+# the descriptor is shared with netlink, which enters it in-process instead of forking.
+node_handles: dict[str, dict] = {}
+
+def cache_node(name: str, pid: int | None):
+    netns = PREFIX + name
+    fd = os.open(f"{NETNS_DIR}/{netns}" if pid is None else f"/proc/{pid}/ns/net", os.O_RDONLY)
+    netlink.remember(netns, fd)
+    node_handles[name] = {"pid": pid, "netns_fd": fd}
+    store.record_node(name, pid=pid, started=None if pid is None else store.process_started(pid))
+
+def forget_node(name: str):
+    node_handles.pop(name, None)
+    netlink.forget(PREFIX + name)
+
+def forget_all_nodes():
+    for name in list(node_handles):
+        forget_node(name)
+
+def link_netns(name: str, pid: int):
     # create netns file in /var/run/netns so that `ip` command can visit.
-    pid = subprocess.run(['docker', 'inspect', '-f', "'{{.State.Pid}}'", container_name], capture_output=True).stdout.decode()[1:-2]
-    subprocess.run(["ln", "-sfT", f"/proc/{pid}/ns/net", f"{NETNS_DIR}/{container_name}"])
-    print(f"{name} -> {network}")
+    path = pathlib.Path(NETNS_DIR, PREFIX + name)
+    path.unlink(missing_ok=True)
+    path.symlink_to(f"/proc/{pid}/ns/net")
+    cache_node(name, pid)
+
+@instrument.timed
+def register_netns(name: str):
+    if name in netns_devices:
+        return
+    pid = client.api.inspect_container(PREFIX + name)["State"]["Pid"]
+    link_netns(name, pid)
+
+def running_nodes() -> dict[str, dict]:
+    # devices dockernet is running right now, keyed by name without the prefix.
+    import pool
+    nodes: dict[str, dict] = {}
+    for container in client.containers.list(filters={"label": OWNER}):
+        if not container.name.startswith(PREFIX):
+            continue
+        mounts = {m["Destination"]: m["Source"] for m in container.attrs["Mounts"]}
+        if pool.is_pooled(container):
+            mounts[FRR_CONFIG_DIR] = pool.config_source(mounts)
+        nodes[container.name.removeprefix(PREFIX)] = {
+            "image": container.attrs["Config"]["Image"],
+            "networks": [n.removeprefix(PREFIX) for n in container.attrs["NetworkSettings"]["Networks"]],
+            "mounts": mounts,
+            "pid": container.attrs["State"]["Pid"],
+        }
+    if pathlib.Path(NETNS_DIR).exists():
+        for entry in pathlib.Path(NETNS_DIR).iterdir():
+            if entry.name.startswith(PREFIX) and not entry.is_symlink():
+                nodes[entry.name.removeprefix(PREFIX)] = {"image": NETNS_IMAGE, "networks": ["none"], "mounts": {}, "pid": None}
+    return nodes
+
+def adopt_device(name: str, node: dict):
+    # take over a device found by running_nodes() from an earlier session.
+    store.record_node(name, image=node["image"], network=node["networks"][0] if node["networks"] else "none",
+                      config=node["mounts"].get(FRR_CONFIG_DIR))
+    if node["image"] == NETNS_IMAGE:
+        netns_devices.add(name)
+        cache_node(name, None)
+    else:
+        link_netns(name, node["pid"])
+
+def save_state():
+    store.save(PREFIX, {name: None if ip is None else str(ip) for name, ip in hosts.items()})
+
+def reattach(workers: int = WORKERS) -> int:
+    # pick up the topology an earlier session left running from the state file alone: a
+    # container whose pid still runs the process that was recorded is taken as is, one that
+    # was restarted is looked up again and one that is gone is dropped. Nodes of a partitioned
+    # topology on another machine cannot be checked from here and are taken on trust.
+    saved = store.load(PREFIX)
+    if saved is None or len(node_handles) != 0:
+        return 0
+    start = time.perf_counter()
+    placed = {name: node["site"] for name, node in saved["nodes"].items() if node.get("site") is not None}
+    if len(placed) != 0:
+        import partition
+        partition.activate(list({site["name"]: site for site in placed.values()}.values()),
+                           {name: site["name"] for name, site in placed.items()})
+    fresh: list[str] = []
+    stale: list[str] = []
+    for name, node in saved["nodes"].items():
+        pid = node.get("pid")
+        if name in placed and placed[name]["via"] is not None:
+            if node.get("image") == NETNS_IMAGE:
+                netns_devices.add(name)
+        elif node.get("image") == NETNS_IMAGE or (pid is not None and store.process_started(pid) == node.get("started")):
+            fresh.append(name)
+        else:
+            stale.append(name)
+    store.adopt(saved)
+    gone: list[str] = []
+    for name in fresh:
+        try:
+            if saved["nodes"][name]["image"] == NETNS_IMAGE:
+                netns_devices.add(name)
+                cache_node(name, None)
+            elif pathlib.Path(NETNS_DIR, PREFIX + name).is_symlink():
+                cache_node(name, saved["nodes"][name]["pid"])
+            else:
+                link_netns(name, saved["nodes"][name]["pid"])
+        except OSError:
+            gone.append(name)
+
+    def refresh(name: str):
+        try:
+            if name in placed:
+                partition.register_node(name, placed[name])
+            else:
+                register_netns(name)
+        except (docker.errors.NotFound, OSError):
+            gone.append(name)
+    run_map(refresh, stale, workers)
+    attached = len(saved["nodes"]) - len(gone)
+    for name in gone:
+        store.forget_node(name)
+    for name, ip in saved["hosts"].items():
+        if name not in gone:
+            hosts[name] = None if ip is None else ipaddress.ip_address(ip)
+    save_state()
+    print(f"reattached {attached} nodes ({len(set(stale) - set(gone))} looked up again, {len(gone)} gone), "
+          f"{len(store.state['links'])} links and {len(hosts)} hosts in {(time.perf_counter() - start) * 1000:.1f}ms")
+    return attached
+
+@instrument.timed
+def remove_device(name: str):
+    forget_node(name)
+    if name in netns_devices:
+        instrument.run(["ip", "netns", "del", PREFIX + name])
+        netns_devices.discard(name)
+    else:
+        import pool
+        container = client.containers.get(PREFIX + name)
+        if pool.is_pooled(container):
+            pool.release(container)
+        else:
+            remove_container(container)
+        pathlib.Path(f"{NETNS_DIR}/{PREFIX + name}").unlink(missing_ok=True)
+    hosts.pop(name, None)
+    store.forget_node(name)
+    print(f"{name} removed")
+
+def running_networks() -> dict[str, str]:
+    networks: dict[str, str] = {}
+    for network in client.networks.list(filters={"label": OWNER}):
+        configs = network.attrs["IPAM"]["Config"] or [{}]
+        networks[network.name.removeprefix(PREFIX)] = configs[0].get("Subnet", "")
+    return networks
+
+@instrument.timed
+def remove_network(name: str):
+    client.networks.get(PREFIX + name).remove()
+    store.forget_network(name)
+
+@instrument.timed
+def create_device(name: str, image_name: str, network: str, *args):
+    pathlib.Path(NETNS_DIR).mkdir(parents=True, exist_ok=True)
+    start_device(name, image_name, network, *args)
+    register_netns(name)
 
 hosts: dict[str, ipaddress.IPv4Address | None] = {}
 
@@ -64,31 +312,85 @@ def create_host(name: str, image_name: str, network: str, *args):
     create_device(name, image_name, network, *args)
     hosts[name] = None
 
-def pingall():
-    max_host_name_len = max([len(i) for i in hosts.keys()])
-    for h1 in hosts.keys():
-        if hosts[h1] is None:
-            continue
-        print(f"{h1:>{max_host_name_len + 1}} |", end="", flush=True)
-        for h2 in hosts.keys():
-            if h1 == h2 or hosts[h2] is None:
-                continue
-            rt = subprocess.run([
-                "docker",
-                "exec",
-                PREFIX + h1,
-                "ping",
-                "-c1",
-                str(hosts[h2])
-            ], stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT).returncode
-            if rt == 0:
-                print(f"{h2:>{max_host_name_len + 1}}", end="", flush=True)
-            else:
-                print(f"{'x':>{max_host_name_len + 1}}", end="", flush=True)
-        print("")
+PING_GRACE = 5
+PING_SENT = re.compile(r"(\d+) packets transmitted, (\d+) (?:packets )?received")
+PING_RTT = re.compile(r"= [\d.]+/([\d.]+)/")
+
+def parse_ping(output: str, count: int) -> dict[str, float | None]:
+    sent = PING_SENT.search(output)
+    rtt = PING_RTT.search(output)
+    transmitted = int(sent.group(1)) if sent else count
+    received = int(sent.group(2)) if sent else 0
+    return {
+        "sent": transmitted,
+        "received": received,
+        "loss": 1.0 - received / transmitted if transmitted else 1.0,
+        "rtt_ms": float(rtt.group(1)) if rtt and received else None,
+    }
+
+def ping_pair(h1: str, h2: str, timeout: int, count: int) -> dict[str, float | None]:
+    try:
+        output = instrument.run(device_command(
+            h1,
+            "ping",
+            "-c", str(count),
+            "-W", str(timeout),
+            str(hosts[h2])
+        ), capture_output=True, text=True, timeout=timeout * count + PING_GRACE).stdout
+    except subprocess.TimeoutExpired:
+        output = ""
+    return parse_ping(output, count)
 
-def connect_device(container_name: str, network_name: str, *args):
-    subprocess.run([
+def ping_source(h1: str, targets: list[str], timeout: int, count: int) -> dict[str, dict[str, float | None]]:
+    # all pings of one source run in a single exec; each target reports on one line.
+    by_address = {str(hosts[h2]): h2 for h2 in targets}
+    script = f"for t in {' '.join(by_address)}; do (echo \"$t $(ping -q -c {count} -W {timeout} $t 2>&1 | tr '\\n' ' ')\") & done; wait"
+    try:
+        output = instrument.run(device_command(h1, "sh", "-c", script),
+                                capture_output=True, text=True, timeout=timeout * count + PING_GRACE).stdout
+    except subprocess.TimeoutExpired:
+        output = ""
+    lines = {line.split(" ", 1)[0]: line for line in output.splitlines() if line}
+    return {h2: parse_ping(lines.get(address, ""), count) for address, h2 in by_address.items()}
+
+@instrument.timed
+def pingall(workers: int = WORKERS, timeout: int = 1, count: int = 1, per_source: bool = False) -> dict[str, dict[str, dict[str, float | None]]]:
+    addressed = [h for h in hosts.keys() if hosts[h] is not None]
+    matrix: dict[str, dict[str, dict[str, float | None]]] = {h1: {} for h1 in addressed}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        if per_source:
+            futures = {h1: pool.submit(ping_source, h1, [h2 for h2 in addressed if h2 != h1], timeout, count) for h1 in addressed}
+            for h1, future in futures.items():
+                matrix[h1] = future.result()
+        else:
+            futures = {(h1, h2): pool.submit(ping_pair, h1, h2, timeout, count) for h1 in addressed for h2 in addressed if h1 != h2}
+            for (h1, h2), future in futures.items():
+                matrix[h1][h2] = future.result()
+    return matrix
+
+def format_matrix(matrix: dict[str, dict[str, dict[str, float | None]]], fmt: str = "grid") -> str:
+    if fmt == "json":
+        return json.dumps(matrix, indent=2)
+    if fmt == "csv":
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(["src", "dst", "sent", "received", "loss", "rtt_ms"])
+        for h1, row in matrix.items():
+            for h2, result in row.items():
+                writer.writerow([h1, h2, result["sent"], result["received"], result["loss"], result["rtt_ms"]])
+        return out.getvalue()
+    if len(matrix) == 0:
+        return ""
+    width = max([len(i) for i in matrix.keys()]) + 1
+    lines = []
+    for h1, row in matrix.items():
+        cells = [f"{h2 if result['received'] else 'x':>{width}}" for h2, result in row.items()]
+        lines.append(f"{h1:>{width}} |" + "".join(cells))
+    return "\n".join(lines)
+
+@instrument.timed
+def connect_device(container_name: str, network_name: str, *args) -> subprocess.CompletedProcess:
+    done = instrument.run([
         "docker",
         "network",
         "connect",
@@ -97,56 +399,171 @@ def connect_device(container_name: str, network_name: str, *args):
         PREFIX + container_name
     ])
     print(f"{container_name} -> {network_name}")
+    return done
 
-def exec_device(container_name: str, program: str, *args):
-    subprocess.run([
-        "docker",
+# nodes of a partitioned topology that live on another docker daemon: the docker command
+# that reaches it and, for another machine, the prefix that runs commands there (see partition.py).
+LOCAL_SITE = {"name": None, "docker": ["docker"], "via": None}
+node_sites: dict[str, dict] = {}
+
+def device_command(container_name: str, program: str, *args, interactive: bool = False) -> list[str]:
+    site = node_sites.get(container_name, LOCAL_SITE)
+    if container_name in netns_devices:
+        return [*(site["via"] or []), "ip", "netns", "exec", PREFIX + container_name, program, *args]
+    return [
+        *site["docker"],
         "exec",
+        *(["-it"] if interactive else []),
         PREFIX + container_name,
         program,
         *args,
-    ])
+    ]
+
+@instrument.timed
+def exec_device(container_name: str, program: str, *args) -> subprocess.CompletedProcess:
+    return instrument.run(device_command(container_name, program, *args))
+
+EXEC_MARKER = "__dockernet_exec__"
+EXEC_STATUS = re.compile(rf"\n{EXEC_MARKER} (\d+) (\d+)\n")
+
+class ExecBatch:
+    # queues commands per device and runs each device's queue as one shell script in a single exec.
+    def __init__(self):
+        self.commands: dict[str, list[list[str]]] = {}
 
+    def add(self, container_name: str, program: str, *args):
+        self.commands.setdefault(container_name, []).append([program, *args])
+
+    def script(self, container_name: str) -> str:
+        lines = [f"{shlex.join(command)} 2>&1; printf '\\n{EXEC_MARKER} {i} %d\\n' $?"
+                 for i, command in enumerate(self.commands[container_name])]
+        return "\n".join(lines)
+
+    def flush_device(self, container_name: str) -> list[tuple[str, int, str]]:
+        # one (command, return code, output) per queued command, in order.
+        commands = self.commands[container_name]
+        proc = instrument.run(device_command(container_name, "sh", "-c", self.script(container_name)),
+                              capture_output=True, text=True)
+        results: list[tuple[str, int, str]] = []
+        start = 0
+        for match in EXEC_STATUS.finditer(proc.stdout):
+            results.append((shlex.join(commands[len(results)]), int(match.group(2)), proc.stdout[start:match.start()]))
+            start = match.end()
+        # commands that never reported (the exec itself failed) get the exec's status.
+        for command in commands[len(results):]:
+            results.append((shlex.join(command), proc.returncode or -1, proc.stderr))
+        return results
+
+    def flush(self, workers: int = WORKERS) -> dict[str, list[tuple[str, int, str]]]:
+        names = list(self.commands)
+        results = dict(zip(names, run_map(self.flush_device, names, workers)))
+        self.commands.clear()
+        return results
 
 def attach_device(container_name: str, program: str, *args):
-    subprocess.run([
-        "docker",
-        "exec",
-        "-it",
-        PREFIX + container_name,
-        program,
-        *args
-    ])
+    instrument.run(device_command(container_name, program, *args, interactive=True))
+
+def plan_links(links: list[list[str]]) -> netlink.LinkBatch:
+    batch = netlink.LinkBatch()
+    for link in links:
+        c1, if1, c2, if2, ip1, ip2 = (list(link) + [None, None])[:6]
+        store.record_link([c1, if1, c2, if2, ip1, ip2])
+        c1_name = PREFIX + c1
+        c2_name = PREFIX + c2
+        batch.veth(c1_name, if1, c2_name, if2)
+
+        # Bring up device
+        batch.up(c1_name, if1, f"{c2}.{if2}")
+        batch.up(c2_name, if2, f"{c1}.{if1}")
 
+        # set ip if configured
+        if ip1 is not None:
+            intf1 = ipaddress.ip_interface(ip1)
+            batch.addr(c1_name, if1, ip1)
+            if c1 in hosts.keys():
+                hosts[c1] = intf1.ip
+                if ip2 is not None:
+                    batch.route(c1_name, str(ipaddress.ip_interface(ip2).ip))
+        if ip2 is not None:
+            intf2 = ipaddress.ip_interface(ip2)
+            batch.addr(c2_name, if2, ip2)
+            if c2 in hosts.keys():
+                hosts[c2] = intf2.ip
+                if ip1 is not None:
+                    batch.route(c2_name, str(ipaddress.ip_interface(ip1).ip))
+    return batch
+
+@instrument.timed
+def link_devices(links: list[list[str]], workers: int = WORKERS):
+    plan_links(links).commit(workers)
+
+    for link in links:
+        print(f"{link[0]}.{link[1]} -> {link[2]}.{link[3]}")
+
+@instrument.timed
 def link_device(c1: str, if1: str, c2: str, if2: str, ip1: str | None = None, ip2: str | None = None):
-    c1_name = PREFIX + c1
-    c2_name = PREFIX + c2
-    subprocess.run(["ip", "netns", "exec", c1_name, "ip", "link", "add", "dev", if1, "type", "veth", "peer", "name", if2, "netns", c2_name])
-
-    # Bring up device
-    exec_device(c1, "ip", "link", "set", "dev", if1, "up")
-    exec_device(c2, "ip", "link", "set", "dev", if2, "up")
-
-    # set ip if configured
-    if ip1 is not None:
-        intf1 = ipaddress.ip_interface(ip1)
-        exec_device(c1, "ip", "addr", "add", ip1, "dev", if1)
-        if c1 in hosts.keys():
-            hosts[c1] = intf1.ip
-            if ip2 is not None:
-                exec_device(c1, "ip", "route", "add", "default", "via", str(ipaddress.ip_interface(ip2).ip))
-    if ip2 is not None:
-        intf2 = ipaddress.ip_interface(ip2)
-        exec_device(c2, "ip", "addr", "add", ip2, "dev", if2)
-        if c2 in hosts.keys():
-            hosts[c2] = intf2.ip
-            if ip1 is not None:
-                exec_device(c2, "ip", "route", "add", "default", "via", str(ipaddress.ip_interface(ip1).ip))
-    
-    print(f"{c1}.{if1} -> {c2}.{if2}")
+    link_devices([[c1, if1, c2, if2, ip1, ip2]])
+
+def link_matches(between: list[str], c1: str, c2: str) -> bool:
+    # between is a pair of node name globs, e.g. ["rs*", "rl*"]; the link may run either way.
+    a, b = between
+    return ((fnmatch.fnmatchcase(c1, a) and fnmatch.fnmatchcase(c2, b))
+            or (fnmatch.fnmatchcase(c1, b) and fnmatch.fnmatchcase(c2, a)))
+
+@instrument.timed
+def impair_links(between: list[str], profile: dict | None, workers: int = WORKERS) -> int:
+    # change netem on running links in place; links are found by the peer alias of their ends.
+    names = list(running_nodes())
+    batch = netlink.LinkBatch()
+    count = 0
+    for name, ifaces in zip(names, run_map(netlink.interfaces, [PREFIX + name for name in names], workers)):
+        for ifname, iface in ifaces.items():
+            if iface["alias"] is not None and link_matches(between, name, iface["alias"].split(".", 1)[0]):
+                batch.impair(PREFIX + name, ifname, profile)
+                count += 1
+    batch.commit(workers)
+    print(f"{count} link ends {'cleared' if profile is None else 'impaired'}")
+    return count
+
+def run_map(fn, items: list, workers: int = WORKERS) -> list:
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return list(pool.map(fn, items))
+
+def run_phase(phase: str, fn, items: list, workers: int = WORKERS) -> float:
+    # run fn(*item) for every item on a bounded pool, re-raising the first failure.
+    start = time.perf_counter()
+    with instrument.span(phase, category="phase"), ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        list(pool.map(lambda item: fn(*item), items))
+    elapsed = time.perf_counter() - start
+    print(f"[{phase}] {len(items)} done in {elapsed:.2f}s ({workers} workers)")
+    return elapsed
+
+def parse_args(parser: argparse.ArgumentParser, argstr: str) -> argparse.Namespace | None:
+    # argparse exits on bad input, which would leave the REPL.
+    try:
+        return parser.parse_args(argstr.split())
+    except SystemExit:
+        return None
 
 class DockerNet(Cmd):
     prompt = PROMPT
+    # why the last command failed, for scripts, which stop there.
+    failure: str | None = None
+
+    def fail(self, message: str | None = None):
+        if message is not None:
+            print(message)
+        elif sys.exc_info()[0] is not None:
+            traceback.print_exc()
+            message = traceback.format_exception_only(sys.exc_info()[1])[-1].strip()
+        self.failure = message or "invalid arguments"
+
+    def precmd(self, line):
+        self.failure = None
+        return line
+
+    def default(self, line):
+        self.fail(f"*** Unknown syntax: {line}")
 
     def do_help(self, arg: str) -> bool | None:
         print("""DockerNet: docker container network emulator
@@ -158,54 +575,335 @@ Subcommands:
                     create a network with name NAME and with subnet SUBNET.
     create_device NAME IMAGE NETWORK [..args]
                     create a container from image IMAGE with name NAME and attach to network NETWORK.
+    create_host NAME IMAGE NETWORK [..args]
+                    like create_device, but NAME takes part in pingall.
+                    IMAGE "netns" backs the host with a bare network namespace (NETWORK must be none).
     connect_device NAME NETWORK [..args]
                     connect a container DEVICE to network NETWORK
     exec_device NAME PROGRAM [..args]
                     run command PROGRAM on container DEVICE
+    exec_batch FILE run every "NAME PROGRAM [..args]" line of FILE, one exec per container.
     attach_device NAME PROGRAM [..args]
                     run command PROGRAM on container DEVICE and attach to it
+    load_topo FILE [WORKERS]
+                    build the topology described by a JSON topology file.
+    reconcile_topo FILE [WORKERS]
+                    change the running topology to match FILE, touching only what differs.
+    apply_config FILE [-r ROUTER ...] | apply_config fattree PODS LEAFS  [-n] [-v] [-j WORKERS]
+                    push the bgpd.conf of every router of topology FILE (or of a fattree rendered again) into the
+                    running containers with frr-reload, which applies only what differs from the running config;
+                    prints the apply time of every router. -n shows the changes without applying them.
+    failures FILE|random [-a down|pause|kill] [-b A B] [-m GLOB] [-c COUNT] [--hold S] [--gap S] [--seed N]
+             [-s SAMPLE] [-i INTERVAL] [--settle S] [--json] [-o FILE]
+                    run a failure schedule (FILE is a JSON list of {"at": S, "action": ..., "target": ...}) or COUNT random
+                    failures of links between globs A and B, or of routers matching GLOB, each undone after --hold;
+                    SAMPLE host pairs are pinged every INTERVAL throughout, and every event gets its packet-loss
+                    window and the time until the last pair it cut off was reachable again.
+    top [tiers|nodes] [-s cpu|rss|rx|tx] [-n COUNT] [-i INTERVAL] | top export FILE [-f json|csv] | top stop
+                    CPU, memory and traffic per tier (spine, leaf, rack, host) or per node; the first top starts a
+                    sampler that reads docker stats of every node once every INTERVAL in the background until
+                    top stop, and export writes the time series it collected so far.
+    partition TOPO SITES [-p] [-j WORKERS]
+                    build topology TOPO split over the docker daemons of SITES (see partition.py), placing nodes so
+                    few links are cut and every site gets its share; cut links are VXLAN tunnels between sites.
+                    -p prints the placement only.
+    source FILE [-j WORKERS]
+                    run the commands of FILE, one per line; lines that only create or link nodes no other line
+                    nearby touches run concurrently. stops at the first failed line and reports it.
+                    ./dockernet.py --script FILE runs a script without the prompt.
+    exit [keep] | detach
+                    leave; the topology is torn down unless keep (or detach, --keep, DOCKERNET_KEEP=1) is given,
+                    in which case it keeps running and the next session reattaches to it from its state file.
+    pool fill IMAGE COUNT [TEMPLATE] | drain | status
+                    keep pre-started containers of IMAGE that create_device claims instead of starting new ones;
+                    TEMPLATE is an FRR config directory to boot them with. clean returns claimed ones to the pool.
+    pingall [grid|json|csv] [-j WORKERS] [-t TIMEOUT] [-c COUNT] [-s] [-o FILE]
+                    ping every host pair concurrently and print the reachability matrix.
+                    -s runs all pings of a source host inside one exec.
+    trafficall [all|permutation|incast] [-t SECONDS] [-P PER_HOST] [-d HOST] [-n SENDERS] [--seed N] [--json] [-o FILE]
+                    iperf3 between host pairs in the given pattern, at most PER_HOST flows per host at a time;
+                    prints fabric capacity, per-flow throughput and retransmits, and how evenly each router
+                    spread traffic over equal links. incast sends from -n hosts (all by default) to -d HOST.
+    impair A B [delay=TIME] [jitter=TIME] [loss=PERCENT] [rate=RATE] | impair A B clear
+                    set netem on both ends of every running link between nodes matching globs A and B
+                    (e.g. impair rs* rl* delay=2ms rate=1gbit), without recreating the links.
+    reachability FILE [summary|grid|json] [-p] [-j WORKERS]
+                    expected reachability and ECMP path counts of topology FILE, worked out from its FRR configs
+                    without touching the devices; -p also runs pingall and lists the pairs that disagree.
+    stats [table|json|chrome] [-n NODE] [-o FILE] [--reset]
+                    time, count and latency percentiles of every operation, subprocess and docker API call so far;
+                    -n breaks one node down, chrome writes a trace for chrome://tracing or Perfetto.
+                    set DOCKERNET_TRACE=FILE to write the trace on exit.
+    converge [-j WORKERS] [-i INTERVAL] [-s STABLE] [-t TIMEOUT] [ROUTER ...]
+                    poll every router until all BGP sessions are up and no RIB changed for STABLE polls,
+                    then print the time it took.
 """)
         
     def do_docker(self, args):
-        subprocess.run(["docker", *args.split()])
+        done = instrument.run(["docker", *args.split()])
+        if done.returncode != 0:
+            self.fail(f"docker exited with {done.returncode}")
 
     def do_clean(self, argstr):
         args = argstr.split()
         if len(args) != 0:
-            print("Usage: clean")
+            self.fail("Usage: clean")
             return
         try:
             clean_networks()
         except:
-            traceback.print_exc()
+            self.fail()
 
     def do_pingall(self, argstr):
+        parser = argparse.ArgumentParser(prog="pingall")
+        parser.add_argument("format", nargs="?", choices=["grid", "json", "csv"], default="grid")
+        parser.add_argument("-j", "--workers", type=int, default=WORKERS)
+        parser.add_argument("-t", "--timeout", type=int, default=1)
+        parser.add_argument("-c", "--count", type=int, default=1)
+        parser.add_argument("-s", "--per-source", action="store_true")
+        parser.add_argument("-o", "--output")
+        args = parse_args(parser, argstr)
+        if args is None:
+            return self.fail()
+        try:
+            output = format_matrix(pingall(args.workers, args.timeout, args.count, args.per_source), args.format)
+            if args.output is None:
+                print(output)
+            else:
+                with open(args.output, "w") as f:
+                    f.write(output)
+        except:
+            self.fail()
+
+    def do_trafficall(self, argstr):
+        import traffic
+        parser = argparse.ArgumentParser(prog="trafficall")
+        parser.add_argument("pattern", nargs="?", choices=traffic.PATTERNS, default="all")
+        parser.add_argument("-t", "--time", type=int, default=traffic.DURATION)
+        parser.add_argument("-P", "--per-host", type=int, default=traffic.PER_HOST)
+        parser.add_argument("-d", "--target")
+        parser.add_argument("-n", "--senders", type=int)
+        parser.add_argument("--seed", type=int)
+        parser.add_argument("--no-balance", action="store_true")
+        parser.add_argument("--json", action="store_true")
+        parser.add_argument("-o", "--output")
+        parser.add_argument("-j", "--workers", type=int, default=WORKERS)
+        args = parse_args(parser, argstr)
+        if args is None:
+            return self.fail()
+        try:
+            report = traffic.trafficall(args.pattern, args.time, args.per_host, args.seed, args.target, args.senders,
+                                        not args.no_balance, args.workers)
+            print(json.dumps(report, indent=2) if args.json else traffic.format_report(report))
+            if args.output is not None:
+                with open(args.output, "w") as f:
+                    json.dump(report, f, indent=1)
+        except:
+            self.fail()
+
+    def do_impair(self, argstr):
         args = argstr.split()
-        if len(args) != 0:
-            print("Usage: pingall")
+        if len(args) < 3 or (args[2] != "clear" and not all("=" in arg for arg in args[2:])):
+            self.fail("Usage: impair A B [delay=TIME] [jitter=TIME] [loss=PERCENT] [rate=RATE] | impair A B clear")
             return
         try:
-            pingall()
+            profile = None if args[2] == "clear" else dict(arg.split("=", 1) for arg in args[2:])
+            impair_links(args[:2], profile)
         except:
-            traceback.print_exc()
+            self.fail()
+
+    def do_reachability(self, argstr):
+        parser = argparse.ArgumentParser(prog="reachability")
+        parser.add_argument("file")
+        parser.add_argument("format", nargs="?", choices=["summary", "grid", "json"], default="summary")
+        parser.add_argument("-p", "--pingall", action="store_true")
+        parser.add_argument("-j", "--workers", type=int, default=WORKERS)
+        args = parse_args(parser, argstr)
+        if args is None:
+            return self.fail()
+        try:
+            import reachability
+            pings = pingall(args.workers, per_source=True) if args.pingall else None
+            print(reachability.run(reachability.topo_model(args.file), args.format, pings))
+        except:
+            self.fail()
+
+    def do_apply_config(self, argstr):
+        parser = argparse.ArgumentParser(prog="apply_config")
+        parser.add_argument("source", nargs="+", metavar="FILE | fattree PODS LEAFS")
+        parser.add_argument("-r", "--routers", nargs="+")
+        parser.add_argument("-n", "--dry-run", action="store_true")
+        parser.add_argument("-v", "--verbose", action="store_true")
+        parser.add_argument("-j", "--workers", type=int, default=WORKERS)
+        args = parse_args(parser, argstr)
+        if args is None:
+            return self.fail()
+        try:
+            import liveconfig
+            if args.source[0] == "fattree" and len(args.source) == 3:
+                import fattree
+                report = fattree.reconfigure(int(args.source[1]), int(args.source[2]), args.dry_run, args.workers)
+            elif len(args.source) == 1:
+                import topology
+                configs = liveconfig.topo_configs(topology.load_topo(args.source[0]), args.routers)
+                report = liveconfig.apply_config(configs, None, args.dry_run, args.workers)
+            else:
+                self.fail(parser.format_usage().strip())
+                return
+            print(liveconfig.format_report(report, args.verbose or args.dry_run))
+        except:
+            self.fail()
+
+    def do_failures(self, argstr):
+        import failures
+        parser = argparse.ArgumentParser(prog="failures")
+        parser.add_argument("schedule", metavar="FILE|random")
+        parser.add_argument("-a", "--action", choices=list(failures.RESTORE), default="down")
+        parser.add_argument("-b", "--between", nargs=2, default=["r*", "r*"], metavar=("A", "B"))
+        parser.add_argument("-m", "--nodes", default="r*", metavar="GLOB")
+        parser.add_argument("-c", "--count", type=int, default=3)
+        parser.add_argument("--hold", type=float, default=failures.HOLD)
+        parser.add_argument("--gap", type=float, default=failures.GAP)
+        parser.add_argument("--seed", type=int)
+        parser.add_argument("-s", "--sample", type=int, default=failures.SAMPLE)
+        parser.add_argument("-i", "--interval", type=float, default=failures.PROBE_INTERVAL)
+        parser.add_argument("--settle", type=float, default=failures.SETTLE)
+        parser.add_argument("--json", action="store_true")
+        parser.add_argument("-o", "--output")
+        args = parse_args(parser, argstr)
+        if args is None:
+            return self.fail()
+        try:
+            if args.schedule != "random":
+                events = failures.load_schedule(args.schedule)
+            elif args.action == "down":
+                events = failures.random_schedule("down", failures.link_ends(args.between), args.count, args.hold, args.gap, args.seed)
+            else:
+                events = failures.random_schedule(args.action, failures.node_targets(args.nodes), args.count, args.hold, args.gap, args.seed)
+            report = failures.run(events, args.sample, args.interval, args.settle, args.seed)
+            print(json.dumps(report, indent=1) if args.json else failures.format_report(report))
+            if args.output is not None:
+                with open(args.output, "w") as f:
+                    json.dump(report, f, indent=1)
+        except:
+            self.fail()
+
+    def do_top(self, argstr):
+        import resources
+        parser = argparse.ArgumentParser(prog="top")
+        parser.add_argument("view", nargs="?", choices=["tiers", "nodes", "export", "stop"], default="tiers")
+        parser.add_argument("file", nargs="?")
+        parser.add_argument("-f", "--format", choices=["json", "csv"], default="json")
+        parser.add_argument("-s", "--sort", choices=["cpu", "rss", "rx", "tx"], default="cpu")
+        parser.add_argument("-n", "--count", type=int)
+        parser.add_argument("-i", "--interval", type=float, default=resources.INTERVAL)
+        args = parse_args(parser, argstr)
+        if args is None:
+            return self.fail()
+        try:
+            if args.view == "stop":
+                resources.stop()
+                return
+            if args.view == "export":
+                if resources.sampler is None or args.file is None:
+                    self.fail("Usage: top export FILE [-f json|csv], while the sampler runs")
+                    return
+                resources.sampler.export(args.file, args.format)
+                return
+            if resources.sampler is None:
+                # the first view waits for two samples, so rates can be worked out.
+                resources.start(args.interval)
+                while len(resources.sampler.series) < 2:
+                    time.sleep(args.interval / 4)
+            nodes = resources.sampler.nodes()
+            rows = resources.tiers(nodes) if args.view == "tiers" else nodes
+            sort = {"rx": "rx_bps", "tx": "tx_bps"}.get(args.sort, args.sort)
+            print(resources.format_top(rows, sort, args.count))
+        except:
+            self.fail()
+
+    def do_partition(self, argstr):
+        parser = argparse.ArgumentParser(prog="partition")
+        parser.add_argument("topo")
+        parser.add_argument("sites")
+        parser.add_argument("-p", "--plan", action="store_true")
+        parser.add_argument("-j", "--workers", type=int, default=WORKERS)
+        args = parse_args(parser, argstr)
+        if args is None:
+            return self.fail()
+        try:
+            import topology
+            import partition
+            topo = topology.load_topo(args.topo)
+            site_list = partition.load_sites(args.sites)
+            if args.plan:
+                placement = partition.plan(topo, site_list)
+                result = partition.summary(placement, topo["links"])
+                print(f"placement: {result['nodes']}, {result['cut']} of {result['links']} links cut")
+                for site in site_list:
+                    print(f"{site['name']}: {' '.join(sorted(name for name, placed in placement.items() if placed == site['name']))}")
+                return
+            partition.apply(topo, site_list, args.workers)
+        except:
+            self.fail()
+
+    def do_stats(self, argstr):
+        parser = argparse.ArgumentParser(prog="stats")
+        parser.add_argument("format", nargs="?", choices=["table", "json", "chrome"], default="table")
+        parser.add_argument("-n", "--node")
+        parser.add_argument("-o", "--output")
+        parser.add_argument("--reset", action="store_true")
+        args = parse_args(parser, argstr)
+        if args is None:
+            return self.fail()
+        try:
+            if args.format == "chrome" and args.output is None:
+                self.fail("stats chrome needs -o FILE")
+                return
+            if args.output is not None:
+                instrument.export(args.output, "chrome" if args.format == "chrome" else "json")
+            elif args.format == "json":
+                print(json.dumps(instrument.summary(), indent=2))
+            else:
+                stats = instrument.summary()
+                print(instrument.format_table(stats, args.node))
+                if args.node is None and len(stats["nodes"]) != 0:
+                    print("slowest nodes: " + ", ".join(f"{node} {total:.2f}s" for node, total in instrument.slowest_nodes(stats, 5)))
+            if args.reset:
+                instrument.reset()
+        except:
+            self.fail()
+
+    def do_converge(self, argstr):
+        import convergence
+        parser = argparse.ArgumentParser(prog="converge")
+        parser.add_argument("routers", nargs="*")
+        convergence.add_poll_args(parser)
+        args = parse_args(parser, argstr)
+        if args is None:
+            return self.fail()
+        try:
+            convergence.wait_converged(args.routers or None, args.interval, args.stable, args.timeout, args.workers)
+        except:
+            self.fail()
 
     def do_create_network(self, argstr: str):
         args = argstr.split()
         if len(args) != 2:
-            print("Usage: create_network NAME SUBNET")
+            self.fail("Usage: create_network NAME SUBNET")
             return
         try:
             name = args[0]
             address = ipaddress.ip_network(args[1])
             create_network(name, address)
         except:
-            traceback.print_exc()
+            self.fail()
 
 
     def do_create_device(self, argstr: str):
         args = argstr.split()
         if len(args) < 3:
-            print("Usage: create_device NAME IMAGE NETWORK [..args]")
+            self.fail("Usage: create_device NAME IMAGE NETWORK [..args]")
             return
         try:
             name = args[0]
@@ -214,12 +912,12 @@ Subcommands:
             args = args[3:]
             create_device(name, image_name, network, *args)
         except:
-            traceback.print_exc()
+            self.fail()
     
     def do_create_host(self, argstr: str):
         args = argstr.split()
         if len(args) < 3:
-            print("Usage: create_host NAME IMAGE NETWORK [..args]")
+            self.fail("Usage: create_host NAME IMAGE NETWORK [..args]")
             return
         try:
             name = args[0]
@@ -228,12 +926,12 @@ Subcommands:
             args = args[3:]
             create_host(name, image_name, network, *args)
         except:
-            traceback.print_exc()
+            self.fail()
 
     def do_connect_device(self, argstr: str):
         args = argstr.split()
         if len(args) < 2:
-            print("Usage: connect_device NAME NETWORK [..args]")
+            self.fail("Usage: connect_device NAME NETWORK [..args]")
             return
         try:
             name = args[0]
@@ -241,12 +939,12 @@ Subcommands:
             args = args[2:]
             connect_device(name, network_name, *args)
         except:
-            traceback.print_exc()
+            self.fail()
 
     def do_link_device(self, argstr: str):
         args = argstr.split()
         if len(args) != 4:
-            print("Usage: link_device CONTAINER1 IF1 CONTAINER2 IF2")
+            self.fail("Usage: link_device CONTAINER1 IF1 CONTAINER2 IF2")
             return
         try:
             c1 = args[0]
@@ -255,12 +953,12 @@ Subcommands:
             if2 = args[3]
             link_device(c1, if1, c2, if2)
         except:
-            traceback.print_exc()
+            self.fail()
 
     def do_exec_device(self, argstr: str):
         args = argstr.split()
         if len(args) < 2:
-            print("Usage: exec_device NAME PROGRAM [..args]")
+            self.fail("Usage: exec_device NAME PROGRAM [..args]")
             return
         try:
             name = args[0]
@@ -268,12 +966,37 @@ Subcommands:
             args = args[2:]
             exec_device(name, program, *args)
         except:
-            traceback.print_exc()
+            self.fail()
+
+    def do_exec_batch(self, argstr: str):
+        args = argstr.split()
+        if len(args) != 1:
+            self.fail("Usage: exec_batch FILE")
+            return
+        try:
+            batch = ExecBatch()
+            with open(args[0]) as f:
+                for line in f:
+                    command = shlex.split(line, comments=True)
+                    if len(command) >= 2:
+                        batch.add(*command)
+            failed = 0
+            for name, results in batch.flush().items():
+                for command, returncode, output in results:
+                    print(f"{name}: {command} -> {returncode}")
+                    if returncode != 0:
+                        failed += 1
+                        if output:
+                            print(output.rstrip())
+            if failed != 0:
+                self.fail(f"{failed} commands exited non-zero")
+        except:
+            self.fail()
 
     def do_attach_device(self, argstr: str):
         args = argstr.split()
         if len(args) < 2:
-            print("Usage: attach_device NAME PROGRAM [..args]")
+            self.fail("Usage: attach_device NAME PROGRAM [..args]")
             return
         try:
             name = args[0]
@@ -281,39 +1004,140 @@ Subcommands:
             args = args[2:]
             attach_device(name, program, *args)
         except:
-            traceback.print_exc()
+            self.fail()
     
     def do_create_topo(self, argstr: str):
         args = argstr.split()
-        if len(args) < 0:
-            print("Usage: create_topo")
+        if len(args) != 0:
+            self.fail("Usage: create_topo")
             return
         try:
-            clean_networks()
+            import topology
+            # only the difference to what is already running is applied.
+            topology.reconcile_topo(topology.normalize_topo({
+                "devices": [
+                    {"name": "r1", "image": "frrouting/frr", "config": f"{os.getcwd()}/config/r1"},
+                    {"name": "r2", "image": "frrouting/frr", "config": f"{os.getcwd()}/config/r2"},
+                ],
+                "hosts": [
+                    {"name": "h1", "image": "archlinux"},
+                    {"name": "h2", "image": "archlinux"},
+                ],
+                "links": [
+                    ["r1", "eth0", "r2", "eth0", "10.0.0.10/29", "10.0.0.11/29"],
+                    ["r1", "eth1", "h1", "eth0", "10.0.0.1/29", "10.0.0.2/29"],
+                    ["r2", "eth1", "h2", "eth0", "10.0.0.17/29", "10.0.0.18/29"],
+                ],
+            }))
+        except:
+            self.fail()
 
-            create_device("r1", "frrouting/frr", "none",
-                          "-v", f"{os.getcwd()}/config/r1:/etc/frr")
-            create_device("r2", "frrouting/frr", "none",
-                          "-v", f"{os.getcwd()}/config/r2:/etc/frr",)
-            create_host("h1", "archlinux", "none")
-            create_host("h2", "archlinux", "none")
+    def do_load_topo(self, argstr: str):
+        args = argstr.split()
+        if len(args) not in [1, 2]:
+            self.fail("Usage: load_topo FILE [WORKERS]")
+            return
+        try:
+            import topology
+            topo = topology.load_topo(args[0])
+            topology.apply_topo(topo, int(args[1]) if len(args) == 2 else WORKERS)
+        except:
+            self.fail()
 
-            link_device("r1", "eth0", "r2", "eth0", "10.0.0.10/29", "10.0.0.11/29")
-            link_device("r1", "eth1", "h1", "eth0", "10.0.0.1/29", "10.0.0.2/29")
-            link_device("r2", "eth1", "h2", "eth0", "10.0.0.17/29", "10.0.0.18/29")
+    def do_reconcile_topo(self, argstr: str):
+        args = argstr.split()
+        if len(args) not in [1, 2]:
+            self.fail("Usage: reconcile_topo FILE [WORKERS]")
+            return
+        try:
+            import topology
+            topo = topology.load_topo(args[0])
+            topology.reconcile_topo(topo, int(args[1]) if len(args) == 2 else WORKERS)
         except:
-            traceback.print_exc()
+            self.fail()
+
+    def do_pool(self, argstr: str):
+        args = argstr.split()
+        if len(args) == 0 or args[0] not in ["fill", "drain", "status"] or (args[0] == "fill" and len(args) not in [3, 4]):
+            self.fail("Usage: pool fill IMAGE COUNT [TEMPLATE] | drain | status")
+            return
+        try:
+            import pool
+            if args[0] == "fill":
+                pool.fill(args[1], int(args[2]), args[3] if len(args) == 4 else None)
+            elif args[0] == "drain":
+                print(f"removed {pool.drain()} pooled containers")
+            for image, count in pool.status().items():
+                print(f"{image}: {count} idle")
+        except:
+            self.fail()
+
+    def do_source(self, argstr):
+        parser = argparse.ArgumentParser(prog="source")
+        parser.add_argument("file")
+        parser.add_argument("-j", "--workers", type=int, default=WORKERS)
+        args = parse_args(parser, argstr)
+        if args is None:
+            return self.fail()
+        try:
+            import script
+            failed = script.run(self, args.file, args.workers)
+            if failed is not None:
+                self.failure = failed
+        except:
+            self.fail()
+
+    def do_detach(self, argstr):
+        self.keep = True
+        raise SystemExit
 
     def do_exit(self, argstr):
+        if argstr.strip() not in ["", "keep"]:
+            self.fail("Usage: exit [keep]")
+            return
+        self.keep = argstr.strip() == "keep"
         raise SystemExit
-def main_loop():
+
+    def postcmd(self, stop, line):
+        try:
+            save_state()
+        except OSError:
+            traceback.print_exc()
+        return stop
+
+KEEP_ENV = "DOCKERNET_KEEP"
+
+def main_loop(keep: bool = False, script_file: str | None = None):
     if os.geteuid() != 0:
         exit("dockernet.py should be run as root")
+    app = DockerNet()
+    app.keep = keep or os.environ.get(KEEP_ENV) == "1"
     try:
-        app = DockerNet()
-        app.cmdloop("Welcome to the jungle!")
+        try:
+            reattach()
+        except:
+            traceback.print_exc()
+        if script_file is None:
+            app.cmdloop("Welcome to the jungle!")
+        else:
+            app.onecmd(app.precmd(f"source {script_file}"))
+            app.postcmd(False, "")
     finally:
-        clean_networks()
+        if app.keep:
+            save_state()
+            print(f"topology left running, the next session reattaches to it from {store.state_file(PREFIX)}")
+        else:
+            clean_networks()
+        if os.environ.get(instrument.TRACE_ENV):
+            instrument.export(os.environ[instrument.TRACE_ENV])
+    if script_file is not None and app.failure is not None:
+        exit(1)
 
 if __name__ == "__main__":
-    main_loop()
\ No newline at end of file
+    # modules imported by the REPL (topology, ...) must share this module's state.
+    sys.modules["dockernet"] = sys.modules[__name__]
+    parser = argparse.ArgumentParser(description="docker container network emulator")
+    parser.add_argument("--keep", action="store_true", help="leave the topology running on exit")
+    parser.add_argument("--script", metavar="FILE", help="run the commands of FILE instead of the prompt")
+    args = parser.parse_args()
+    main_loop(args.keep, args.script)
\ No newline at end of file
@@ -0,0 +1,178 @@
+import re
+import json
+import time
+import math
+import random
+import fnmatch
+import tempfile
+import subprocess
+import netlink
+import dockernet
+
+# Failure injection on a running fabric. A schedule is a list of events
+# {"at": SECONDS, "action": ACTION, "target": TARGET} with the time counted from the
+# start of probing: "down" and "up" take a link end "NODE.IFNAME" (its peer loses carrier
+# too), "pause", "unpause" and "kill" take a container; a killed container stays gone.
+# While the schedule runs, a sample of host pairs is pinged every PROBE_INTERVAL. Every
+# gap in a pair's replies is blamed on the last event before the gap began, and an event
+# reconverged when the last pair it cut off got replies again.
+PROBE_INTERVAL = 0.01
+SAMPLE = 16
+WARMUP = 2.0
+SETTLE = 5.0
+HOLD = 5.0
+GAP = 10.0
+# what undoes each failure, for random schedules.
+RESTORE = {"down": "up", "pause": "unpause", "kill": None}
+ACTIONS = ["down", "up", "pause", "unpause", "kill"]
+REPLY = re.compile(r"^\[([\d.]+)\].* icmp_seq=(\d+) ")
+
+def load_schedule(path: str) -> list[dict]:
+    with open(path) as f:
+        events = json.load(f)
+    for event in events:
+        if event.get("action") not in ACTIONS:
+            raise ValueError(f"unknown action {event.get('action')}, expected one of {ACTIONS}")
+        if event["action"] in ["down", "up"] and "." not in event["target"]:
+            raise ValueError(f"{event['action']} takes a link end NODE.IFNAME, not {event['target']}")
+    return sorted(events, key=lambda event: event["at"])
+
+def link_ends(between: list[str], workers: int = dockernet.WORKERS) -> list[str]:
+    # one end of every running link between nodes matching the two globs.
+    names = list(dockernet.running_nodes())
+    ends = []
+    for name, ifaces in zip(names, dockernet.run_map(netlink.interfaces, [dockernet.PREFIX + name for name in names], workers)):
+        for ifname, iface in ifaces.items():
+            if iface["alias"] is not None and f"{name}.{ifname}" < iface["alias"] \
+                    and dockernet.link_matches(between, name, iface["alias"].split(".", 1)[0]):
+                ends.append(f"{name}.{ifname}")
+    return sorted(ends)
+
+def random_schedule(action: str, targets: list[str], count: int, hold: float = HOLD, gap: float = GAP,
+                    seed: int | None = None, warmup: float = WARMUP) -> list[dict]:
+    # one failure at a time: each is undone after hold seconds and followed by gap quiet seconds.
+    if len(targets) == 0:
+        raise ValueError("nothing to fail")
+    rng = random.Random(seed)
+    events = []
+    for i in range(count):
+        at = warmup + i * (hold + gap)
+        target = rng.choice(targets)
+        events.append({"at": at, "action": action, "target": target})
+        if RESTORE[action] is not None:
+            events.append({"at": at + hold, "action": RESTORE[action], "target": target})
+    return events
+
+def inject(action: str, target: str):
+    if action in ["down", "up"]:
+        node, ifname = target.split(".", 1)
+        batch = netlink.LinkBatch()
+        if action == "down":
+            batch.down(dockernet.PREFIX + node, ifname)
+        else:
+            batch.up(dockernet.PREFIX + node, ifname)
+        batch.commit()
+    else:
+        getattr(dockernet.client.containers.get(dockernet.PREFIX + target), action)()
+
+def sample_pairs(sample: int, seed: int | None = None) -> list[tuple[str, str]]:
+    addressed = sorted(h for h in dockernet.hosts if dockernet.hosts[h] is not None)
+    pairs = [(h1, h2) for h1 in addressed for h2 in addressed if h1 != h2]
+    return sorted(random.Random(seed).sample(pairs, min(sample, len(pairs))))
+
+def start_probes(pairs: list[tuple[str, str]], interval: float, seconds: float) -> list[tuple[subprocess.Popen, object]]:
+    # ping stops by itself after seconds; output goes to files, as a pipe would fill and stall it.
+    probes = []
+    for src, dst in pairs:
+        output = tempfile.TemporaryFile("w+")
+        cmd = dockernet.device_command(src, "ping", "-D", "-n", "-i", str(interval), "-w", str(math.ceil(seconds)),
+                                       str(dockernet.hosts[dst]))
+        probes.append((subprocess.Popen(cmd, stdout=output, stderr=subprocess.DEVNULL, text=True), output))
+    return probes
+
+def collect(probes: list[tuple[subprocess.Popen, object]]) -> list[list[tuple[float, int]]]:
+    replies = []
+    for process, output in probes:
+        process.wait()
+        output.seek(0)
+        found = sorted({int(m.group(2)): float(m.group(1)) for m in map(REPLY.match, output) if m is not None}.items())
+        replies.append([(at, seq) for seq, at in found])
+        output.close()
+    return replies
+
+def gaps(replies: list[tuple[float, int]], end: float, interval: float) -> list[tuple[float, float | None, int]]:
+    # (last reply before, first reply after or None if it never came back, probes lost)
+    found = []
+    for (t0, s0), (t1, s1) in zip(replies, replies[1:]):
+        if s1 - s0 > 1:
+            found.append((t0, t1, s1 - s0 - 1))
+    if len(replies) != 0 and end - replies[-1][0] > 1.0:
+        found.append((replies[-1][0], None, round((end - replies[-1][0]) / interval)))
+    return found
+
+def analyze(events: list[dict], pairs: list[tuple[str, str]], replies: list[list[tuple[float, int]]],
+            start: float, end: float, interval: float) -> list[dict]:
+    results = [{"at": round(event["time"] - start, 3), "action": event["action"], "target": event["target"],
+                "pairs": set(), "lost": 0, "loss_window": 0.0, "reconvergence": 0.0, "unrecovered": 0} for event in events]
+    background = {"at": None, "action": "none", "target": "-", "pairs": set(), "lost": 0, "loss_window": 0.0,
+                  "reconvergence": None, "unrecovered": 0}
+    for pair, received in zip(pairs, replies):
+        for t0, t1, lost in gaps(received, end, interval):
+            # the event that happened before the first probe of the gap went out.
+            blamed = [result for result, event in zip(results, events) if event["time"] <= t0 + 2 * interval]
+            result = blamed[-1] if len(blamed) != 0 else background
+            result["pairs"].add(pair)
+            result["lost"] += lost
+            result["loss_window"] = max(result["loss_window"], (end if t1 is None else t1) - t0)
+            if t1 is None:
+                result["unrecovered"] += 1
+            elif result is not background:
+                result["reconvergence"] = max(result["reconvergence"], t1 - start - result["at"])
+    for result in results + [background]:
+        result["pairs"] = len(result["pairs"])
+        result["loss_window"] = round(result["loss_window"], 3)
+        if result["reconvergence"] is not None:
+            result["reconvergence"] = round(result["reconvergence"], 3)
+    return results + ([background] if background["pairs"] != 0 else [])
+
+def run(events: list[dict], sample: int = SAMPLE, interval: float = PROBE_INTERVAL, settle: float = SETTLE,
+        seed: int | None = None) -> dict:
+    pairs = sample_pairs(sample, seed)
+    if len(pairs) == 0:
+        raise ValueError("no addressed hosts to probe")
+    duration = max((event["at"] for event in events), default=0.0) + settle
+    print(f"probing {len(pairs)} host pairs every {interval * 1000:.0f}ms for {duration:.1f}s, {len(events)} events")
+    start = time.time()
+    probes = start_probes(pairs, interval, duration)
+    try:
+        for event in events:
+            time.sleep(max(0.0, start + event["at"] - time.time()))
+            event["time"] = time.time()
+            inject(event["action"], event["target"])
+            print(f"{event['time'] - start:7.2f}s {event['action']} {event['target']}")
+    finally:
+        # a failed injection stops the probes early rather than waiting them out.
+        for process, _output in probes:
+            if process.poll() is None and len(events) != 0 and "time" not in events[-1]:
+                process.terminate()
+        replies = collect(probes)
+    end = time.time()
+    return {"pairs": len(pairs), "interval": interval, "events": analyze(events, pairs, replies, start, end, interval),
+            "silent_pairs": [f"{src}->{dst}" for (src, dst), received in zip(pairs, replies) if len(received) == 0]}
+
+def format_report(report: dict) -> str:
+    lines = [f"{'at':>8} {'event':<24} {'pairs':>6} {'lost':>7} {'window':>8} {'reconverged':>12}"]
+    for e in report["events"]:
+        at = "-" if e["at"] is None else f"{e['at']:.2f}s"
+        reconverged = "-" if e["reconvergence"] is None or e["pairs"] == 0 else f"{e['reconvergence']:.3f}s"
+        if e["unrecovered"] != 0:
+            reconverged = f"{e['unrecovered']} never"
+        lines.append(f"{at:>8} {(e['action'] + ' ' + e['target'])[:24]:<24} {e['pairs']:>6} {e['lost']:>7} "
+                     f"{e['loss_window']:>7.3f}s {reconverged:>12}")
+    if len(report["silent_pairs"]) != 0:
+        lines.append(f"no reply at all: {' '.join(report['silent_pairs'])}")
+    return "\n".join(lines)
+
+def node_targets(glob: str) -> list[str]:
+    import convergence
+    return [name for name in convergence.routers() if fnmatch.fnmatchcase(name, glob)]
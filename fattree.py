@@ -1,22 +1,27 @@
 #!/usr/bin/env python3
 import os
 import sys
-import json
 import dockernet
+import topology
 import traceback
 import ipaddress
 import pathlib
 import shutil
-import subprocess
-
-from next_network import new_network
+import filecmp
+import allocator
+import snapshot
+import instrument
+import liveconfig
+from typing import Iterator
 
 ROUTER_IMAGE = "frrouting/frr"
-HOST_IMAGE = "frrouting/frr"
+HOST_IMAGE = dockernet.NETNS_IMAGE
 DEFAULT_CONFIG = "default_config"
 
 config_dir = pathlib.Path(".config").absolute()
 snapshot_dir = "snapshot"
+# written next to the configs it points at.
+TOPO_FILE = str(config_dir / "fattree.json")
 
 neighbor_config = "  neighbor {neighbor} remote-as {remote_as}"
 network_config = "  network {network}"
@@ -52,265 +57,251 @@ router bgp {private_asn}
 !
 {networks}"""
 AS_START = 0
-
-def fattree(num_pods: int, num_leafs_per_pod: int, config_only: bool = False):
-    if not config_only:
-        dockernet.clean_networks()
-
-    if config_dir.exists():
-        shutil.rmtree(str(config_dir))
-    if pathlib.Path(snapshot_dir).exists():
-        shutil.rmtree(snapshot_dir)
-
-    pathlib.Path(os.path.join(snapshot_dir, "configs")).mkdir(exist_ok=True, parents=True)
-    pathlib.Path(os.path.join(snapshot_dir, "hosts")).mkdir(exist_ok=True, parents=True)
-
-    # links logical expression
-    links: list[list[str]] = []
-    ip_addresses: dict[str, dict[str, ipaddress.IPv4Interface]] = {}
-
-
-    # create logical links: spine - leaf
-
-    network_spine_leaf = ipaddress.ip_network("10.0.0.0/10")
-    subnet_iter = network_spine_leaf.subnets(new_prefix=30)
-    
-    for cluster in range(num_leafs_per_pod):
+SPINE_LEAF_NETWORK = "10.0.0.0/10"
+LEAF_RACK_NETWORK = "10.64.0.0/10"
+HOST_NETWORK = "10.128.0.0/9"
+LINK_PREFIXLEN = 30
+# node globs of each tier's links, for per-tier netem profiles, e.g.
+# fattree(2, 2, profiles={"spine-leaf": {"delay": "1ms", "rate": "10gbit"}})
+TIERS = {
+    "spine-leaf": ["rs*", "rl*"],
+    "leaf-rack": ["rl*", "rr*"],
+    "rack-host": ["rr*", "h*"],
+}
+
+def share_defaults(device_config: pathlib.Path):
+    # unchanged files such as `daemons` are copied from DEFAULT_CONFIG, and only when they
+    # differ. Not hardlinked: the FRR entrypoint chowns /etc/frr, and a write in one router
+    # would reach every other router and the checkout.
+    for default in pathlib.Path(DEFAULT_CONFIG).iterdir():
+        target = device_config / default.name
+        if target.exists() and not os.path.samefile(default, target) and filecmp.cmp(default, target, shallow=False):
+            continue
+        target.unlink(missing_ok=True)
+        shutil.copyfile(default, target)
+
+def write_configs(configs: dict[str, str]) -> int:
+    # only files whose content hash differs from the previous run are written; files and
+    # device directories the previous run produced but this one does not are removed.
+    config_dir.mkdir(parents=True, exist_ok=True)
+    hashes = snapshot.load_manifest(config_dir)
+    new_hashes: dict[str, str] = {}
+    written = 0
+    for device, config in configs.items():
+        device_config = config_dir / device
+        device_config.mkdir(parents=True, exist_ok=True)
+        share_defaults(device_config)
+        written += snapshot.write_if_changed(device_config / "bgpd.conf", config, hashes, new_hashes)
+
+    for path in hashes.keys() - new_hashes.keys():
+        pathlib.Path(path).unlink(missing_ok=True)
+    for entry in config_dir.iterdir():
+        if entry.is_dir() and entry.name not in configs:
+            shutil.rmtree(entry)
+    snapshot.save_manifest(config_dir, new_hashes)
+    print(f"configs: {written} of {len(new_hashes)} files written")
+    return written
+
+def render_interfaces(addresses: list[tuple[str, ipaddress.IPv4Interface]]) -> tuple[str, str]:
+    ifaces = [interface_config.format(iface_name=iface, ip_address=ip.ip, subnet_mask=ip.netmask) for iface, ip in addresses]
+    networks = [network_config.format(network=str(ip.network)) for _iface, ip in addresses]
+    return '\n'.join(ifaces), '\n'.join(networks)
+
+class Fabric:
+    # every address is a function of the link's position in the fabric, so links, hosts
+    # and configs are generated on demand instead of being collected in memory first.
+    def __init__(self, num_pods: int, num_leafs_per_pod: int):
+        self.num_pods = num_pods
+        self.num_leafs_per_pod = num_leafs_per_pod
+        # every /30 is allocated up front, so an undersized range fails before anything is torn down.
+        self.spine_leaf = allocator.SubnetPool(SPINE_LEAF_NETWORK, LINK_PREFIXLEN)
+        self.leaf_rack = allocator.SubnetPool(LEAF_RACK_NETWORK, LINK_PREFIXLEN)
+        self.rack_host = allocator.SubnetPool(HOST_NETWORK, LINK_PREFIXLEN)
+        self.spine_leaf_subnets = self.spine_leaf.allocate_many(num_leafs_per_pod * num_pods * num_pods)
+        self.leaf_rack_subnets = self.leaf_rack.allocate_many(num_pods * num_leafs_per_pod * num_leafs_per_pod)
+        self.rack_host_subnets = self.rack_host.allocate_many(num_pods * num_leafs_per_pod)
+
+    def spine_leaf_ips(self, cluster: int, pod: int, i: int) -> tuple[ipaddress.IPv4Interface, ipaddress.IPv4Interface]:
+        # rs{cluster * num_pods + i} eth{pod} <-> rl{pod * num_leafs_per_pod + cluster} eth{i}
+        return self.spine_leaf.p2p(self.spine_leaf_subnets[(cluster * self.num_pods + pod) * self.num_pods + i])
+
+    def leaf_rack_ips(self, pod: int, leaf: int, rack: int) -> tuple[ipaddress.IPv4Interface, ipaddress.IPv4Interface]:
+        # rl{pod * num_leafs_per_pod + leaf} eth{num_pods + rack} <-> rr{pod * num_leafs_per_pod + rack} eth{leaf}
+        return self.leaf_rack.p2p(self.leaf_rack_subnets[(pod * self.num_leafs_per_pod + leaf) * self.num_leafs_per_pod + rack])
+
+    def rack_host_ips(self, i: int) -> tuple[ipaddress.IPv4Interface, ipaddress.IPv4Interface]:
+        # rr{i} eth{num_leafs_per_pod} <-> h{i} eth0
+        return self.rack_host.p2p(self.rack_host_subnets[i])
+
+    def links(self) -> Iterator[list[str]]:
+        num_pods, num_leafs_per_pod = self.num_pods, self.num_leafs_per_pod
+        # spine - leaf
+        for cluster in range(num_leafs_per_pod):
+            for pod in range(num_pods):
+                for i in range(num_pods):
+                    ip_spine, ip_leaf = self.spine_leaf_ips(cluster, pod, i)
+                    yield [f"rs{cluster * num_pods + i}", f"eth{pod}", f"rl{pod * num_leafs_per_pod + cluster}", f"eth{i}", str(ip_spine), str(ip_leaf)]
+        # leaf - rack
         for pod in range(num_pods):
-            leaf_device = f"rl{pod * num_leafs_per_pod + cluster}"
-            ip_addresses[leaf_device] = {}
-            for i in range(num_pods):
-                spine_device = f"rs{cluster * num_pods + i}"
-                if pod == 0:
-                    ip_addresses[spine_device] = {}
-
-                subnet = next(subnet_iter)
-                iter = subnet.hosts()
-
-                ip_spine = ipaddress.ip_interface((next(iter), subnet.prefixlen))
-                ip_leaf = ipaddress.ip_interface((next(iter), subnet.prefixlen))
-                ip_addresses[spine_device][f"eth{pod}"] = ip_spine
-                ip_addresses[leaf_device][f"eth{i}"] = ip_leaf
-                links.append([spine_device, f"eth{pod}", leaf_device, f"eth{i}", str(ip_spine), str(ip_leaf)])
-
-
-    # create logical links: leaf - rack
-
-    network_leaf_rack = ipaddress.ip_network("10.64.0.0/10")
-    subnet_iter = network_leaf_rack.subnets(new_prefix=30)
-
-    for pod in range(num_pods):
-        for leaf in range(num_leafs_per_pod):
-            leaf_device = f"rl{pod * num_leafs_per_pod + leaf}"
-            for rack in range(num_leafs_per_pod):
-                rack_device = f"rr{pod * num_leafs_per_pod + rack}"
-                if leaf == 0:
-                    ip_addresses[rack_device] = {}
-
-                subnet = next(subnet_iter)
-                iter = subnet.hosts()
-                ip_leaf = ipaddress.ip_interface((next(iter), subnet.prefixlen))
-                ip_rack = ipaddress.ip_interface((next(iter), subnet.prefixlen))
-                ip_addresses[leaf_device][f"eth{num_pods + rack}"] = ip_leaf
-                ip_addresses[rack_device][f"eth{leaf}"] = ip_rack
-
-                links.append([leaf_device, f"eth{num_pods + rack}", rack_device, f"eth{leaf}", str(ip_leaf), str(ip_rack)])
-    # create logical links: rack - host
-
-    host_network = ipaddress.ip_network("10.128.0.0/9")
-    subnet_iter = host_network.subnets(new_prefix=30)
-    for i in range(num_pods * num_leafs_per_pod):
-        if not config_only:
-            dockernet.create_host(f"h{i}", HOST_IMAGE, "none")
-        subnet = next(subnet_iter)
-        iter = subnet.hosts()
-        ip_rack = ipaddress.ip_interface((next(iter), subnet.prefixlen))
-        ip_host = ipaddress.ip_interface((next(iter), subnet.prefixlen))
-        ip_addresses[f"rr{i}"][f"eth{num_leafs_per_pod}"] = ip_rack
-        links.append([f"rr{i}", f"eth{num_leafs_per_pod}", f"h{i}", "eth0", str(ip_rack), str(ip_host)])
-
-        # host config for batfish
-        host_config = {
-            "hostname": f"h{i}",
-            "hostInterfaces": {
-                "eth0": {
-                    "name": "eth0",
-                    "prefix": str(ip_host),
-                    "gateway": str(ip_rack.ip)
+            for leaf in range(num_leafs_per_pod):
+                for rack in range(num_leafs_per_pod):
+                    ip_leaf, ip_rack = self.leaf_rack_ips(pod, leaf, rack)
+                    yield [f"rl{pod * num_leafs_per_pod + leaf}", f"eth{num_pods + rack}", f"rr{pod * num_leafs_per_pod + rack}", f"eth{leaf}", str(ip_leaf), str(ip_rack)]
+        # rack - host
+        for i in range(num_pods * num_leafs_per_pod):
+            ip_rack, ip_host = self.rack_host_ips(i)
+            yield [f"rr{i}", f"eth{num_leafs_per_pod}", f"h{i}", "eth0", str(ip_rack), str(ip_host)]
+
+    def hosts(self) -> Iterator[tuple[str, dict]]:
+        # host configs for batfish
+        for i in range(self.num_pods * self.num_leafs_per_pod):
+            ip_rack, ip_host = self.rack_host_ips(i)
+            yield f"h{i}", {
+                "hostname": f"h{i}",
+                "hostInterfaces": {
+                    "eth0": {
+                        "name": "eth0",
+                        "prefix": str(ip_host),
+                        "gateway": str(ip_rack.ip)
+                    }
                 }
             }
-        }
-        with open(os.path.join(snapshot_dir, f"hosts/h{i}.json"), "w") as f:
-            json.dump(host_config, f)
 
-    # create spine devices and their configs
-    config_dir.mkdir(parents=True, exist_ok=True)
-    
-    topo_config = {
-        "edges": [
-            {
-                "node1": {
-                    "hostname": i[0],
-                    "interfaceName": i[1]
-                }, "node2": {
-                    "hostname": i[2],
-                    "interfaceName": i[3]
-                }
-            } for i in links
-        ]
-    }
-
-    with open(os.path.join(snapshot_dir, "topo.json"), "w") as f:
-        json.dump(topo_config, f)
-
-    for cluster in range(num_leafs_per_pod):
+    def configs(self) -> Iterator[tuple[str, str]]:
+        num_pods, num_leafs_per_pod = self.num_pods, self.num_leafs_per_pod
+        private_as_start = AS_START + num_leafs_per_pod + num_pods
+        private_as_start_rack = private_as_start + num_leafs_per_pod * num_pods
+
+        # spine devices
+        for cluster in range(num_leafs_per_pod):
+            for pod in range(num_pods):
+                addresses = [(f"eth{i}", self.spine_leaf_ips(cluster, i, pod)[0]) for i in range(num_pods)]
+                neighbors = [neighbor_config.format(neighbor=str(self.spine_leaf_ips(cluster, i, pod)[1].ip), remote_as=str(AS_START + num_leafs_per_pod + i))
+                             for i in range(num_pods)]
+                ifaces, networks = render_interfaces(addresses)
+                yield f"rs{cluster * num_pods + pod}", router_config.format(
+                    interfaces=ifaces,
+                    asn=AS_START + cluster,
+                    router_ip=str(addresses[0][1].ip),
+                    neighbors='\n'.join(neighbors),
+                    networks=networks)
+
+        # leaf devices, bgp with confederation
         for pod in range(num_pods):
-            device = f"rs{cluster * num_pods + pod}"
-            device_config = str(os.path.join(str(config_dir), device))
-            subprocess.run(["cp", "-r", DEFAULT_CONFIG, device_config])
-            # create bgp config
-            neighbors: list[str] = []
-            networks: list[str] = []
-            ifaces: list[str] = []
-            for i in range(num_pods):
-                leaf_device = f"rl{i * num_leafs_per_pod + cluster}"
-                neighbors.append(neighbor_config.format(neighbor=str(ip_addresses[leaf_device][f"eth{pod}"].ip), remote_as=str(AS_START + num_leafs_per_pod + i)))
-
-            for iface in ip_addresses[device]:
-                ip = ip_addresses[device][iface]
-                networks.append(network_config.format(network=str(ip.network)))
-                ifaces.append(interface_config.format(iface_name=iface, ip_address=ip.ip, subnet_mask=ip.netmask))
-            
-            config = router_config.format(
-                interfaces='\n'.join(ifaces),
-                asn=AS_START + cluster,
-                router_ip=str(ip_addresses[device]["eth0"].ip),
-                neighbors='\n'.join(neighbors),
-                networks='\n'.join(networks))
-
-            with open(os.path.join(device_config, "bgpd.conf"), "w") as f:
-                f.write(config)
-
-            with open(os.path.join(snapshot_dir, f"configs/{device}.cfg"), "w") as f:
-                f.write(config)
-
-            if not config_only:
-                dockernet.create_device(device, ROUTER_IMAGE, "none", "-v", f"{device_config}:/etc/frr") # spine
-
-    # create leaf devices and their configs
-    private_as_start = AS_START + num_leafs_per_pod + num_pods
-    private_as_start_rack = private_as_start + num_leafs_per_pod * num_pods
-
-    for pod in range(num_pods):
-        for leaf in range(num_leafs_per_pod):
-            device = f"rl{pod * num_leafs_per_pod + leaf}"
-            device_config = str(os.path.join(str(config_dir), device))
-            subprocess.run(["cp", "-r", DEFAULT_CONFIG, device_config])
-            # create bgp config with confederation
-            neighbors: list[str] = []
-            networks: list[str] = []
-            ifaces: list[str] = []
-            confed_peers: list[str] = []
-            # north bound
-            for i in range(num_pods):
-                spine_device = f"rs{leaf * num_pods + i}"
-                neighbors.append(neighbor_config.format(neighbor=str(ip_addresses[spine_device][f"eth{pod}"].ip), remote_as=str(AS_START + leaf)))
-
-
-            # south bound
-            for i in range(num_leafs_per_pod):
-                rack_device = f"rr{pod * num_leafs_per_pod + i}"
-                remote_as = str(private_as_start_rack + pod * num_leafs_per_pod + i)
-                neighbors.append(neighbor_config.format(neighbor=str(ip_addresses[rack_device][f"eth{leaf}"].ip), remote_as=remote_as))
-                confed_peers.append(remote_as)
-
-            for iface in ip_addresses[device]:
-                ip = ip_addresses[device][iface]
-                networks.append(network_config.format(network=str(ip.network)))
-                ifaces.append(interface_config.format(iface_name=iface, ip_address=ip.ip, subnet_mask=ip.netmask))
-            
-            config = router_confed_config.format(
-                interfaces='\n'.join(ifaces),
-                private_asn=str(private_as_start + pod * num_leafs_per_pod + leaf),
-                router_ip=str(ip_addresses[device]["eth0"].ip),
-                public_asn=AS_START + num_leafs_per_pod + pod,
-                confed_peers=" ".join(confed_peers),
-                neighbors="\n".join(neighbors),
-                networks="\n".join(networks))
-
-            with open(os.path.join(device_config, "bgpd.conf"), "w") as f:
-                f.write(config)
-
-            with open(os.path.join(snapshot_dir, f"configs/{device}.cfg"), "w") as f:
-                f.write(config)
-
-            if not config_only:
-                dockernet.create_device(device, ROUTER_IMAGE, "none", "-v", f"{device_config}:/etc/frr") # spine
-
-    # create rack devices and their configs
-    for pod in range(num_pods):
-        for leaf in range(num_leafs_per_pod):
-            device = f"rr{pod * num_leafs_per_pod + leaf}"
-            device_config = str(os.path.join(str(config_dir), device))
-            subprocess.run(["cp", "-r", DEFAULT_CONFIG, device_config])
-
-            # create bgp config with confederation
-            neighbors: list[str] = []
-            networks: list[str] = []
-            confed_peers: list[str] = []
-            ifaces: list[str] = []
-            # north bound
-            for i in range(num_leafs_per_pod):
-                leaf_device = f"rl{pod * num_leafs_per_pod + i}"
-                remote_as = str(private_as_start + pod * num_leafs_per_pod + i)
-                neighbors.append(neighbor_config.format(neighbor=str(ip_addresses[leaf_device][f"eth{num_pods + leaf}"].ip), remote_as=remote_as))
-                confed_peers.append(remote_as)
-
-            for iface in ip_addresses[device]:
-                ip = ip_addresses[device][iface]
-                ifaces.append(interface_config.format(iface_name=iface, ip_address=ip.ip, subnet_mask=ip.netmask))
-                networks.append(network_config.format(network=str(ip.network)))
-            
-            config = router_confed_config.format(
-                interfaces='\n'.join(ifaces),
-                private_asn=str(private_as_start_rack + pod * num_leafs_per_pod + leaf),
-                router_ip=str(ip_addresses[device]["eth0"].ip),
-                public_asn=AS_START + num_leafs_per_pod + pod,
-                confed_peers=" ".join(confed_peers),
-                neighbors="\n".join(neighbors),
-                networks="\n".join(networks))
-
-            with open(os.path.join(device_config, "bgpd.conf"), "w") as f:
-                f.write(config)
-
-            with open(os.path.join(snapshot_dir, f"configs/{device}.cfg"), "w") as f:
-                f.write(config)
-
-            if not config_only:
-                dockernet.create_device(device, ROUTER_IMAGE, "none", "-v", f"{device_config}:/etc/frr") # spine
-
-    if not config_only:
-        for link in links:
-            dockernet.link_device(*link)
+            for leaf in range(num_leafs_per_pod):
+                addresses = [(f"eth{i}", self.spine_leaf_ips(leaf, pod, i)[1]) for i in range(num_pods)]
+                addresses += [(f"eth{num_pods + rack}", self.leaf_rack_ips(pod, leaf, rack)[0]) for rack in range(num_leafs_per_pod)]
+                # north bound
+                neighbors = [neighbor_config.format(neighbor=str(self.spine_leaf_ips(leaf, pod, i)[0].ip), remote_as=str(AS_START + leaf))
+                             for i in range(num_pods)]
+                # south bound
+                confed_peers = [str(private_as_start_rack + pod * num_leafs_per_pod + i) for i in range(num_leafs_per_pod)]
+                neighbors += [neighbor_config.format(neighbor=str(self.leaf_rack_ips(pod, leaf, i)[1].ip), remote_as=confed_peers[i])
+                              for i in range(num_leafs_per_pod)]
+                ifaces, networks = render_interfaces(addresses)
+                yield f"rl{pod * num_leafs_per_pod + leaf}", router_confed_config.format(
+                    interfaces=ifaces,
+                    private_asn=str(private_as_start + pod * num_leafs_per_pod + leaf),
+                    router_ip=str(addresses[0][1].ip),
+                    public_asn=AS_START + num_leafs_per_pod + pod,
+                    confed_peers=" ".join(confed_peers),
+                    neighbors="\n".join(neighbors),
+                    networks=networks)
+
+        # rack devices, bgp with confederation
+        for pod in range(num_pods):
+            for rack in range(num_leafs_per_pod):
+                addresses = [(f"eth{leaf}", self.leaf_rack_ips(pod, leaf, rack)[1]) for leaf in range(num_leafs_per_pod)]
+                addresses.append((f"eth{num_leafs_per_pod}", self.rack_host_ips(pod * num_leafs_per_pod + rack)[0]))
+                # north bound
+                confed_peers = [str(private_as_start + pod * num_leafs_per_pod + i) for i in range(num_leafs_per_pod)]
+                neighbors = [neighbor_config.format(neighbor=str(self.leaf_rack_ips(pod, i, rack)[0].ip), remote_as=confed_peers[i])
+                             for i in range(num_leafs_per_pod)]
+                ifaces, networks = render_interfaces(addresses)
+                yield f"rr{pod * num_leafs_per_pod + rack}", router_confed_config.format(
+                    interfaces=ifaces,
+                    private_asn=str(private_as_start_rack + pod * num_leafs_per_pod + rack),
+                    router_ip=str(addresses[0][1].ip),
+                    public_asn=AS_START + num_leafs_per_pod + pod,
+                    confed_peers=" ".join(confed_peers),
+                    neighbors="\n".join(neighbors),
+                    networks=networks)
+
+def fattree(num_pods: int, num_leafs_per_pod: int, config_only: bool = False, workers: int = dockernet.WORKERS,
+            reconcile: bool = False, snapshot_only: bool = False, profiles: dict[str, dict] | None = None):
+    fabric = Fabric(num_pods, num_leafs_per_pod)
+    if snapshot_only:
+        # streamed straight to disk; nothing is emulated, so docker is never needed.
+        with instrument.span("fattree snapshot", category="phase"):
+            snapshot.export(snapshot_dir, fabric.configs(), fabric.hosts(), fabric.links(), workers)
+        return None
+
+    if not config_only and not reconcile:
+        dockernet.clean_networks()
 
+    with instrument.span("fattree render", category="phase"):
+        configs = dict(fabric.configs())
+        links = list(fabric.links())
+    with instrument.span("fattree write_configs", category="phase"):
+        write_configs(configs)
+    with instrument.span("fattree snapshot", category="phase"):
+        snapshot.export(snapshot_dir, configs.items(), fabric.hosts(), links, workers)
+
+    devices = [{"name": device, "image": ROUTER_IMAGE, "config": str(config_dir / device)} for device in configs]
+    hosts = [{"name": f"h{i}", "image": HOST_IMAGE} for i in range(num_pods * num_leafs_per_pod)]
+    impairments = [{"between": TIERS[tier], **profile} for tier, profile in (profiles or {}).items()]
+    topo = topology.normalize_topo({"devices": devices, "hosts": hosts, "links": links, "impairments": impairments})
+    topology.dump_topo(topo, TOPO_FILE)
+
+    if reconcile and not config_only:
+        topology.reconcile_topo(topo, workers)
+    elif not config_only:
+        topology.apply_topo(topo, workers)
+    return topo
+
+def reconfigure(num_pods: int, num_leafs_per_pod: int, test: bool = False, workers: int = dockernet.WORKERS) -> dict:
+    # render the configs again and push the ones that changed into the running routers.
+    fabric = Fabric(num_pods, num_leafs_per_pod)
+    with instrument.span("fattree render", category="phase"):
+        configs = dict(fabric.configs())
+    previous = {device: (config_dir / device / "bgpd.conf").read_text() if (config_dir / device / "bgpd.conf").exists() else None
+                for device in configs}
+    if any(config is None for config in previous.values()):
+        raise ValueError(f"fabric {num_pods}x{num_leafs_per_pod} is not the one running; use reconcile to change its size")
+    with instrument.span("fattree apply_config", category="phase"):
+        report = liveconfig.apply_config(configs, previous, test, workers)
+    if not test:
+        # a router whose reload failed keeps its old config on disk, so the next apply retries it.
+        failed = {result["router"] for result in report["results"] if not result["ok"]}
+        with instrument.span("fattree write_configs", category="phase"):
+            write_configs({device: previous[device] if device in failed else config for device, config in configs.items()})
+    return report
 
 if __name__ == "__main__":
     num_pods = 2
     num_leafs_per_pod = 2
+    workers = dockernet.WORKERS
 
-    if len(sys.argv) < 2 or sys.argv[1] not in ['run', 'genconfig']:
-        print("Usage: sudo ./fattree.py run|genconfig [NUM_PODS NUM_LEAFS_PER_POD]", file=sys.stderr)
+    if len(sys.argv) < 2 or sys.argv[1] not in ['run', 'reconcile', 'apply', 'genconfig', 'snapshot']:
+        print("Usage: sudo ./fattree.py run|reconcile|apply|genconfig|snapshot [NUM_PODS NUM_LEAFS_PER_POD [WORKERS]]", file=sys.stderr)
         exit(-1)
     
-    if len(sys.argv) == 4:
+    if len(sys.argv) >= 4:
         num_pods = int(sys.argv[2])
         num_leafs_per_pod = int(sys.argv[3])
+    if len(sys.argv) == 5:
+        workers = int(sys.argv[4])
 
-    if sys.argv[1] == 'genconfig':
-        fattree(num_pods, num_leafs_per_pod, config_only=True)
+    if sys.argv[1] in ['genconfig', 'snapshot']:
+        fattree(num_pods, num_leafs_per_pod, workers=workers, config_only=True, snapshot_only=sys.argv[1] == 'snapshot')
         exit(0)
+    if sys.argv[1] == 'apply':
+        # the fabric keeps running, before and after.
+        report = reconfigure(num_pods, num_leafs_per_pod, workers=workers)
+        print(liveconfig.format_report(report))
+        exit(1 if report["failed"] != 0 else 0)
     try:
-        fattree(num_pods, num_leafs_per_pod)
+        fattree(num_pods, num_leafs_per_pod, workers=workers, reconcile=sys.argv[1] == 'reconcile')
     except:
         traceback.print_exc()
     finally:
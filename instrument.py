@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import bisect
+import functools
+import threading
+import contextlib
+import subprocess
+import collections
+
+# Timing for every dockernet operation, subprocess and docker API call. Each finished span
+# updates per-operation counters and a latency histogram, is credited to the node it
+# touched, and is kept for trace export (the most recent MAX_EVENTS only). Nodes are
+# credited with self time, the span less the spans and API calls nested in it on the same
+# thread, so create_device and the docker run inside it do not count twice.
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000]
+MAX_EVENTS = 200000
+TRACE_ENV = "DOCKERNET_TRACE"
+DOCKER_VALUE_OPTIONS = {"-H", "--host", "-c", "--context", "--config", "-l", "--log-level"}
+
+lock = threading.Lock()
+epoch = time.perf_counter()
+events: collections.deque = collections.deque(maxlen=MAX_EVENTS)
+operations: dict[str, dict] = {}
+nodes: dict[str, dict[str, list]] = {}
+# stripped from node names, set by dockernet.
+node_prefix = ""
+# per thread, the time spent in children of every open span.
+local = threading.local()
+
+def open_spans() -> list[float]:
+    if not hasattr(local, "children"):
+        local.children = []
+    return local.children
+
+def record(category: str, name: str, start: float, duration: float, node: str | None = None,
+           self_time: float | None = None):
+    if node is not None:
+        node = os.path.basename(node).removeprefix(node_prefix)
+    with lock:
+        op = operations.get(name)
+        if op is None:
+            op = operations[name] = {"category": category, "count": 0, "total": 0.0, "min": duration, "max": duration,
+                                     "buckets": [0] * (len(BUCKETS_MS) + 1)}
+        op["count"] += 1
+        op["total"] += duration
+        op["min"] = min(op["min"], duration)
+        op["max"] = max(op["max"], duration)
+        op["buckets"][bisect.bisect_left(BUCKETS_MS, duration * 1000)] += 1
+        if node is not None:
+            per_node = nodes.setdefault(node, {}).setdefault(name, [0, 0.0])
+            per_node[0] += 1
+            per_node[1] += duration if self_time is None else self_time
+        events.append((category, name, start, duration, threading.get_ident(), node))
+
+def reset():
+    with lock:
+        events.clear()
+        operations.clear()
+        nodes.clear()
+
+@contextlib.contextmanager
+def span(name: str, node: str | None = None, category: str = "op"):
+    children = open_spans()
+    children.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        nested = children.pop()
+        if len(children) != 0:
+            children[-1] += duration
+        record(category, name, start, duration, node, duration - nested)
+
+def timed(fn):
+    # the first argument of every dockernet operation is the node (or network) it works on.
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        node = args[0] if len(args) != 0 and isinstance(args[0], str) else None
+        with span(fn.__name__, node):
+            return fn(*args, **kwargs)
+    return wrapper
+
+def command_span(cmd: list[str]) -> tuple[str, str | None]:
+    # a stable name for a command line, and the node it runs against.
+    words = [word for word in cmd[1:] if not word.startswith("-")]
+    if cmd[0] == "docker":
+        # global options before the subcommand, e.g. -H for another daemon, take a value.
+        rest = cmd[1:]
+        while len(rest) != 0 and rest[0].startswith("-"):
+            rest = rest[2:] if rest[0] in DOCKER_VALUE_OPTIONS else rest[1:]
+        words = [word for word in rest if not word.startswith("-")]
+        if "--name" in cmd:
+            return f"docker {words[0]}", cmd[cmd.index("--name") + 1]
+        if words[:1] == ["exec"]:
+            if len(words) > 2:
+                # a remote site's agent runs ip for the nodes there; credit the node it names.
+                name, node = command_span(rest[rest.index(words[1]) + 1:])
+                if node is not None:
+                    return name, node
+            return f"docker exec {words[2] if len(words) > 2 else ''}".strip(), words[1] if len(words) > 1 else None
+        if words[:2] == ["network", "connect"]:
+            return "docker network connect", words[-1]
+        return f"docker {words[0] if words else ''}".strip(), None
+    if cmd[0] == "ip":
+        if words[:2] == ["netns", "exec"]:
+            return f"ip netns exec {words[3] if len(words) > 3 else ''}".strip(), words[2] if len(words) > 2 else None
+        if words[:1] == ["netns"]:
+            return f"ip netns {words[1]}", words[2] if len(words) > 2 else None
+        node = cmd[cmd.index("-n") + 1] if "-n" in cmd else None
+        name = "batch" if "-batch" in cmd else " ".join(w for w in words if w != node)
+        return f"ip {name}", node
+    return os.path.basename(cmd[0]), None
+
+def run(cmd: list[str], *args, **kwargs) -> subprocess.CompletedProcess:
+    name, node = command_span(cmd)
+    with span(name, node, "subprocess"):
+        return subprocess.run(cmd, *args, **kwargs)
+
+def api_span(method: str, path: str) -> tuple[str, str | None]:
+    # /v1.44/containers/dn-r1/exec -> "POST containers/{id}/exec", node dn-r1
+    parts = [part for part in path.split("?")[0].split("/") if part != ""]
+    if len(parts) != 0 and parts[0].startswith("v") and parts[0][1:2].isdigit():
+        parts = parts[1:]
+    node = None
+    if len(parts) >= 2 and parts[0] in ["containers", "networks", "exec"] and parts[1] not in ["json", "create", "prune"]:
+        node = parts[1]
+        parts[1] = "{id}"
+    return f"{method} {'/'.join(parts)}", node
+
+def docker_hook(response, *args, **kwargs):
+    # requests response hook: the call is over, and elapsed is how long it took.
+    duration = response.elapsed.total_seconds()
+    name, node = api_span(response.request.method, response.request.path_url)
+    children = open_spans()
+    if len(children) != 0:
+        children[-1] += duration
+    record("api", name, time.perf_counter() - duration, duration, node if node is not None and node.startswith(node_prefix) else None)
+
+def percentile(op: dict, fraction: float) -> float:
+    # upper bound of the histogram bucket the percentile falls in, in seconds.
+    target = op["count"] * fraction
+    seen = 0
+    for i, count in enumerate(op["buckets"]):
+        seen += count
+        if seen >= target and count != 0:
+            return min(op["max"], BUCKETS_MS[i] / 1000) if i < len(BUCKETS_MS) else op["max"]
+    return op["max"]
+
+def summary() -> dict:
+    with lock:
+        ops = {name: dict(op, buckets=list(op["buckets"])) for name, op in operations.items()}
+        per_node = {node: {name: {"count": c, "total": round(t, 6)} for name, (c, t) in names.items()} for node, names in nodes.items()}
+    return {
+        "buckets_ms": BUCKETS_MS,
+        "operations": {name: {
+            "category": op["category"],
+            "count": op["count"],
+            "total": round(op["total"], 6),
+            "mean": round(op["total"] / op["count"], 6),
+            "min": round(op["min"], 6),
+            "max": round(op["max"], 6),
+            "p50": round(percentile(op, 0.5), 6),
+            "p95": round(percentile(op, 0.95), 6),
+            "buckets": op["buckets"],
+        } for name, op in sorted(ops.items(), key=lambda item: -item[1]["total"])},
+        "nodes": per_node,
+    }
+
+def chrome_trace() -> dict:
+    # chrome://tracing and Perfetto "complete" events, in microseconds since import.
+    with lock:
+        recorded = list(events)
+    pid = os.getpid()
+    return {"displayTimeUnit": "ms", "traceEvents": [{
+        "name": name,
+        "cat": category,
+        "ph": "X",
+        "ts": round((start - epoch) * 1e6, 1),
+        "dur": round(duration * 1e6, 1),
+        "pid": pid,
+        "tid": tid,
+        "args": {} if node is None else {"node": node},
+    } for category, name, start, duration, tid, node in recorded]}
+
+def format_table(stats: dict, node: str | None = None) -> str:
+    if node is not None:
+        names = stats["nodes"].get(node, {})
+        lines = [f"{'operation':<32} {'count':>7} {'total':>9}"]
+        for name, op in sorted(names.items(), key=lambda item: -item[1]["total"]):
+            lines.append(f"{name[:32]:<32} {op['count']:>7} {op['total']:>8.3f}s")
+        return "\n".join(lines)
+    lines = [f"{'operation':<32} {'count':>7} {'total':>9} {'mean':>8} {'p50':>8} {'p95':>8} {'max':>8}"]
+    for name, op in stats["operations"].items():
+        lines.append(f"{name[:32]:<32} {op['count']:>7} {op['total']:>8.3f}s" + "".join(
+            f" {op[key] * 1000:>6.1f}ms" for key in ["mean", "p50", "p95", "max"]))
+    return "\n".join(lines)
+
+def slowest_nodes(stats: dict, count: int = 10) -> list[tuple[str, float]]:
+    totals = {node: sum(op["total"] for op in names.values()) for node, names in stats["nodes"].items()}
+    return sorted(totals.items(), key=lambda item: -item[1])[:count]
+
+def export(path: str, fmt: str = "chrome"):
+    with open(path, "w") as f:
+        json.dump(chrome_trace() if fmt == "chrome" else summary(), f)
@@ -0,0 +1,74 @@
+import time
+import difflib
+import pathlib
+import subprocess
+import instrument
+import dockernet
+
+# Pushes new bgpd.conf files into running routers without restarting them. Each router
+# gets one exec that writes the file to /etc/frr (so pooled routers, whose /etc/frr is a
+# copy, see it too) and runs FRR's frr-reload.py on it, which diffs it against the running
+# configuration and sends only the changed lines to bgpd. Routers whose rendered config
+# is the same as the one they run are not touched at all.
+RELOAD = "/usr/lib/frr/frr-reload.py"
+CONFIG_FILE = f"{dockernet.FRR_CONFIG_DIR}/bgpd.conf"
+TIMEOUT = 60
+
+def diff_size(old: str | None, new: str) -> tuple[int, int] | None:
+    # lines added and removed, None when the previous config is unknown.
+    if old is None:
+        return None
+    diff = list(difflib.unified_diff(old.splitlines(), new.splitlines(), lineterm="", n=0))
+    added = sum(1 for line in diff if line.startswith("+") and not line.startswith("+++"))
+    removed = sum(1 for line in diff if line.startswith("-") and not line.startswith("---"))
+    return added, removed
+
+def reload_script(test: bool) -> str:
+    if test:
+        # dry run: print what frr-reload would change, leave the file and bgpd alone.
+        return f"cat > /tmp/bgpd.conf.new && {RELOAD} --test --daemon bgpd /tmp/bgpd.conf.new"
+    # the file is only put in place once bgpd took it, so a failed reload leaves the old one.
+    return (f"cat > {CONFIG_FILE}.new && {RELOAD} --reload --daemon bgpd {CONFIG_FILE}.new"
+            f" && mv {CONFIG_FILE}.new {CONFIG_FILE} || {{ rm -f {CONFIG_FILE}.new; exit 1; }}")
+
+def push_config(name: str, config: str, test: bool = False, timeout: float = TIMEOUT) -> dict:
+    start = time.perf_counter()
+    try:
+        done = instrument.run(dockernet.device_command(name, "sh", "-c", reload_script(test)), input=config,
+                              capture_output=True, text=True, timeout=timeout)
+        ok, output = done.returncode == 0, done.stdout + done.stderr
+    except subprocess.TimeoutExpired:
+        ok, output = False, f"no answer in {timeout}s"
+    return {"router": name, "ok": ok, "seconds": round(time.perf_counter() - start, 3), "output": output.strip()}
+
+def apply_config(configs: dict[str, str], previous: dict[str, str | None] | None = None, test: bool = False,
+                 workers: int = dockernet.WORKERS) -> dict:
+    # previous holds the configs the routers run now; without it every router is pushed
+    # and frr-reload alone decides what changed.
+    previous = previous or {}
+    changed = [name for name, config in configs.items() if previous.get(name) != config]
+    start = time.perf_counter()
+    results = dockernet.run_map(lambda name: push_config(name, configs[name], test), changed, workers)
+    for result in results:
+        result["diff"] = diff_size(previous.get(result["router"]), configs[result["router"]])
+    elapsed = time.perf_counter() - start
+    failed = [result for result in results if not result["ok"]]
+    print(f"{'checked' if test else 'applied'} {len(changed) - len(failed)} of {len(changed)} changed configs "
+          f"({len(configs) - len(changed)} unchanged) in {elapsed:.2f}s")
+    return {"test": test, "routers": len(configs), "changed": len(changed), "failed": len(failed),
+            "seconds": round(elapsed, 3), "results": results}
+
+def format_report(report: dict, verbose: bool = False) -> str:
+    lines = []
+    for result in sorted(report["results"], key=lambda result: -result["seconds"]):
+        diff = "" if result["diff"] is None else f" +{result['diff'][0]} -{result['diff'][1]} lines"
+        lines.append(f"{result['router']:<10} {result['seconds']:>7.2f}s {'ok' if result['ok'] else 'FAILED'}{diff}")
+        if verbose or not result["ok"]:
+            lines += [f"    {line}" for line in result["output"].splitlines()]
+    return "\n".join(lines)
+
+def topo_configs(topo: dict, names: list[str] | None = None) -> dict[str, str]:
+    # the bgpd.conf of every device of a topology that has a config directory.
+    return {device["name"]: pathlib.Path(device["config"], "bgpd.conf").read_text() for device in topo["devices"]
+            if "config" in device and (names is None or device["name"] in names)
+            and pathlib.Path(device["config"], "bgpd.conf").exists()}
@@ -0,0 +1,331 @@
+import contextlib
+import ctypes
+import errno
+import ipaddress
+import json
+import os
+import subprocess
+import instrument
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from pyroute2 import IPRoute
+    from pyroute2.netlink.exceptions import NetlinkError
+except ImportError:
+    IPRoute = None
+
+# netlink is used in-process when pyroute2 is installed, otherwise every
+# namespace gets a single `ip -batch` invocation.
+BACKEND = "ip" if IPRoute is None else "netlink"
+NETNS_DIR = "/var/run/netns"
+CLONE_NEWNET = 0x40000000
+
+# open namespace descriptors by netns name; dockernet registers container
+# namespaces here straight from their pid, the rest are opened on first use.
+netns_fds: dict[str, int] = {}
+netns_lock = threading.Lock()
+libc = ctypes.CDLL(None, use_errno=True)
+
+def setns(fd: int):
+    if hasattr(os, "setns"):
+        os.setns(fd, CLONE_NEWNET)
+    elif libc.setns(fd, CLONE_NEWNET) != 0:
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code))
+
+def remember(netns: str, fd: int):
+    with netns_lock:
+        old = netns_fds.pop(netns, None)
+        netns_fds[netns] = fd
+    if old is not None:
+        os.close(old)
+
+def forget(netns: str):
+    with netns_lock:
+        fd = netns_fds.pop(netns, None)
+    if fd is not None:
+        os.close(fd)
+
+def netns_fd(netns: str) -> int:
+    with netns_lock:
+        if netns not in netns_fds:
+            netns_fds[netns] = os.open(f"{NETNS_DIR}/{netns}", os.O_RDONLY)
+        return netns_fds[netns]
+
+@contextlib.contextmanager
+def in_netns(netns: str):
+    # switches only the calling thread, which is restored before returning.
+    own = os.open("/proc/thread-self/ns/net", os.O_RDONLY)
+    try:
+        setns(netns_fd(netns))
+        yield
+    finally:
+        setns(own)
+        os.close(own)
+
+def open_netns(netns: str):
+    # a netlink socket keeps the namespace it was created in.
+    with in_netns(netns):
+        return IPRoute()
+
+# cut links of a partitioned topology are VXLAN tunnels, one VNI per link.
+VXLAN_PORT = 4789
+
+class LinkBatch:
+    def __init__(self, via: list[str] | None = None):
+        self.veths: list[tuple[str, str, str, str]] = []
+        self.tunnels: dict[str | None, list[tuple[str, str, int, str, str]]] = {}
+        self.ops: dict[str, list[tuple[str, ...]]] = {}
+        self.removals: dict[str, list[str]] = {}
+        self.qdiscs: dict[str, list[tuple[str, dict | None]]] = {}
+        # command prefix that runs ip and tc on another machine (e.g. docker exec into an agent
+        # there); such a batch is always scripted, as netlink sockets cannot leave this kernel.
+        self.via = via
+        self.scripted = via is not None or BACKEND == "ip"
+
+    def _queue(self, netns: str, *op: str):
+        self.ops.setdefault(netns, []).append(op)
+
+    def veth(self, netns1: str, if1: str, netns2: str, if2: str):
+        self.veths.append((netns1, if1, netns2, if2))
+
+    def tunnel(self, underlay: str | None, netns: str, ifname: str, vni: int, local: str, remote: str):
+        # a VXLAN end is created in the underlay namespace (None: the machine's own), which keeps
+        # carrying its traffic after the device moves into netns as ifname.
+        self.tunnels.setdefault(underlay, []).append((netns, ifname, vni, local, remote))
+
+    def delete(self, netns: str, ifname: str):
+        self.removals.setdefault(netns, []).append(ifname)
+
+    def up(self, netns: str, ifname: str, alias: str | None = None):
+        # the alias names the peer end so a later reconcile can tell how links are wired.
+        self._queue(netns, "up", ifname, *([] if alias is None else [alias]))
+
+    def down(self, netns: str, ifname: str):
+        self._queue(netns, "down", ifname)
+
+    def addr(self, netns: str, ifname: str, address: str):
+        self._queue(netns, "addr", ifname, address)
+
+    def unaddr(self, netns: str, ifname: str, address: str):
+        self._queue(netns, "unaddr", ifname, address)
+
+    def route(self, netns: str, gateway: str):
+        self._queue(netns, "route", gateway)
+
+    def impair(self, netns: str, ifname: str, profile: dict | None):
+        # a netem profile (delay, jitter, loss, rate) for the egress of ifname; None removes it.
+        self.qdiscs.setdefault(netns, []).append((ifname, profile))
+
+    def namespaces(self) -> list[str]:
+        return list(dict.fromkeys([*self.ops, *self.qdiscs]))
+
+    def commit(self, workers: int = 1):
+        # stale links go first, and all veths must exist before any namespace configures its ends.
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            list(pool.map(self.commit_removals, list(self.removals)))
+            self.commit_veths()
+            list(pool.map(self.commit_namespace, self.namespaces()))
+
+    def commit_removals(self, netns: str):
+        with instrument.span("commit_removals", netns, BACKEND):
+            self._commit_removals(netns)
+
+    def _commit_removals(self, netns: str):
+        # removing one end of a veth removes its peer, so missing devices are not an error.
+        ifnames = self.removals.get(netns, [])
+        if self.scripted:
+            _ip_batch(netns, [f"link del dev {ifname}" for ifname in ifnames], check=False, via=self.via)
+            return
+        handle = open_netns(netns)
+        try:
+            for ifname in ifnames:
+                for index in handle.link_lookup(ifname=ifname):
+                    try:
+                        handle.link("del", index=index)
+                    except NetlinkError as e:
+                        if e.code != errno.ENODEV:
+                            raise
+        finally:
+            handle.close()
+
+    def commit_veths(self):
+        if len(self.tunnels) != 0:
+            with instrument.span("commit_tunnels", category="ip"):
+                for underlay, tunnels in self.tunnels.items():
+                    _ip_batch(underlay, [line for netns, ifname, vni, local, remote in tunnels for line in [
+                        f"link add dnvx{vni} type vxlan id {vni} local {local} remote {remote} dstport {VXLAN_PORT}",
+                        f"link set dnvx{vni} netns {netns} name {ifname}",
+                    ]], via=self.via)
+        if len(self.veths) == 0:
+            return
+        with instrument.span("commit_veths", category=BACKEND):
+            self._commit_veths()
+
+    def _commit_veths(self):
+        if self.scripted:
+            _ip_batch(None, [f"link add name {if1} netns {ns1} type veth peer name {if2} netns {ns2}"
+                             for ns1, if1, ns2, if2 in self.veths], via=self.via)
+            return
+        handles: dict[str, IPRoute] = {}
+        try:
+            for ns1, if1, ns2, if2 in self.veths:
+                if ns1 not in handles:
+                    handles[ns1] = open_netns(ns1)
+                handles[ns1].link("add", ifname=if1, kind="veth", peer={"ifname": if2, "net_ns_fd": netns_fd(ns2)})
+        finally:
+            for handle in handles.values():
+                handle.close()
+
+    def commit_namespace(self, netns: str):
+        with instrument.span("commit_namespace", netns, BACKEND):
+            self._commit_namespace(netns)
+
+    def _commit_namespace(self, netns: str):
+        ops = self.ops.get(netns, [])
+        if self.scripted:
+            if len(ops) != 0:
+                _ip_batch(netns, [_ip_line(op) for op in ops], via=self.via)
+        elif len(ops) != 0:
+            handle = open_netns(netns)
+            try:
+                _netlink_apply(handle, ops)
+            finally:
+                handle.close()
+        self.commit_qdiscs(netns)
+
+    def commit_qdiscs(self, netns: str):
+        # netem is configured with one `tc -batch` per namespace whatever the backend;
+        # removing a qdisc that is not there is not an error.
+        qdiscs = self.qdiscs.get(netns, [])
+        removals = [f"qdisc del dev {ifname} root" for ifname, profile in qdiscs if profile is None]
+        changes = [_tc_line(ifname, profile) for ifname, profile in qdiscs if profile is not None]
+        if len(removals) != 0:
+            _tc_batch(netns, removals, check=False, via=self.via)
+        if len(changes) != 0:
+            _tc_batch(netns, changes, via=self.via)
+
+def _ip_line(op: tuple[str, ...]) -> str:
+    if op[0] == "up":
+        return f"link set dev {op[1]} up" + (f" alias {op[2]}" if len(op) == 3 else "")
+    if op[0] == "down":
+        return f"link set dev {op[1]} down"
+    if op[0] == "addr":
+        return f"addr add {op[2]} dev {op[1]}"
+    if op[0] == "unaddr":
+        return f"addr del {op[2]} dev {op[1]}"
+    return f"route replace default via {op[1]}"
+
+NETEM_KEYS = ["delay", "jitter", "loss", "rate"]
+
+def netem_args(profile: dict) -> list[str]:
+    unknown = set(profile) - set(NETEM_KEYS)
+    if len(unknown) != 0:
+        raise ValueError(f"unknown netem settings {sorted(unknown)}")
+    args = []
+    if profile.get("delay") is not None:
+        args += ["delay", str(profile["delay"])] + ([str(profile["jitter"])] if profile.get("jitter") is not None else [])
+    if profile.get("loss") is not None:
+        args += ["loss", str(profile["loss"])]
+    if profile.get("rate") is not None:
+        args += ["rate", str(profile["rate"])]
+    return args
+
+def _tc_line(ifname: str, profile: dict) -> str:
+    return f"qdisc replace dev {ifname} root netem {' '.join(netem_args(profile))}"
+
+def _tc_batch(netns: str, lines: list[str], check: bool = True, via: list[str] | None = None):
+    instrument.run([*(via or []), "tc", "-n", netns, "-force", "-batch", "-"], input="\n".join(lines) + "\n", text=True,
+                   check=check, stderr=None if check else subprocess.DEVNULL)
+
+def _ip_batch(netns: str | None, lines: list[str], check: bool = True, via: list[str] | None = None):
+    netns_args = [] if netns is None else ["-n", netns]
+    instrument.run([*(via or []), "ip", *netns_args, "-force", "-batch", "-"], input="\n".join(lines) + "\n", text=True,
+                   check=check, stderr=None if check else subprocess.DEVNULL)
+
+def _netlink_apply(handle, ops: list[tuple[str, ...]]):
+    for op in ops:
+        if op[0] == "route":
+            gateway = ipaddress.ip_address(op[1])
+            handle.route("replace", dst="0.0.0.0/0" if gateway.version == 4 else "::/0", gateway=str(gateway))
+            continue
+        index = handle.link_lookup(ifname=op[1])[0]
+        if op[0] == "up":
+            handle.link("set", index=index, state="up", **({"ifalias": op[2]} if len(op) == 3 else {}))
+        elif op[0] == "down":
+            handle.link("set", index=index, state="down")
+        else:
+            intf = ipaddress.ip_interface(op[2])
+            handle.addr("add" if op[0] == "addr" else "del", index=index, address=str(intf.ip), prefixlen=intf.network.prefixlen)
+
+def interfaces(netns: str) -> dict[str, dict]:
+    # every interface but lo, with its alias, whether it is a veth, its root qdisc and its global addresses.
+    result: dict[str, dict] = {}
+    if BACKEND == "ip":
+        output = instrument.run(["ip", "-j", "-d", "-n", netns, "addr", "show"], capture_output=True, text=True, check=True).stdout
+        for link in json.loads(output):
+            if link["ifname"] == "lo":
+                continue
+            result[link["ifname"]] = {
+                "alias": link.get("ifalias"),
+                "veth": link.get("linkinfo", {}).get("info_kind") == "veth",
+                "qdisc": link.get("qdisc"),
+                "addresses": {f"{a['local']}/{a['prefixlen']}" for a in link.get("addr_info", []) if a.get("scope") == "global"},
+            }
+        return result
+    handle = open_netns(netns)
+    try:
+        by_index: dict[int, dict] = {}
+        for link in handle.get_links():
+            ifname = link.get_attr("IFLA_IFNAME")
+            if ifname == "lo":
+                continue
+            linkinfo = link.get_attr("IFLA_LINKINFO")
+            by_index[link["index"]] = result[ifname] = {
+                "alias": link.get_attr("IFLA_IFALIAS"),
+                "veth": linkinfo is not None and linkinfo.get_attr("IFLA_INFO_KIND") == "veth",
+                "qdisc": link.get_attr("IFLA_QDISC"),
+                "addresses": set(),
+            }
+        for addr in handle.get_addr():
+            if addr["index"] in by_index and addr["scope"] == 0:
+                by_index[addr["index"]]["addresses"].add(f"{addr.get_attr('IFA_ADDRESS')}/{addr['prefixlen']}")
+    finally:
+        handle.close()
+    return result
+
+def counters(netns: str) -> dict[str, dict]:
+    # byte and packet counters of every interface but lo, with its alias (the peer end of a veth).
+    result: dict[str, dict] = {}
+    if BACKEND == "ip":
+        output = instrument.run(["ip", "-j", "-s", "-n", netns, "link", "show"], capture_output=True, text=True, check=True).stdout
+        for link in json.loads(output):
+            if link["ifname"] == "lo":
+                continue
+            stats = link.get("stats64", {})
+            result[link["ifname"]] = {
+                "alias": link.get("ifalias"),
+                "tx_bytes": stats.get("tx", {}).get("bytes", 0),
+                "rx_bytes": stats.get("rx", {}).get("bytes", 0),
+                "tx_packets": stats.get("tx", {}).get("packets", 0),
+                "rx_packets": stats.get("rx", {}).get("packets", 0),
+            }
+        return result
+    handle = open_netns(netns)
+    try:
+        for link in handle.get_links():
+            ifname = link.get_attr("IFLA_IFNAME")
+            if ifname == "lo":
+                continue
+            stats = link.get_attr("IFLA_STATS64") or {}
+            result[ifname] = {
+                "alias": link.get_attr("IFLA_IFALIAS"),
+                "tx_bytes": stats.get("tx_bytes", 0),
+                "rx_bytes": stats.get("rx_bytes", 0),
+                "tx_packets": stats.get("tx_packets", 0),
+                "rx_packets": stats.get("rx_packets", 0),
+            }
+    finally:
+        handle.close()
+    return result
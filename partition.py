@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+import sys
+import json
+import math
+import heapq
+import pathlib
+import ipaddress
+import traceback
+import collections
+import subprocess
+import docker
+import instrument
+import netlink
+import store
+import dockernet
+import topology
+
+# Partitioned emulation: the nodes of a topology are placed on several docker daemons
+# ("sites"), and links whose ends land on different sites become VXLAN tunnels between
+# the sites' underlay addresses. A sites file is JSON:
+# {"sites": [
+#   {"name": "a", "address": "10.99.0.1", "underlay": "site-a"},
+#   {"name": "b", "address": "10.99.0.2", "underlay": "site-b", "docker_host": "unix:///run/docker-b.sock"},
+#   {"name": "c", "address": "10.99.0.3", "docker_host": "tcp://10.99.0.3:2375", "remote": true, "weight": 2}]}
+# A site without docker_host uses the default daemon. A daemon on this machine shares its
+# kernel, so its namespaces are set up like any other; a remote site gets a privileged
+# agent container (host pid and network) that runs every ip and tc command for it, and
+# the config directories of its routers must exist at the same path there. underlay
+# names a namespace (dnul-<underlay>) standing in for the site's machine: its tunnel ends
+# start there instead of in the machine's own namespace. Missing stand-ins are created,
+# all on one bridge, so a partitioned topology can be tried on a single machine.
+# Nodes on docker networks stay on the first site, as networks exist on one daemon only.
+# A fattree is partitioned from the .config/fattree.json that `fattree.py genconfig` writes.
+AGENT = "agent"
+AGENT_IMAGE = "nicolaka/netshoot"
+VNI_BASE = 1000
+# how far a site may grow beyond its share of nodes to cut fewer links.
+BALANCE = 0.05
+PASSES = 10
+UNDERLAY_BRIDGE = "underlay"
+# not PREFIX, so running_nodes() does not take stand-ins for nodes.
+STANDIN_PREFIX = "dnul-"
+STANDIN_PREFIXLEN = 24
+SITE_KEYS = {"name", "address", "docker_host", "underlay", "remote", "weight"}
+
+sites: dict[str, dict] = {}
+clients: dict[str, docker.DockerClient] = {}
+
+def load_sites(path: str) -> list[dict]:
+    with open(path) as f:
+        raw = json.load(f)["sites"]
+    result = []
+    for site in raw:
+        unknown = set(site) - SITE_KEYS
+        if len(unknown) != 0:
+            raise ValueError(f"site {site.get('name')}: unknown keys {sorted(unknown)}")
+        address = str(site["address"])
+        docker_cli = ["docker", *(["-H", site["docker_host"]] if site.get("docker_host") else [])]
+        remote = bool(site.get("remote", False))
+        result.append({
+            "name": site["name"],
+            "address": str(ipaddress.ip_interface(address).ip),
+            "interface": str(ipaddress.ip_interface(address if "/" in address else f"{address}/{STANDIN_PREFIXLEN}")),
+            "docker_host": site.get("docker_host"),
+            "underlay": None if site.get("underlay") is None else STANDIN_PREFIX + site["underlay"],
+            "remote": remote,
+            "weight": float(site.get("weight", 1)),
+            "docker": docker_cli,
+            "via": [*docker_cli, "exec", "-i", dockernet.PREFIX + AGENT] if remote else None,
+        })
+    names = [site["name"] for site in result]
+    addresses = [site["address"] for site in result]
+    if len(result) == 0 or len(set(names)) != len(names) or len(set(addresses)) != len(addresses):
+        raise ValueError("sites need distinct names and addresses")
+    if any(site["remote"] and site["docker_host"] is None for site in result):
+        raise ValueError("a remote site needs its docker_host")
+    # sites on this machine share its root namespace, where tunnel ends of the same VNI collide.
+    local = [site["underlay"] for site in result if not site["remote"]]
+    named = [underlay for underlay in local if underlay is not None]
+    if len(local) - len(named) > 1 or len(set(named)) != len(named):
+        raise ValueError("sites on this machine need distinct underlays, all but one of them")
+    return result
+
+def place(nodes: list[str], links: list[list], site_list: list[dict], pinned: dict[str, str] | None = None) -> dict[str, str]:
+    # grow one site at a time from the best-connected unplaced node, always taking the node
+    # with most links into the site, then move nodes to the site most of their links go to
+    # while that cuts links and every site stays within BALANCE of its share.
+    pinned = pinned or {}
+    neighbours: dict[str, list[str]] = {node: [] for node in nodes}
+    for link in links:
+        neighbours[link[0]].append(link[2])
+        neighbours[link[2]].append(link[0])
+    total = sum(site["weight"] for site in site_list)
+    share = {site["name"]: len(nodes) * site["weight"] / total for site in site_list}
+    placement = dict(pinned)
+    size = collections.Counter(placement.values())
+    unplaced = {node for node in nodes if node not in placement}
+    order = sorted(unplaced, key=lambda node: (-len(neighbours[node]), node))
+    for i, site in enumerate(site_list):
+        name = site["name"]
+        target = size[name] + len(unplaced) if i == len(site_list) - 1 else round(share[name])
+        gain: dict[str, int] = {}
+        frontier: list[tuple[int, str]] = []
+        while size[name] < target and len(unplaced) != 0:
+            while len(frontier) != 0 and (frontier[0][1] not in unplaced or -frontier[0][0] != gain[frontier[0][1]]):
+                heapq.heappop(frontier)
+            node = heapq.heappop(frontier)[1] if len(frontier) != 0 else next(node for node in order if node in unplaced)
+            placement[node] = name
+            unplaced.discard(node)
+            size[name] += 1
+            for peer in neighbours[node]:
+                if peer in unplaced:
+                    gain[peer] = gain.get(peer, 0) + 1
+                    heapq.heappush(frontier, (-gain[peer], peer))
+
+    upper = {name: math.ceil(value * (1 + BALANCE)) for name, value in share.items()}
+    lower = {name: math.floor(value * (1 - BALANCE)) for name, value in share.items()}
+    for _ in range(PASSES):
+        moved = 0
+        for node in nodes:
+            if node in pinned:
+                continue
+            here = placement[node]
+            counts = collections.Counter(placement[peer] for peer in neighbours[node])
+            best = max(share, key=lambda name: (counts[name], name == here))
+            if counts[best] > counts[here] and size[best] < upper[best] and size[here] > lower[here]:
+                placement[node] = best
+                size[here] -= 1
+                size[best] += 1
+                moved += 1
+        if moved == 0:
+            break
+    return placement
+
+def plan(topo: dict, site_list: list[dict]) -> dict[str, str]:
+    nodes = [node["name"] for node in topo["devices"] + topo["hosts"]]
+    pinned = {node["name"]: site_list[0]["name"] for node in topo["devices"] + topo["hosts"] if node["network"] != "none"}
+    return place(nodes, topo["links"], site_list, pinned)
+
+def cut_links(placement: dict[str, str], links: list[list]) -> list[list]:
+    return [link for link in links if placement[link[0]] != placement[link[2]]]
+
+def summary(placement: dict[str, str], links: list[list]) -> dict:
+    return {"nodes": dict(sorted(collections.Counter(placement.values()).items())), "links": len(links),
+            "cut": len(cut_links(placement, links))}
+
+def client_of(site: dict):
+    if site["docker_host"] is None:
+        return dockernet.client
+    if site["name"] not in clients:
+        clients[site["name"]] = docker.DockerClient(base_url=site["docker_host"], max_pool_size=dockernet.WORKERS)
+    return clients[site["name"]]
+
+def shared(site: dict) -> bool:
+    # nodes on the default daemon are started and registered by dockernet itself.
+    return site["docker_host"] is None
+
+def start_agent(site: dict):
+    instrument.run([*site["docker"], "run", "-d", "--rm", "--name", dockernet.PREFIX + AGENT, "--privileged",
+                    "--pid", "host", "--network", "host", "-v", f"{dockernet.NETNS_DIR}:{dockernet.NETNS_DIR}:rshared",
+                    "--label", dockernet.OWNER, AGENT_IMAGE, "sleep", "infinity"], stdout=subprocess.DEVNULL, check=True)
+    print(f"{site['name']}: agent started")
+
+@instrument.timed
+def start_node(name: str, site: dict, node: dict):
+    store.record_node(name, site=site)
+    if shared(site):
+        dockernet.start_device(*topology.node_args(node))
+        return
+    if node["image"] == dockernet.NETNS_IMAGE:
+        if site["via"] is None:
+            dockernet.start_netns(name, node["network"])
+            return
+        instrument.run([*site["via"], "ip", "netns", "add", dockernet.PREFIX + name], check=True)
+        dockernet.netns_devices.add(name)
+        store.record_node(name, image=node["image"], network=node["network"], args=[], config=None)
+        batch = netlink.LinkBatch(site["via"])
+        batch.up(dockernet.PREFIX + name, "lo")
+        batch.commit_namespace(dockernet.PREFIX + name)
+    else:
+        args = topology.node_args(node)[3:]
+        store.record_node(name, image=node["image"], network=node["network"], args=args, config=node.get("config"))
+        dockernet.run_container(site["docker"], name, node["image"], node["network"], *args)
+    print(f"{name} -> {node['network']} ({site['name']})")
+
+@instrument.timed
+def register_node(name: str, site: dict):
+    if name in dockernet.netns_devices:
+        return
+    if shared(site):
+        dockernet.register_netns(name)
+        return
+    pid = client_of(site).api.inspect_container(dockernet.PREFIX + name)["State"]["Pid"]
+    if site["via"] is None:
+        dockernet.link_netns(name, pid)
+        return
+    # the namespace is on another machine; only the agent there can name it.
+    instrument.run([*site["via"], "ln", "-sfn", f"/proc/{pid}/ns/net", f"{dockernet.NETNS_DIR}/{dockernet.PREFIX + name}"], check=True)
+    store.record_node(name, pid=pid, started=None)
+
+def site_batches(batch: netlink.LinkBatch, placement: dict[str, str]) -> dict[str, netlink.LinkBatch]:
+    # the plan of the whole topology, split by site; veths between sites turn into tunnels.
+    by_site = {name: netlink.LinkBatch(site["via"]) for name, site in sites.items()}
+    def site_of(netns: str) -> dict:
+        return sites[placement[netns.removeprefix(dockernet.PREFIX)]]
+    tunnels = 0
+    for ns1, if1, ns2, if2 in batch.veths:
+        site1, site2 = site_of(ns1), site_of(ns2)
+        if site1 is site2:
+            by_site[site1["name"]].veth(ns1, if1, ns2, if2)
+            continue
+        vni = VNI_BASE + tunnels
+        tunnels += 1
+        by_site[site1["name"]].tunnel(site1["underlay"], ns1, if1, vni, site1["address"], site2["address"])
+        by_site[site2["name"]].tunnel(site2["underlay"], ns2, if2, vni, site2["address"], site1["address"])
+    for netns, ops in batch.ops.items():
+        by_site[site_of(netns)["name"]].ops[netns] = ops
+    for netns, qdiscs in batch.qdiscs.items():
+        by_site[site_of(netns)["name"]].qdiscs[netns] = qdiscs
+    return by_site
+
+def activate(site_list: list[dict], placement: dict[str, str]):
+    # also used by dockernet.reattach, with the sites recorded in the state file.
+    sites.update({site["name"]: site for site in site_list})
+    for name, site_name in placement.items():
+        if not shared(sites[site_name]):
+            dockernet.node_sites[name] = sites[site_name]
+    if clean_sites not in dockernet.cleanup_hooks:
+        dockernet.cleanup_hooks.append(clean_sites)
+
+def apply(topo: dict, site_list: list[dict], workers: int = dockernet.WORKERS) -> dict:
+    nodes = {node["name"]: node for node in topo["devices"] + topo["hosts"]}
+    placement = plan(topo, site_list)
+    result = summary(placement, topo["links"])
+    print(f"placement: {result['nodes']}, {result['cut']} of {result['links']} links cut")
+    activate(site_list, placement)
+    pathlib.Path(dockernet.NETNS_DIR).mkdir(parents=True, exist_ok=True)
+    missing = [site for site in site_list if site["underlay"] is not None and not site["remote"]
+               and not pathlib.Path(dockernet.NETNS_DIR, site["underlay"]).exists()]
+    if len(missing) != 0:
+        standins(missing)
+    for host in topo["hosts"]:
+        dockernet.hosts[host["name"]] = None
+
+    timings = {}
+    remote = [[site] for site in site_list if site["remote"]]
+    timings["agents"] = dockernet.run_phase("agents", start_agent, remote, workers)
+    timings["networks"] = dockernet.run_phase("networks", dockernet.create_network,
+                                              [[network["name"], ipaddress.ip_network(network["subnet"])] for network in topo["networks"]], workers)
+    timings["devices"] = dockernet.run_phase("devices", start_node, [[name, sites[placement[name]], node] for name, node in nodes.items()], workers)
+    timings["netns"] = dockernet.run_phase("netns", register_node, [[name, sites[placement[name]]] for name in nodes], workers)
+    batch = dockernet.plan_links(topo["links"])
+    topology.impair(batch, topo, topo["links"])
+    timings["links"] = dockernet.run_phase("links", lambda site_batch: site_batch.commit(workers),
+                                           [[site_batch] for site_batch in site_batches(batch, placement).values()], workers)
+    dockernet.save_state()
+    print(f"partitioned topology up in {sum(timings.values()):.2f}s")
+    return {**result, "placement": placement, "timings": timings}
+
+def clean_sites(workers: int = dockernet.WORKERS):
+    # containers on the other daemons, namespaces the agents named, and the stand-ins and their bridge.
+    for site in sites.values():
+        if site["via"] is not None:
+            instrument.run([*site["via"], "sh", "-c", f"for f in {dockernet.NETNS_DIR}/{dockernet.PREFIX}*; do "
+                            "[ -e \"$f\" ] || [ -L \"$f\" ] || continue; [ -L \"$f\" ] && rm -f \"$f\" || ip netns del \"${f##*/}\"; done"],
+                           stderr=subprocess.DEVNULL)
+        if not shared(site):
+            containers = client_of(site).containers.list(all=True, filters={"label": dockernet.OWNER})
+            dockernet.run_map(dockernet.remove_container, containers, workers)
+            print(f"{site['name']}: removed {len(containers)} containers")
+    for entry in pathlib.Path(dockernet.NETNS_DIR).glob(STANDIN_PREFIX + "*"):
+        instrument.run(["ip", "netns", "del", entry.name], stderr=subprocess.DEVNULL)
+    instrument.run(["ip", "link", "del", dockernet.PREFIX + UNDERLAY_BRIDGE], stderr=subprocess.DEVNULL)
+    for name in list(dockernet.node_sites):
+        del dockernet.node_sites[name]
+    sites.clear()
+
+def standins(site_list: list[dict]):
+    # one namespace per site underlay, all on one bridge: separate machines on one box.
+    bridge = dockernet.PREFIX + UNDERLAY_BRIDGE
+    if not pathlib.Path("/sys/class/net", bridge).exists():
+        netlink._ip_batch(None, [f"link add {bridge} type bridge", f"link set {bridge} up"])
+    for site in site_list:
+        port = f"ul-{site['name']}"[:15]
+        instrument.run(["ip", "netns", "add", site["underlay"]], check=True)
+        netlink._ip_batch(None, [f"link add {port} type veth peer name ul0 netns {site['underlay']}",
+                                 f"link set {port} master {bridge}", f"link set {port} up"])
+        netlink._ip_batch(site["underlay"], ["link set lo up", f"addr add {site['interface']} dev ul0", "link set ul0 up"])
+    print(f"{len(site_list)} site stand-ins on {bridge}")
+
+if __name__ == "__main__":
+    if len(sys.argv) not in [4, 5] or sys.argv[1] not in ["plan", "run"]:
+        print("Usage: sudo ./partition.py plan|run TOPO SITES [WORKERS]", file=sys.stderr)
+        exit(-1)
+    topo = topology.load_topo(sys.argv[2])
+    site_list = load_sites(sys.argv[3])
+    if sys.argv[1] == "plan":
+        placement = plan(topo, site_list)
+        print(json.dumps({**summary(placement, topo["links"]), "placement": placement}, indent=1))
+        exit(0)
+    try:
+        activate(site_list, {})
+        dockernet.clean_networks()
+        apply(topo, site_list, int(sys.argv[4]) if len(sys.argv) == 5 else dockernet.WORKERS)
+    except:
+        traceback.print_exc()
+    finally:
+        dockernet.main_loop()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+import sys
+import json
+import pathlib
+import shutil
+import subprocess
+import instrument
+import threading
+import uuid
+import dockernet
+
+# Warm pool: pre-started containers named POOL_PREFIX + token. A claimed container is
+# renamed to its node name; released ones are scrubbed and renamed back. Bind mounts
+# cannot be added to a running container, so every pool container mounts its own
+# staging directory on /etc/frr and a claim copies the node's config directory into it.
+POOL_LABEL = "dockernet.pool"
+TOKEN_LABEL = "dockernet.pool.token"
+POOL_PREFIX = "dnpool-"
+POOL_DIR = pathlib.Path(".pool").absolute()
+MARKER = ".dockernet.json"
+# the router bgp part of bgpd.conf, loaded into a claimed container's running bgpd.
+CLAIM_CONFIG = "bgpd.claim"
+
+idle: dict[str, list] = {}
+idle_lock = threading.Lock()
+loaded = False
+
+def is_pooled(container) -> bool:
+    return container.labels.get(POOL_LABEL) == dockernet.PREFIX
+
+def token_of(container) -> str:
+    return container.labels[TOKEN_LABEL]
+
+def staging_dir(token: str) -> pathlib.Path:
+    return POOL_DIR / token
+
+def read_marker(staging: pathlib.Path) -> dict:
+    marker = staging / MARKER
+    return json.loads(marker.read_text()) if marker.exists() else {}
+
+def reset_staging(staging: pathlib.Path, template: str | None):
+    if staging.exists():
+        shutil.rmtree(staging)
+    if template is not None:
+        shutil.copytree(template, staging)
+    else:
+        staging.mkdir(parents=True)
+    (staging / MARKER).write_text(json.dumps({"template": template, "source": None}))
+
+def load():
+    global loaded
+    with idle_lock:
+        if loaded:
+            return
+        for container in dockernet.client.containers.list(filters={"label": f"{POOL_LABEL}={dockernet.PREFIX}"}):
+            if container.name.startswith(POOL_PREFIX):
+                idle.setdefault(container.attrs["Config"]["Image"], []).append(container)
+        loaded = True
+
+def start(image_name: str, template: str | None = None):
+    token = uuid.uuid4().hex[:12]
+    args = []
+    if template is not None:
+        reset_staging(staging_dir(token), str(pathlib.Path(template).absolute()))
+        args = ["-v", f"{staging_dir(token)}:{dockernet.FRR_CONFIG_DIR}"]
+    instrument.run(["docker", "run", "-dit", "--rm", "--privileged",
+                    "--name", POOL_PREFIX + token,
+                    "--network", "none",
+                    "--label", dockernet.OWNER,
+                    "--label", f"{POOL_LABEL}={dockernet.PREFIX}",
+                    "--label", f"{TOKEN_LABEL}={token}",
+                    *args, image_name], stdout=subprocess.DEVNULL, check=True)
+    with idle_lock:
+        idle.setdefault(image_name, []).append(dockernet.client.containers.get(POOL_PREFIX + token))
+
+def fill(image_name: str, count: int, template: str | None = None, workers: int = dockernet.WORKERS):
+    load()
+    dockernet.run_phase(f"pool {image_name}", start, [[image_name, template]] * count, workers)
+
+def drain(workers: int = dockernet.WORKERS) -> int:
+    load()
+    with idle_lock:
+        containers = [container for members in idle.values() for container in members]
+        idle.clear()
+    dockernet.run_map(dockernet.remove_container, containers, workers)
+    for container in containers:
+        shutil.rmtree(staging_dir(token_of(container)), ignore_errors=True)
+    return len(containers)
+
+def status() -> dict[str, int]:
+    load()
+    with idle_lock:
+        return {image: len(members) for image, members in idle.items()}
+
+def exec_checked(container, cmd: list[str]):
+    result = container.exec_run(cmd)
+    if result.exit_code != 0:
+        raise RuntimeError(f"{container.name}: {' '.join(cmd)} exited with {result.exit_code}: {result.output.decode(errors='replace').strip()}")
+
+def bgp_section(config: str) -> str:
+    # bgpd ignores the interface stanzas of bgpd.conf when it starts; vtysh -f would send
+    # them to zebra, which then puts the addresses on the links before the link engine does.
+    lines = []
+    inside = False
+    for line in config.splitlines():
+        if line.startswith("router bgp"):
+            inside = True
+        elif line != "" and not line[0].isspace() and not line.startswith("!"):
+            inside = False
+        if inside:
+            lines.append(line)
+    return "\n".join(lines) + "\n"
+
+def pool_config(args: tuple) -> tuple[bool, str | None]:
+    # only bare devices and devices with a single /etc/frr mount can come from the pool.
+    if len(args) == 0:
+        return True, None
+    if len(args) == 2 and args[0] == "-v" and args[1].endswith(f":{dockernet.FRR_CONFIG_DIR}"):
+        return True, args[1].rsplit(":", 1)[0]
+    return False, None
+
+def claim(name: str, image_name: str, network: str, *args) -> bool:
+    usable, config = pool_config(args)
+    if not usable or network != "none":
+        return False
+    load()
+    with idle_lock:
+        members = idle.get(image_name, [])
+        container = next((c for c in members if (config is None) == (len(c.attrs["Mounts"]) == 0)), None)
+        if container is None:
+            return False
+        members.remove(container)
+
+    container.rename(dockernet.PREFIX + name)
+    if config is not None:
+        staging = staging_dir(token_of(container))
+        marker = read_marker(staging)
+        daemons_changed = (pathlib.Path(config, "daemons").read_bytes() != (staging / "daemons").read_bytes()
+                           if pathlib.Path(config, "daemons").exists() and (staging / "daemons").exists() else False)
+        # only bgpd's config is loaded live; any other daemon's config needs FRR started again.
+        others = [conf.name for conf in pathlib.Path(config).glob("*.conf") if conf.name not in ["bgpd.conf", "vtysh.conf"]]
+        shutil.copytree(config, staging, dirs_exist_ok=True)
+        (staging / MARKER).write_text(json.dumps({"template": marker.get("template"), "source": config}))
+        if daemons_changed or len(others) != 0:
+            # a different daemon set needs FRR started again, which a restart of the container does.
+            container.restart()
+        elif (staging / "bgpd.conf").exists():
+            (staging / CLAIM_CONFIG).write_text(bgp_section((staging / "bgpd.conf").read_text()))
+            exec_checked(container, ["vtysh", "-f", f"{dockernet.FRR_CONFIG_DIR}/{CLAIM_CONFIG}"])
+    print(f"{name} -> {network} (pool)")
+    return True
+
+def release(container):
+    # scrub a claimed container and hand it back to the pool instead of killing it.
+    name = container.name.removeprefix(dockernet.PREFIX)
+    dockernet.forget_node(name)
+    exec_checked(container, ["sh", "-c", "for i in $(ls /sys/class/net); do [ $i = lo ] || ip link del $i || exit 1; done"])
+    staging = staging_dir(token_of(container))
+    if staging.exists():
+        exec_checked(container, ["vtysh", "-c", "configure terminal", "-c", "no router bgp"])
+        # zebra keeps the config of deleted interfaces and would give it to the next node's ethN.
+        exec_checked(container, ["sh", "-c", "for i in $(vtysh -c 'show running-config' | sed -n 's/^interface \\([^ ]*\\).*/\\1/p'); do "
+                                 "vtysh -c 'configure terminal' -c \"no interface $i\" || exit 1; done"])
+        reset_staging(staging, read_marker(staging).get("template"))
+    container.rename(POOL_PREFIX + token_of(container))
+    container.reload()
+    pathlib.Path(dockernet.NETNS_DIR, dockernet.PREFIX + name).unlink(missing_ok=True)
+    dockernet.hosts.pop(name, None)
+    load()
+    with idle_lock:
+        idle.setdefault(container.attrs["Config"]["Image"], []).append(container)
+    print(f"{name} returned to pool")
+
+def config_source(mounts: dict[str, str]) -> str | None:
+    # the config directory a pooled node was claimed with, as if it were mounted directly.
+    source = mounts.get(dockernet.FRR_CONFIG_DIR)
+    if source is None or not source.startswith(str(POOL_DIR)):
+        return source
+    return read_marker(pathlib.Path(source)).get("source")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ['fill', 'drain', 'status'] or (sys.argv[1] == 'fill' and len(sys.argv) not in [4, 5]):
+        print("Usage: sudo ./pool.py fill IMAGE COUNT [TEMPLATE] | drain | status", file=sys.stderr)
+        exit(-1)
+
+    if sys.argv[1] == 'fill':
+        fill(sys.argv[2], int(sys.argv[3]), sys.argv[4] if len(sys.argv) == 5 else None)
+    elif sys.argv[1] == 'drain':
+        print(f"removed {drain()} pooled containers")
+    for image, count in status().items():
+        print(f"{image}: {count} idle")
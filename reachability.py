@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+import sys
+import json
+import heapq
+import time
+import argparse
+import ipaddress
+import pathlib
+import traceback
+
+# Offline model of what the emulated fabric should do: BGP sessions come from the
+# neighbor statements of every bgpd.conf checked against the links they run over,
+# routes are propagated path-vector style from the routers that announce them (AS and
+# confederation loop checks, shortest AS_SEQUENCE first, eBGP over confed/iBGP, fewest
+# confederation hops, multipath over equal paths), and every host pair is walked over the resulting ECMP next hops
+# in both directions. Where FRR would break a tie by age, the lowest router-id wins.
+DEFAULT_MAXIMUM_PATHS = 64
+MAX_UPDATES_PER_ROUTER = 1000
+
+def parse_config(text: str) -> dict:
+    router = {
+        "asn": None,
+        "router_id": None,
+        "confed_id": None,
+        "confed_peers": set(),
+        "neighbors": {},
+        "networks": [],
+        "datacenter": False,
+        "requires_policy": None,
+        "multipath_relax": None,
+        "maximum_paths": DEFAULT_MAXIMUM_PATHS,
+    }
+    for line in text.splitlines():
+        words = line.split()
+        if words[:3] == ["frr", "defaults", "datacenter"]:
+            router["datacenter"] = True
+        elif words[:2] == ["router", "bgp"] and len(words) >= 3:
+            router["asn"] = int(words[2])
+        elif words[:2] == ["bgp", "router-id"]:
+            router["router_id"] = words[2]
+        elif words[:3] == ["bgp", "confederation", "identifier"]:
+            router["confed_id"] = int(words[3])
+        elif words[:3] == ["bgp", "confederation", "peers"]:
+            router["confed_peers"] = {int(asn) for asn in words[3:]}
+        elif words[:1] == ["neighbor"] and len(words) >= 4 and words[2] == "remote-as" and words[3].isdigit():
+            router["neighbors"][str(ipaddress.ip_address(words[1]))] = int(words[3])
+        elif words[:1] == ["network"]:
+            router["networks"].append(ipaddress.ip_network(words[1], strict=False))
+        elif words[:3] == ["no", "bgp", "ebgp-requires-policy"]:
+            router["requires_policy"] = False
+        elif words[:2] == ["bgp", "ebgp-requires-policy"]:
+            router["requires_policy"] = True
+        elif words[:4] == ["bgp", "bestpath", "as-path", "multipath-relax"]:
+            router["multipath_relax"] = True
+        elif words[:1] == ["maximum-paths"] and words[1].isdigit():
+            router["maximum_paths"] = int(words[1])
+    # the datacenter profile drops the eBGP policy requirement and relaxes multipath.
+    if router["requires_policy"] is None:
+        router["requires_policy"] = not router["datacenter"]
+    if router["multipath_relax"] is None:
+        router["multipath_relax"] = router["datacenter"]
+    return router
+
+def public_as(router: dict) -> int:
+    return router["asn"] if router["confed_id"] is None else router["confed_id"]
+
+def peer_kind(local: dict, remote: dict) -> tuple[int, str]:
+    # the AS local must configure for remote, and what kind of session that makes.
+    if local["confed_id"] is not None and local["confed_id"] == remote["confed_id"] and remote["asn"] in local["confed_peers"] | {local["asn"]}:
+        return remote["asn"], "ibgp" if local["asn"] == remote["asn"] else "confed"
+    return public_as(remote), "ibgp" if public_as(local) == public_as(remote) else "ebgp"
+
+def build_model(topo: dict, configs: dict[str, str]) -> dict:
+    routers = {name: parse_config(text) for name, text in configs.items()}
+    hosts = {host["name"]: None for host in topo["hosts"]}
+    # (node, address of its link peer) -> (peer, own address on that link)
+    peers: dict[tuple[str, str], tuple[str, str | None]] = {}
+    attached: dict[str, set[str]] = {name: set() for name in hosts}
+    for c1, _if1, c2, _if2, ip1, ip2 in topo["links"]:
+        a1 = None if ip1 is None else str(ipaddress.ip_interface(ip1).ip)
+        a2 = None if ip2 is None else str(ipaddress.ip_interface(ip2).ip)
+        if a2 is not None:
+            peers[(c1, a2)] = (c2, a1)
+        if a1 is not None:
+            peers[(c2, a1)] = (c1, a2)
+        for host, ip, router, gateway in ((c1, ip1, c2, a2), (c2, ip2, c1, a1)):
+            if host in hosts and ip is not None:
+                hosts[host] = {"address": ipaddress.ip_interface(ip).ip, "gateway": gateway, "router": router}
+            if host in hosts:
+                attached[host].add(router)
+
+    sessions: dict[str, list[tuple[str, str]]] = {name: [] for name in routers}
+    problems: list[str] = []
+    # a broken session is reported from the side that finds it first, not from both.
+    reported: set[frozenset] = set()
+    for name, router in routers.items():
+        for address, remote_as in router["neighbors"].items():
+            peer, own = peers.get((name, address), (None, None))
+            if peer not in routers:
+                problems.append(f"{name}: neighbor {address} is not a directly connected router")
+                continue
+            expected, kind = peer_kind(router, routers[peer])
+            back = routers[peer]["neighbors"].get(own)
+            session = frozenset([(name, address), (peer, own)])
+            if session in reported:
+                continue
+            if remote_as != expected or back is None:
+                reported.add(session)
+            if remote_as != expected:
+                problems.append(f"{name}: neighbor {address} ({peer}) remote-as {remote_as}, but {peer} is AS {expected}")
+            elif back is None:
+                problems.append(f"{name}: {peer} has no neighbor statement for {own}")
+            elif back == peer_kind(routers[peer], router)[0]:
+                sessions[name].append((peer, kind))
+    return {"routers": routers, "hosts": hosts, "attached": attached, "sessions": sessions, "problems": sorted(set(problems))}
+
+def export_path(model: dict, sender: str, path: tuple | None, kind: str) -> tuple | None:
+    # what sender announces over a session of kind (as seen by sender), None for nothing.
+    if path is None:
+        return None
+    as_seq, confed_seq, learned = path
+    router = model["routers"][sender]
+    if kind == "ibgp" and learned == "ibgp":
+        return None
+    if kind == "ebgp":
+        if router["requires_policy"]:
+            return None
+        return ((public_as(router),) + as_seq, (), "ebgp")
+    if kind == "confed":
+        return (as_seq, (router["asn"],) + confed_seq, "confed")
+    return (as_seq, confed_seq, "ibgp")
+
+def accepts(router: dict, path: tuple) -> bool:
+    as_seq, confed_seq, learned = path
+    if learned == "ebgp" and router["requires_policy"]:
+        return False
+    if router["asn"] in as_seq or router["asn"] in confed_seq:
+        return False
+    return router["confed_id"] is None or router["confed_id"] not in as_seq
+
+def rank(path: tuple) -> tuple[int, int, int]:
+    # confederation segments do not count towards the AS path length (RFC 5065); they only
+    # break ties, standing in for the IGP distance to the next hop inside the confederation.
+    as_seq, confed_seq, learned = path
+    return len(as_seq), {"local": -1, "ebgp": 0}.get(learned, 1), len(confed_seq)
+
+def select(model: dict, name: str, rib_in: dict[str, tuple]) -> tuple[tuple | None, list[str]]:
+    # (path announced onwards, next hops used for forwarding); rib_in maps peer -> (rank, tie-break, path).
+    if len(rib_in) == 0:
+        return None, []
+    router = model["routers"][name]
+    best_peer = min(rib_in, key=lambda peer: rib_in[peer][:2])
+    best_rank, _tie, best = rib_in[best_peer]
+    multipath = sorted((entry[1], peer) for peer, entry in rib_in.items() if entry[0] == best_rank
+                       and (router["multipath_relax"] or entry[2][0][:1] == best[0][:1]))
+    return best, [peer for _tie, peer in multipath[:router["maximum_paths"]]]
+
+def propagate(model: dict, origins: set[str]) -> dict[str, list[str]]:
+    # next hops of every router towards a prefix announced by origins; origins map to [].
+    # exported paths never rank better than the sender's, so going through routers best
+    # path first settles most of them on their first visit.
+    announced: dict[str, tuple | None] = {name: ((), (), "local") for name in origins}
+    nexthops: dict[str, list[str]] = {name: [] for name in origins}
+    rib_in: dict[str, dict[str, tuple]] = {name: {} for name in model["routers"]}
+    queue = [(rank(announced[name]), name) for name in sorted(origins)]
+    heapq.heapify(queue)
+    updates = 0
+    limit = MAX_UPDATES_PER_ROUTER * max(1, len(model["routers"]))
+    while len(queue) != 0 and updates < limit:
+        _rank, sender = heapq.heappop(queue)
+        for peer, kind in model["sessions"][sender]:
+            path = export_path(model, sender, announced.get(sender), kind)
+            if path is not None and not accepts(model["routers"][peer], path):
+                path = None
+            if rib_in[peer].get(sender, (None, None, None))[2] == path:
+                continue
+            updates += 1
+            if path is None:
+                rib_in[peer].pop(sender, None)
+            else:
+                rib_in[peer][sender] = (rank(path), model["routers"][sender]["router_id"] or sender, path)
+            if peer in origins:
+                continue
+            best, hops = select(model, peer, rib_in[peer])
+            nexthops[peer] = hops
+            if announced.get(peer) != best:
+                announced[peer] = best
+                heapq.heappush(queue, ((-2, 0, 0) if best is None else rank(best), peer))
+    return nexthops
+
+def count_paths(nexthops: dict[str, list[str]], delivers: set[str], start: str, counts: dict[str, int]) -> int:
+    # ECMP paths from start to a router that delivers; forwarding loops count as no path.
+    # counts is shared by every start towards the same destination.
+    stack = [(start, False)]
+    visiting: set[str] = set()
+    while len(stack) != 0:
+        node, expanded = stack.pop()
+        if node in counts:
+            continue
+        if node in delivers:
+            counts[node] = 1
+        elif expanded:
+            visiting.discard(node)
+            counts[node] = sum(counts.get(hop, 0) for hop in nexthops.get(node, []))
+        elif node in visiting:
+            counts[node] = 0
+        else:
+            visiting.add(node)
+            stack.append((node, True))
+            stack.extend((hop, False) for hop in nexthops.get(node, []) if hop not in counts and hop not in visiting)
+    return counts[start]
+
+def forwarding(model: dict, address) -> tuple[set[str], dict[str, list[str]]]:
+    # routers that deliver to address directly, and next hops of the rest via the most specific announced prefix.
+    delivers = {router for host, info in model["hosts"].items() if info is not None and info["address"] == address
+                for router in model["attached"][host]}
+    prefixes: dict = {}
+    for name, router in model["routers"].items():
+        for network in router["networks"]:
+            if address in network:
+                prefixes.setdefault(network, set()).add(name)
+    nexthops: dict[str, list[str]] = {}
+    for network in sorted(prefixes, key=lambda n: n.prefixlen):
+        origins = frozenset(prefixes[network])
+        if origins not in model["propagated"]:
+            model["propagated"][origins] = propagate(model, set(origins))
+        for name, hops in model["propagated"][origins].items():
+            if len(hops) != 0 or name in origins:
+                nexthops[name] = hops
+                if name in origins:
+                    delivers.add(name)
+    return delivers, nexthops
+
+def check(model: dict) -> dict[str, dict[str, dict]]:
+    model.setdefault("propagated", {})
+    addressed = {host: info for host, info in model["hosts"].items() if info is not None}
+    # paths[h1][h2]: ECMP paths from h1's gateway towards h2; a ping also needs the way back.
+    paths: dict[str, dict[str, int]] = {h1: {} for h1 in addressed}
+    for h2, dst in addressed.items():
+        delivers, nexthops = forwarding(model, dst["address"])
+        counts: dict[str, int] = {}
+        for h1, src in addressed.items():
+            if h1 != h2:
+                paths[h1][h2] = count_paths(nexthops, delivers, src["router"], counts)
+    return {h1: {h2: {"reachable": forward != 0 and paths[h2][h1] != 0, "paths": forward, "return_paths": paths[h2][h1]}
+                 for h2, forward in row.items()} for h1, row in paths.items()}
+
+def fattree_model(num_pods: int, num_leafs_per_pod: int) -> dict:
+    import fattree
+    fabric = fattree.Fabric(num_pods, num_leafs_per_pod)
+    hosts = [{"name": f"h{i}"} for i in range(num_pods * num_leafs_per_pod)]
+    return build_model({"hosts": hosts, "links": list(fabric.links())}, dict(fabric.configs()))
+
+def topo_model(path: str) -> dict:
+    import topology
+    topo = topology.load_topo(path)
+    configs = {}
+    for node in topo["devices"]:
+        config = pathlib.Path(node.get("config", ""), "bgpd.conf")
+        if "config" in node and config.exists():
+            configs[node["name"]] = config.read_text()
+    return build_model(topo, configs)
+
+def diff(expected: dict[str, dict[str, dict]], pings: dict[str, dict[str, dict]]) -> dict[str, list[tuple[str, str]]]:
+    # pings is a pingall matrix (pingall json); pairs missing from either side are skipped.
+    result: dict[str, list[tuple[str, str]]] = {"missing": [], "unexpected": [], "agree": []}
+    for h1, row in expected.items():
+        for h2, cell in row.items():
+            ping = pings.get(h1, {}).get(h2)
+            if ping is None:
+                continue
+            live = ping["received"] != 0
+            key = "agree" if live == cell["reachable"] else "missing" if cell["reachable"] else "unexpected"
+            result[key].append((h1, h2))
+    return result
+
+def summarize(model: dict, matrix: dict[str, dict[str, dict]], elapsed: float) -> str:
+    cells = [cell for row in matrix.values() for cell in row.values()]
+    reachable = [cell for cell in cells if cell["reachable"]]
+    lines = [f"{len(model['routers'])} routers, {sum(len(s) for s in model['sessions'].values()) // 2} sessions, "
+             f"{len(matrix)} hosts: {len(reachable)} of {len(cells)} pairs reachable in {elapsed:.2f}s"]
+    if len(reachable) != 0:
+        paths = [cell["paths"] for cell in reachable]
+        lines.append(f"ecmp paths per pair: min {min(paths)}, max {max(paths)}, mean {sum(paths) / len(paths):.1f}")
+    lines += [f"warning: {problem}" for problem in model["problems"]]
+    unreachable = [(h1, h2) for h1, row in matrix.items() for h2, cell in row.items() if not cell["reachable"]]
+    for h1, h2 in unreachable[:20]:
+        lines.append(f"unreachable: {h1} -> {h2}")
+    if len(unreachable) > 20:
+        lines.append(f"... and {len(unreachable) - 20} more")
+    return "\n".join(lines)
+
+def format_grid(matrix: dict[str, dict[str, dict]]) -> str:
+    # like pingall's grid, with the number of ECMP paths in place of the host name.
+    if len(matrix) == 0:
+        return ""
+    width = max(max(len(h) for h in matrix), max((len(str(c["paths"])) for row in matrix.values() for c in row.values()), default=1)) + 1
+    return "\n".join(f"{h1:>{width}} |" + "".join(f"{cell['paths'] if cell['reachable'] else 'x':>{width}}" for cell in row.values())
+                     for h1, row in matrix.items())
+
+def format_diff(result: dict[str, list[tuple[str, str]]]) -> str:
+    lines = [f"pingall agrees on {len(result['agree'])} pairs, {len(result['missing'])} expected but failed, "
+             f"{len(result['unexpected'])} reachable but not expected"]
+    lines += [f"missing: {h1} -> {h2}" for h1, h2 in result["missing"]]
+    lines += [f"unexpected: {h1} -> {h2}" for h1, h2 in result["unexpected"]]
+    return "\n".join(lines)
+
+def run(model: dict, fmt: str = "summary", pings: dict | None = None) -> str:
+    start = time.perf_counter()
+    matrix = check(model)
+    elapsed = time.perf_counter() - start
+    output = json.dumps(matrix, indent=2) if fmt == "json" else format_grid(matrix) if fmt == "grid" else summarize(model, matrix, elapsed)
+    if pings is not None:
+        output += "\n" + format_diff(diff(matrix, pings))
+    return output
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="reachability.py", description="expected host reachability and ECMP paths, without running anything")
+    parser.add_argument("source", nargs="+", metavar="fattree PODS LEAFS | topo FILE")
+    parser.add_argument("-f", "--format", choices=["summary", "grid", "json"], default="summary")
+    parser.add_argument("-p", "--pingall", help="JSON matrix from 'pingall json -o FILE' to compare against")
+    args = parser.parse_args()
+    if not (args.source[0] == "fattree" and len(args.source) == 3) and not (args.source[0] == "topo" and len(args.source) == 2):
+        parser.print_usage(sys.stderr)
+        exit(-1)
+    try:
+        model = fattree_model(int(args.source[1]), int(args.source[2])) if args.source[0] == "fattree" else topo_model(args.source[1])
+        pings = None
+        if args.pingall is not None:
+            with open(args.pingall) as f:
+                pings = json.load(f)
+        print(run(model, args.format, pings))
+    except:
+        traceback.print_exc()
+        exit(1)
@@ -0,0 +1,163 @@
+import re
+import csv
+import json
+import time
+import threading
+import subprocess
+import collections
+import docker.errors
+import instrument
+import netlink
+import dockernet
+
+# CPU, memory and traffic of every node over time. Every interval the docker stats of each
+# container are read once (one_shot, so the daemon does not wait for a second sample) by a
+# few workers over the shared client, which leaves most of its connection pool to whatever
+# runs meanwhile; namespace-only nodes have no CPU or memory of their own and only their
+# interface counters are read. The samples go into a bounded series, from which per-node
+# and per-tier rates are worked out.
+INTERVAL = 1.0
+HISTORY = 600
+WORKERS = max(1, dockernet.WORKERS // 4)
+FIELDS = ["cpu", "rss", "rx_bytes", "tx_bytes"]
+# fattree node name prefixes.
+TIERS = {"rs": "spine", "rl": "leaf", "rr": "rack", "h": "host"}
+
+def tier_of(name: str) -> str:
+    return TIERS.get(re.sub(r"[0-9]+$", "", name), "other")
+
+def parse_stats(stats: dict) -> tuple[float, int, int, int]:
+    # cpu in percent of one core, rss as `docker stats` counts it (usage less inactive page cache).
+    cpu, precpu = stats.get("cpu_stats", {}), stats.get("precpu_stats", {})
+    cpu_delta = cpu.get("cpu_usage", {}).get("total_usage", 0) - precpu.get("cpu_usage", {}).get("total_usage", 0)
+    system_delta = cpu.get("system_cpu_usage", 0) - precpu.get("system_cpu_usage", 0)
+    cpus = cpu.get("online_cpus") or len(cpu.get("cpu_usage", {}).get("percpu_usage") or [None])
+    percent = cpu_delta / system_delta * cpus * 100 if system_delta > 0 and cpu_delta > 0 else 0.0
+    memory = stats.get("memory_stats", {})
+    inactive = memory.get("stats", {}).get("inactive_file", memory.get("stats", {}).get("total_inactive_file", 0))
+    networks = (stats.get("networks") or {}).values()
+    return (round(percent, 2), max(0, memory.get("usage", 0) - inactive),
+            sum(n.get("rx_bytes", 0) for n in networks), sum(n.get("tx_bytes", 0) for n in networks))
+
+def namespace_sample(name: str) -> tuple[float, int, int, int] | None:
+    try:
+        ifaces = netlink.counters(dockernet.PREFIX + name).values()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return (0.0, 0, sum(i["rx_bytes"] for i in ifaces), sum(i["tx_bytes"] for i in ifaces))
+
+class Sampler:
+    def __init__(self, interval: float = INTERVAL, history: int = HISTORY, workers: int = WORKERS):
+        self.interval = interval
+        self.workers = workers
+        self.started = time.perf_counter()
+        self.series: collections.deque = collections.deque(maxlen=history)
+        # the cpu counters of each container's previous sample, to work out cpu against.
+        self.cpu: dict[str, dict] = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def container_sample(self, name: str) -> tuple[float, int, int, int] | None:
+        try:
+            stats = dockernet.client.api.stats(dockernet.PREFIX + name, stream=False, one_shot=True)
+        except (docker.errors.APIError, OSError):
+            return None
+        # a one-shot sample has no precpu_stats of its own; the first one reads as idle.
+        cpu = stats.get("cpu_stats", {})
+        stats["precpu_stats"] = self.cpu.get(name, cpu)
+        self.cpu[name] = cpu
+        return parse_stats(stats)
+
+    def tick(self):
+        with instrument.span("resources tick", category="sampler"):
+            # registered nodes are known without asking docker.
+            names = list(dockernet.node_handles)
+            sampled = dockernet.run_map(lambda name: namespace_sample(name) if name in dockernet.netns_devices
+                                        else self.container_sample(name), names, min(self.workers, max(1, len(names))))
+            nodes = {name: sample for name, sample in zip(names, sampled) if sample is not None}
+            for name in self.cpu.keys() - nodes.keys():
+                del self.cpu[name]
+            self.series.append((round(time.perf_counter() - self.started, 3), nodes))
+
+    def run(self):
+        while not self.stopped.is_set():
+            start = time.perf_counter()
+            self.tick()
+            self.stopped.wait(max(0.0, self.interval - (time.perf_counter() - start)))
+
+    def start(self) -> "Sampler":
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def nodes(self) -> dict[str, dict]:
+        # the latest sample of every node, with traffic as a rate over the interval before it.
+        if len(self.series) == 0:
+            return {}
+        t1, now = self.series[-1]
+        t0, before = self.series[-2] if len(self.series) >= 2 else (t1, {})
+        elapsed = t1 - t0
+        result = {}
+        for name, (cpu, rss, rx, tx) in now.items():
+            previous = before.get(name)
+            result[name] = {
+                "tier": tier_of(name),
+                "cpu": cpu,
+                "rss": rss,
+                "rx_bps": (rx - previous[2]) * 8 / elapsed if previous is not None and elapsed > 0 else 0.0,
+                "tx_bps": (tx - previous[3]) * 8 / elapsed if previous is not None and elapsed > 0 else 0.0,
+            }
+        return result
+
+    def to_dict(self) -> dict:
+        return {"interval": self.interval, "fields": FIELDS, "tiers": {name: tier_of(name) for _t, nodes in self.series for name in nodes},
+                "series": [{"t": t, "nodes": {name: list(sample) for name, sample in nodes.items()}} for t, nodes in self.series]}
+
+    def export(self, path: str, fmt: str = "json"):
+        if fmt == "json":
+            with open(path, "w") as f:
+                json.dump(self.to_dict(), f)
+            return
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["t", "node", "tier", *FIELDS])
+            for t, nodes in self.series:
+                for name, sample in sorted(nodes.items()):
+                    writer.writerow([t, name, tier_of(name), *sample])
+
+def tiers(nodes: dict[str, dict]) -> dict[str, dict]:
+    result: dict[str, dict] = {}
+    for node in nodes.values():
+        tier = result.setdefault(node["tier"], {"nodes": 0, "cpu": 0.0, "rss": 0, "rx_bps": 0.0, "tx_bps": 0.0})
+        tier["nodes"] += 1
+        for key in ["cpu", "rss", "rx_bps", "tx_bps"]:
+            tier[key] += node[key]
+    return dict(sorted(result.items()))
+
+def format_top(rows: dict[str, dict], sort: str = "cpu", count: int | None = None) -> str:
+    # rows are nodes or tiers; the total line covers all rows, not only the ones shown.
+    def line(name: str, row: dict) -> str:
+        return (f"{name:<10} {row.get('nodes', 1):>6} {row['cpu']:>7.1f}% {row['rss'] / 2**20:>8.1f}MB "
+                f"{row['rx_bps'] / 1e6:>7.2f}Mb/s {row['tx_bps'] / 1e6:>7.2f}Mb/s")
+    lines = [f"{'name':<10} {'nodes':>6} {'cpu':>8} {'rss':>10} {'rx':>11} {'tx':>11}"]
+    lines += [line(name, row) for name, row in sorted(rows.items(), key=lambda item: -item[1][sort])[:count]]
+    total = {key: sum(row[key] for row in rows.values()) for key in ["cpu", "rss", "rx_bps", "tx_bps"]}
+    lines.append(line("total", dict(total, nodes=sum(row.get("nodes", 1) for row in rows.values()))))
+    return "\n".join(lines)
+
+sampler: Sampler | None = None
+
+def start(interval: float = INTERVAL, history: int = HISTORY) -> Sampler:
+    global sampler
+    if sampler is None:
+        sampler = Sampler(interval, history).start()
+    return sampler
+
+def stop():
+    global sampler
+    if sampler is not None:
+        sampler.stop()
+        sampler = None
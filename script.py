@@ -0,0 +1,114 @@
+import time
+import ipaddress
+import instrument
+import dockernet
+
+# Runs a file of REPL commands, one per line ("#" starts a comment line). Consecutive lines
+# that build the topology (the commands of CONCURRENT) are gathered into one step as long
+# as no line of the step creates or changes a node or network another line of it uses, and
+# a step runs on a pool; every other command runs alone through the REPL once the step
+# before it is done. The script stops after the first step with a failed line, and every
+# failed line of that step is reported with its line number.
+
+def create_network(name: str, subnet: str):
+    dockernet.create_network(name, ipaddress.ip_network(subnet))
+
+def checked(fn):
+    # exec_device and connect_device do not raise when the command fails.
+    def run(*args):
+        done = fn(*args)
+        if done.returncode != 0:
+            raise RuntimeError(f"exit status {done.returncode}")
+    return run
+
+# command: (fewest args, most args or None, function)
+CONCURRENT = {
+    "create_network": (2, 2, create_network),
+    "create_device": (3, None, dockernet.create_device),
+    "create_host": (3, None, dockernet.create_host),
+    "connect_device": (2, None, checked(dockernet.connect_device)),
+    "link_device": (4, 4, dockernet.link_device),
+    "exec_device": (2, None, checked(dockernet.exec_device)),
+}
+
+def read_script(path: str) -> list[tuple[int, str]]:
+    with open(path) as f:
+        lines = [(number, line.strip()) for number, line in enumerate(f, 1)]
+    return [(number, line) for number, line in lines if line != "" and not line.startswith("#")]
+
+def concurrent(app, line: str) -> tuple[str, list[str]] | None:
+    # the command and its args, if the line can share a step with others.
+    command, argstr, _line = app.parseline(line)
+    if command not in CONCURRENT:
+        return None
+    args = argstr.split()
+    fewest, most, _fn = CONCURRENT[command]
+    if len(args) < fewest or (most is not None and len(args) > most):
+        return None
+    return command, args
+
+def touches(command: str, args: list[str]) -> tuple[set, set]:
+    # (written, read): a node or network written by one line of a step is not used by another.
+    if command == "create_network":
+        return {("network", args[0])}, set()
+    if command in ["create_device", "create_host"]:
+        return {("node", args[0])}, {("network", args[2])}
+    if command == "connect_device":
+        return {("node", args[0])}, {("network", args[1])}
+    if command == "link_device":
+        return {("node", args[0]), ("node", args[2])}, set()
+    return {("node", args[0])}, set()
+
+def steps(app, lines: list[tuple[int, str]]) -> list[list[tuple[int, str]]]:
+    result: list[list[tuple[int, str]]] = []
+    written: set | None = None
+    read: set = set()
+    for number, line in lines:
+        parsed = concurrent(app, line)
+        if parsed is None:
+            result.append([(number, line)])
+            written = None
+            continue
+        writes, reads = touches(*parsed)
+        if written is None or writes & (written | read) or reads & written:
+            result.append([])
+            written, read = set(), set()
+        result[-1].append((number, line))
+        written |= writes
+        read |= reads
+    return result
+
+def run_line(app, line: str) -> str | None:
+    # why the line failed, or None.
+    parsed = concurrent(app, line)
+    if parsed is None:
+        app.postcmd(app.onecmd(app.precmd(line)), line)
+        return app.failure
+    command, args = parsed
+    try:
+        CONCURRENT[command][2](*args)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+def run(app, path: str, workers: int = dockernet.WORKERS) -> str | None:
+    # returns why the script stopped, or None when every line ran.
+    lines = read_script(path)
+    groups = steps(app, lines)
+    start = time.perf_counter()
+    for i, group in enumerate(groups):
+        with instrument.span(f"script step {i}", category="script"):
+            if len(group) == 1:
+                errors = [run_line(app, group[0][1])]
+            else:
+                errors = dockernet.run_map(lambda item: run_line(app, item[1]), group, min(workers, len(group)))
+        failed = [(number, line, error) for (number, line), error in zip(group, errors) if error is not None]
+        if len(failed) != 0:
+            for number, line, error in failed:
+                print(f"{path}:{number}: {line}\n    {error}")
+            ran = sum(len(group) for group in groups[:i + 1])
+            print(f"{path}: stopped at step {i + 1} of {len(groups)}, {len(failed)} of {ran} lines run failed")
+            return f"{path}:{failed[0][0]}: {failed[0][2]}"
+    dockernet.save_state()
+    print(f"{path}: {len(lines)} lines in {len(groups)} steps, {time.perf_counter() - start:.2f}s")
+    return None
@@ -0,0 +1,108 @@
+import os
+import json
+import hashlib
+import pathlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterable
+
+# A Batfish snapshot directory:
+#   configs/<device>.cfg   router configs
+#   hosts/<host>.json      host interfaces and gateways
+#   topo.json              {"edges": [{"node1": {...}, "node2": {...}}, ...]}
+# Every input is an iterable and is consumed once, so a generator keeps memory flat
+# no matter how many edges the fabric has.
+QUEUED_PER_WORKER = 4
+# content hashes of the files the last run wrote, so unchanged files are not written again;
+# .config (see fattree.write_configs) keeps one too. Batfish skips hidden files.
+MANIFEST = ".hashes.json"
+
+def load_manifest(directory: pathlib.Path) -> dict[str, str]:
+    manifest = directory / MANIFEST
+    return json.loads(manifest.read_text()) if manifest.exists() else {}
+
+def save_manifest(directory: pathlib.Path, hashes: dict[str, str]):
+    (directory / MANIFEST).write_text(json.dumps(hashes))
+
+def write_if_changed(path: pathlib.Path, content: str, hashes: dict[str, str], new_hashes: dict[str, str]) -> bool:
+    # hashes is the manifest of the previous run; new_hashes collects this one's.
+    digest = hashlib.sha256(content.encode()).hexdigest()
+    new_hashes[str(path)] = digest
+    if hashes.get(str(path)) == digest and path.exists():
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+    return True
+
+def run_bounded(fn, items: Iterable, workers: int) -> int:
+    # like run_map, but only a few items per worker are in flight, so items may be a generator of any length.
+    total = 0
+    pending = set()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for item in items:
+            if len(pending) >= max(1, workers) * QUEUED_PER_WORKER:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                total += sum(future.result() for future in done)
+            pending.add(pool.submit(fn, *item))
+        total += sum(future.result() for future in pending)
+    return total
+
+def edge(link: list) -> dict:
+    return {
+        "node1": {
+            "hostname": link[0],
+            "interfaceName": link[1]
+        }, "node2": {
+            "hostname": link[2],
+            "interfaceName": link[3]
+        }
+    }
+
+def write_topo(path: pathlib.Path, links: Iterable[list]) -> int:
+    # same bytes as json.dump({"edges": [...]}), one edge at a time; the file is swapped in when complete.
+    partial = path.with_name(path.name + ".partial")
+    count = 0
+    with open(partial, "w") as f:
+        f.write('{"edges": [')
+        for link in links:
+            if count != 0:
+                f.write(", ")
+            f.write(json.dumps(edge(link)))
+            count += 1
+        f.write("]}")
+    os.replace(partial, path)
+    return count
+
+def remove_stale(directory: pathlib.Path, suffix: str, keep: set[str]) -> int:
+    stale = [entry for entry in directory.iterdir() if entry.name.endswith(suffix) and entry.name.removesuffix(suffix) not in keep]
+    for entry in stale:
+        entry.unlink()
+    return len(stale)
+
+def export(snapshot_dir: str, configs: Iterable[tuple[str, str]], hosts: Iterable[tuple[str, dict]],
+           links: Iterable[list], workers: int = 1) -> dict[str, int]:
+    root = pathlib.Path(snapshot_dir)
+    (root / "configs").mkdir(parents=True, exist_ok=True)
+    (root / "hosts").mkdir(parents=True, exist_ok=True)
+    # names are kept to remove files a previous, larger export left behind.
+    config_names: set[str] = set()
+    host_names: set[str] = set()
+    hashes = load_manifest(root)
+    new_hashes: dict[str, str] = {}
+
+    def write_config(name: str, config: str) -> bool:
+        config_names.add(name)
+        return write_if_changed(root / "configs" / f"{name}.cfg", config, hashes, new_hashes)
+
+    def write_host(name: str, host: dict) -> bool:
+        host_names.add(name)
+        return write_if_changed(root / "hosts" / f"{name}.json", json.dumps(host), hashes, new_hashes)
+
+    summary = {"edges": write_topo(root / "topo.json", links)}
+    summary["configs_written"] = run_bounded(write_config, configs, workers)
+    summary["hosts_written"] = run_bounded(write_host, hosts, workers)
+    summary["removed"] = remove_stale(root / "configs", ".cfg", config_names) + remove_stale(root / "hosts", ".json", host_names)
+    save_manifest(root, new_hashes)
+    summary["configs"] = len(config_names)
+    summary["hosts"] = len(host_names)
+    print("snapshot: " + ", ".join(f"{key}={value}" for key, value in summary.items()))
+    return summary
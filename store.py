@@ -0,0 +1,105 @@
+import os
+import json
+import pathlib
+import threading
+
+# What dockernet has built (nodes with image, network, args, config and pid, links with
+# their addresses, networks and host addresses), kept on disk so a later session can
+# reattach instead of rebuilding. Changes only mark the store dirty; save() writes it
+# atomically and runs after every REPL command and topology build, not on every change.
+STATE_DIR = pathlib.Path("/var/run/dockernet")
+VERSION = 1
+
+lock = threading.Lock()
+state: dict = {}
+dirty = False
+
+def empty() -> dict:
+    return {"version": VERSION, "nodes": {}, "links": {}, "networks": {}, "hosts": {}}
+
+state = empty()
+
+def state_file(prefix: str) -> pathlib.Path:
+    return STATE_DIR / f"{prefix}state.json"
+
+def process_started(pid: int) -> int | None:
+    # start time in clock ticks since boot; with the pid it tells a process from a later one reusing the pid.
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return int(f.read().rsplit(")", 1)[1].split()[19])
+    except (OSError, IndexError, ValueError):
+        return None
+
+def mark():
+    global dirty
+    dirty = True
+
+def record_node(name: str, **fields):
+    with lock:
+        state["nodes"].setdefault(name, {}).update(fields)
+        mark()
+
+def forget_node(name: str):
+    with lock:
+        state["nodes"].pop(name, None)
+        state["hosts"].pop(name, None)
+        for key in [key for key, link in state["links"].items() if name in (link[0], link[2])]:
+            del state["links"][key]
+        mark()
+
+def link_key(link: list) -> str:
+    return f"{link[0]}.{link[1]}"
+
+def record_link(link: list):
+    with lock:
+        state["links"][link_key(link)] = list(link)
+        mark()
+
+def forget_link(name: str, ifname: str):
+    # by either end.
+    with lock:
+        for key in [key for key, link in state["links"].items() if (name, ifname) in ((link[0], link[1]), (link[2], link[3]))]:
+            del state["links"][key]
+        mark()
+
+def record_network(name: str, subnet: str):
+    with lock:
+        state["networks"][name] = subnet
+        mark()
+
+def forget_network(name: str):
+    with lock:
+        state["networks"].pop(name, None)
+        mark()
+
+def save(prefix: str, hosts: dict[str, str | None]):
+    global dirty
+    with lock:
+        if not dirty and hosts == state["hosts"]:
+            return
+        state["hosts"] = dict(hosts)
+        STATE_DIR.mkdir(parents=True, exist_ok=True)
+        partial = state_file(prefix).with_suffix(".partial")
+        partial.write_text(json.dumps(state))
+        os.replace(partial, state_file(prefix))
+        dirty = False
+
+def load(prefix: str) -> dict | None:
+    try:
+        saved = json.loads(state_file(prefix).read_text())
+    except (OSError, json.JSONDecodeError):
+        return None
+    return saved if saved.get("version") == VERSION else None
+
+def adopt(saved: dict):
+    global state, dirty
+    with lock:
+        state = saved
+        dirty = True
+
+def reset(prefix: str):
+    global state, dirty
+    with lock:
+        state = empty()
+        dirty = False
+        state_file(prefix).unlink(missing_ok=True)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+import sys
+import json
+import ipaddress
+import pathlib
+import traceback
+import dockernet
+import netlink
+import store
+
+# A topology file is JSON:
+# {
+#   "networks": [{"name": "lan", "subnet": "10.1.0.0/24"}],
+#   "devices":  [{"name": "r1", "image": "frrouting/frr", "network": "none", "config": "config/r1", "args": []}],
+#   "hosts":    [{"name": "h1", "image": "netns"}],
+#   "links":    [["r1", "eth0", "h1", "eth0", "10.0.0.1/30", "10.0.0.2/30"]],
+#   "impairments": [{"between": ["r*", "h*"], "delay": "2ms", "loss": "0.1%", "rate": "1gbit"}]
+# }
+# "config" is mounted on /etc/frr and is resolved relative to the topology file.
+# Every link whose ends match the two globs of an impairment gets its netem settings on
+# both ends; when several match, the last one wins.
+FRR_CONFIG_DIR = dockernet.FRR_CONFIG_DIR
+
+def normalize_node(node: dict, base_dir: pathlib.Path) -> dict:
+    if "name" not in node or "image" not in node:
+        raise ValueError(f"node {node} needs a name and an image")
+    normalized = {
+        "name": node["name"],
+        "image": node["image"],
+        "network": node.get("network", "none"),
+        "args": list(node.get("args", [])),
+    }
+    if node.get("config") is not None:
+        normalized["config"] = str((base_dir / node["config"]).absolute())
+    return normalized
+
+def normalize_topo(topo: dict, base_dir: pathlib.Path = pathlib.Path(".")) -> dict:
+    normalized = {
+        "networks": [{"name": n["name"], "subnet": str(ipaddress.ip_network(n["subnet"]))} for n in topo.get("networks", [])],
+        "devices": [normalize_node(n, base_dir) for n in topo.get("devices", [])],
+        "hosts": [normalize_node(n, base_dir) for n in topo.get("hosts", [])],
+        "links": [(list(link) + [None, None])[:6] for link in topo.get("links", [])],
+        "impairments": [dict(impairment) for impairment in topo.get("impairments", [])],
+    }
+    for impairment in normalized["impairments"]:
+        if len(impairment.get("between", [])) != 2:
+            raise ValueError(f"impairment {impairment} needs a pair of node globs in between")
+        netlink.netem_args(profile_of(impairment))
+    networks = {n["name"] for n in normalized["networks"]}
+    names: set[str] = set()
+    for node in normalized["devices"] + normalized["hosts"]:
+        if node["name"] in names:
+            raise ValueError(f"duplicate node {node['name']}")
+        if node["network"] != "none" and node["network"] not in networks:
+            raise ValueError(f"{node['name']}: unknown network {node['network']}")
+        names.add(node["name"])
+    for link in normalized["links"]:
+        for endpoint in (link[0], link[2]):
+            if endpoint not in names:
+                raise ValueError(f"link {link}: unknown node {endpoint}")
+    return normalized
+
+def load_topo(path: str) -> dict:
+    with open(path) as f:
+        topo = json.load(f)
+    return normalize_topo(topo, pathlib.Path(path).parent)
+
+def dump_topo(topo: dict, path: str):
+    with open(path, "w") as f:
+        json.dump(topo, f, indent=1)
+
+def profile_of(impairment: dict) -> dict:
+    return {key: value for key, value in impairment.items() if key != "between"}
+
+def link_profile(topo: dict, link: list) -> dict | None:
+    profile = None
+    for impairment in topo.get("impairments", []):
+        if dockernet.link_matches(impairment["between"], link[0], link[2]):
+            profile = profile_of(impairment)
+    return profile
+
+def impair(batch: netlink.LinkBatch, topo: dict, links: list[list], current: dict | None = None):
+    # netem for both ends of links; with current interfaces, ends that have netem but should not are cleared.
+    for link in links:
+        profile = link_profile(topo, link)
+        for name, ifname in ((link[0], link[1]), (link[2], link[3])):
+            if profile is not None:
+                batch.impair(dockernet.PREFIX + name, ifname, profile)
+            elif current is not None and current[name].get(ifname, {}).get("qdisc") == "netem":
+                batch.impair(dockernet.PREFIX + name, ifname, None)
+
+def node_args(node: dict) -> list[str]:
+    args = list(node["args"])
+    if "config" in node:
+        args += ["-v", f"{node['config']}:{FRR_CONFIG_DIR}"]
+    return [node["name"], node["image"], node["network"], *args]
+
+def plan(topo: dict) -> list[list[tuple[str, object, tuple]]]:
+    # every action is (key, fn, args) and depends on the keys listed next to it;
+    # actions are grouped into stages by their depth in the dependency graph.
+    actions: list[tuple[str, object, tuple, list[str]]] = []
+    for network in topo["networks"]:
+        actions.append((f"network:{network['name']}", dockernet.create_network,
+                        (network["name"], ipaddress.ip_network(network["subnet"])), []))
+    for node in topo["devices"] + topo["hosts"]:
+        deps = [] if node["network"] == "none" else [f"network:{node['network']}"]
+        actions.append((f"device:{node['name']}", dockernet.start_device, tuple(node_args(node)), deps))
+        actions.append((f"netns:{node['name']}", dockernet.register_netns, (node["name"],), [f"device:{node['name']}"]))
+
+    batch = dockernet.plan_links(topo["links"])
+    impair(batch, topo, topo["links"])
+    if len(topo["links"]) != 0:
+        endpoints = {link[0] for link in topo["links"]} | {link[2] for link in topo["links"]}
+        actions.append(("links", batch.commit_veths, (), [f"netns:{name}" for name in sorted(endpoints)]))
+        for netns in batch.namespaces():
+            actions.append((f"addressing:{netns.removeprefix(dockernet.PREFIX)}", batch.commit_namespace, (netns,), ["links"]))
+
+    depth: dict[str, int] = {}
+    stages: list[list[tuple[str, object, tuple]]] = []
+    for key, fn, args, deps in actions:
+        depth[key] = max([depth[dep] + 1 for dep in deps], default=0)
+        if depth[key] == len(stages):
+            stages.append([])
+        stages[depth[key]].append((key, fn, args))
+    return stages
+
+def stage_name(stage: list[tuple[str, object, tuple]]) -> str:
+    kinds = dict.fromkeys(key.split(":")[0] for key, _fn, _args in stage)
+    return "+".join(kinds)
+
+def apply_topo(topo: dict, workers: int = dockernet.WORKERS) -> dict[str, float]:
+    pathlib.Path(dockernet.NETNS_DIR).mkdir(parents=True, exist_ok=True)
+    for host in topo["hosts"]:
+        dockernet.hosts[host["name"]] = None
+    timings: dict[str, float] = {}
+    for depth, stage in enumerate(plan(topo)):
+        name = f"stage {depth}: {stage_name(stage)}"
+        timings[name] = dockernet.run_phase(name, lambda _key, fn, args: fn(*args), stage, workers)
+    dockernet.save_state()
+    print(f"topology up in {sum(timings.values()):.2f}s")
+    return timings
+
+def node_changed(node: dict, running: dict, recreated_networks: set[str]) -> bool:
+    return (running["image"] != node["image"]
+            or node["network"] not in running["networks"]
+            or node["network"] in recreated_networks
+            or running["mounts"].get(FRR_CONFIG_DIR) != node.get("config"))
+
+def reconcile_topo(topo: dict, workers: int = dockernet.WORKERS) -> dict[str, int]:
+    # bring the running topology to topo, touching only nodes, links and addresses that differ.
+    pathlib.Path(dockernet.NETNS_DIR).mkdir(parents=True, exist_ok=True)
+    desired = {node["name"]: node for node in topo["devices"] + topo["hosts"]}
+    running = dockernet.running_nodes()
+    for name, node in running.items():
+        dockernet.adopt_device(name, node)
+
+    networks = {network["name"]: network["subnet"] for network in topo["networks"]}
+    running_networks = dockernet.running_networks()
+    stale_networks = [name for name, subnet in running_networks.items() if networks.get(name) != subnet]
+    new_networks = [name for name in networks if name not in running_networks or name in stale_networks]
+    stale = [name for name in running
+             if name not in desired or node_changed(desired[name], running[name], set(stale_networks))]
+    new = [name for name in desired if name not in running or name in stale]
+
+    dockernet.run_phase("remove devices", dockernet.remove_device, [[name] for name in stale], workers)
+    dockernet.run_phase("remove networks", dockernet.remove_network, [[name] for name in stale_networks], workers)
+    dockernet.run_phase("networks", dockernet.create_network,
+                        [[name, ipaddress.ip_network(networks[name])] for name in new_networks], workers)
+    dockernet.run_phase("devices", dockernet.start_device, [node_args(desired[name]) for name in new], workers)
+    dockernet.run_phase("netns", dockernet.register_netns, [[name] for name in new], workers)
+
+    for host in topo["hosts"]:
+        dockernet.hosts.setdefault(host["name"], None)
+    current = dict(zip(desired, dockernet.run_map(netlink.interfaces, [dockernet.PREFIX + name for name in desired], workers)))
+
+    # a link is kept when both ends exist and still name each other as peers.
+    new_links: list[list[str]] = []
+    kept_links: list[list[str]] = []
+    wanted: dict[str, dict[str, str | None]] = {name: {} for name in desired}
+    for link in topo["links"]:
+        c1, if1, c2, if2, ip1, ip2 = link
+        wanted[c1][if1] = ip1
+        wanted[c2][if2] = ip2
+        end1 = current[c1].get(if1)
+        end2 = current[c2].get(if2)
+        if end1 is not None and end2 is not None and end1["alias"] == f"{c2}.{if2}" and end2["alias"] == f"{c1}.{if1}":
+            kept_links.append(link)
+        else:
+            new_links.append(link)
+
+    batch = dockernet.plan_links(new_links)
+    removed = 0
+    for link in new_links:
+        for name, ifname in ((link[0], link[1]), (link[2], link[3])):
+            if ifname in current[name]:
+                batch.delete(dockernet.PREFIX + name, ifname)
+                store.forget_link(name, ifname)
+    # only ends dockernet made, which carry their peer as alias; docker's own eth0 on a network is a veth too.
+    for name, ifaces in current.items():
+        for ifname, iface in ifaces.items():
+            if iface["veth"] and iface["alias"] is not None and ifname not in wanted[name]:
+                batch.delete(dockernet.PREFIX + name, ifname)
+                store.forget_link(name, ifname)
+                removed += 1
+
+    readdressed = 0
+    for c1, if1, c2, if2, ip1, ip2 in kept_links:
+        for name, ifname, ip, peer_ip in ((c1, if1, ip1, ip2), (c2, if2, ip2, ip1)):
+            have = current[name][ifname]["addresses"]
+            want = set() if ip is None else {str(ipaddress.ip_interface(ip))}
+            for address in have - want:
+                batch.unaddr(dockernet.PREFIX + name, ifname, address)
+            for address in want - have:
+                batch.addr(dockernet.PREFIX + name, ifname, address)
+            if name in dockernet.hosts and ip is not None:
+                dockernet.hosts[name] = ipaddress.ip_interface(ip).ip
+                if have != want and peer_ip is not None:
+                    batch.route(dockernet.PREFIX + name, str(ipaddress.ip_interface(peer_ip).ip))
+            readdressed += len(have ^ want)
+    # profiles are (re)applied in place, so changing them never recreates a link.
+    impair(batch, topo, new_links)
+    impair(batch, topo, kept_links, current)
+    batch.commit(workers)
+
+    summary = {
+        "devices_added": len(new),
+        "devices_removed": len(stale),
+        "links_added": len(new_links),
+        "links_removed": removed,
+        "links_kept": len(kept_links),
+        "address_changes": readdressed,
+    }
+    dockernet.save_state()
+    print("reconcile: " + ", ".join(f"{key}={value}" for key, value in summary.items()))
+    return summary
+
+def print_plan(topo: dict):
+    for depth, stage in enumerate(plan(topo)):
+        print(f"stage {depth}: {stage_name(stage)} ({len(stage)} actions)")
+        for key, _fn, _args in stage:
+            print(f"    {key}")
+
+if __name__ == "__main__":
+    if len(sys.argv) not in [3, 4] or sys.argv[1] not in ['run', 'reconcile', 'plan']:
+        print("Usage: sudo ./topology.py run|reconcile|plan FILE [WORKERS]", file=sys.stderr)
+        exit(-1)
+
+    topo = load_topo(sys.argv[2])
+    workers = int(sys.argv[3]) if len(sys.argv) == 4 else dockernet.WORKERS
+    if sys.argv[1] == 'plan':
+        print_plan(topo)
+        exit(0)
+    try:
+        if sys.argv[1] == 'reconcile':
+            reconcile_topo(topo, workers)
+        else:
+            dockernet.clean_networks()
+            apply_topo(topo, workers)
+    except:
+        traceback.print_exc()
+    finally:
+        dockernet.main_loop()
@@ -0,0 +1,192 @@
+import re
+import json
+import time
+import random
+import subprocess
+import instrument
+import netlink
+import dockernet
+
+# Throughput tests between hosts with iperf3. Flows are scheduled into rounds in which no
+# host sends or receives more than PER_HOST flows at once; the flows of a round run
+# concurrently and rounds run one after the other. Every host runs one iperf3 server per
+# flow it may receive at once, on consecutive ports from BASE_PORT.
+BASE_PORT = 5201
+DURATION = 5
+PER_HOST = 1
+START_GRACE = 0.5
+FLOW_GRACE = 10
+PATTERNS = ["all", "permutation", "incast"]
+
+def flows_for(pattern: str, hosts: list[str], seed: int | None = None, target: str | None = None,
+              senders: int | None = None) -> list[tuple[str, str]]:
+    rng = random.Random(seed)
+    if pattern == "all":
+        return [(h1, h2) for h1 in hosts for h2 in hosts if h1 != h2]
+    if pattern == "permutation":
+        # every host sends to exactly one other host and receives from exactly one.
+        if len(hosts) < 2:
+            return []
+        order = list(hosts)
+        rng.shuffle(order)
+        return [(order[i], order[(i + 1) % len(order)]) for i in range(len(order))]
+    if pattern == "incast":
+        target = target if target is not None else rng.choice(hosts)
+        others = [h for h in hosts if h != target]
+        chosen = others if senders is None else rng.sample(others, min(senders, len(others)))
+        return [(h, target) for h in chosen]
+    raise ValueError(f"unknown pattern {pattern}")
+
+def schedule(flows: list[tuple[str, str]], per_host: int = PER_HOST,
+             receive_limit: int | None = None) -> list[list[tuple[str, str, int]]]:
+    # greedy rounds; each flow gets the port of the receiving slot it occupies.
+    receive_limit = per_host if receive_limit is None else receive_limit
+    rounds: list[list[tuple[str, str, int]]] = []
+    pending = list(flows)
+    while len(pending) != 0:
+        sending: dict[str, int] = {}
+        receiving: dict[str, int] = {}
+        current: list[tuple[str, str, int]] = []
+        rest: list[tuple[str, str]] = []
+        for src, dst in pending:
+            if sending.get(src, 0) < per_host and receiving.get(dst, 0) < receive_limit:
+                current.append((src, dst, BASE_PORT + receiving.get(dst, 0)))
+                sending[src] = sending.get(src, 0) + 1
+                receiving[dst] = receiving.get(dst, 0) + 1
+            else:
+                rest.append((src, dst))
+        rounds.append(current)
+        pending = rest
+    return rounds
+
+def pidfile(host: str, port: int) -> str:
+    return f"/tmp/dockernet-iperf3-{host}-{port}.pid"
+
+def start_servers(host: str, ports: int):
+    # namespace-only hosts share the pid space and /tmp of the machine, so pid files carry the
+    # host name and servers are stopped by pid, never by process name.
+    script = "; ".join(f"iperf3 -s -D -p {BASE_PORT + i} -I {pidfile(host, BASE_PORT + i)}" for i in range(ports))
+    instrument.run(dockernet.device_command(host, "sh", "-c", script), capture_output=True)
+
+def stop_servers(host: str, ports: int):
+    files = " ".join(pidfile(host, BASE_PORT + i) for i in range(ports))
+    instrument.run(dockernet.device_command(host, "sh", "-c", f"for f in {files}; do [ -f $f ] && kill $(cat $f); rm -f $f; done"),
+                   capture_output=True)
+
+def parse_iperf(output: str) -> dict:
+    try:
+        report = json.loads(output)
+    except json.JSONDecodeError:
+        return {"bits_per_second": 0.0, "sent_bits_per_second": 0.0, "retransmits": None, "error": output.strip()[-200:] or "no output"}
+    if "error" in report:
+        return {"bits_per_second": 0.0, "sent_bits_per_second": 0.0, "retransmits": None, "error": report["error"]}
+    end = report.get("end", {})
+    return {
+        "bits_per_second": end.get("sum_received", {}).get("bits_per_second", 0.0),
+        "sent_bits_per_second": end.get("sum_sent", {}).get("bits_per_second", 0.0),
+        "retransmits": end.get("sum_sent", {}).get("retransmits"),
+        "error": None,
+    }
+
+def run_flow(src: str, dst: str, port: int, duration: int) -> dict:
+    try:
+        output = instrument.run(dockernet.device_command(src, "iperf3", "-c", str(dockernet.hosts[dst]), "-p", str(port),
+                                                         "-t", str(duration), "-J"),
+                                capture_output=True, text=True, timeout=duration + FLOW_GRACE).stdout
+    except subprocess.TimeoutExpired:
+        output = ""
+    return {"src": src, "dst": dst, "port": port, **parse_iperf(output)}
+
+def snapshot_counters(routers: list[str], workers: int) -> dict[str, dict[str, dict]]:
+    return dict(zip(routers, dockernet.run_map(netlink.counters, [dockernet.PREFIX + name for name in routers], workers)))
+
+def ecmp_balance(before: dict[str, dict[str, dict]], after: dict[str, dict[str, dict]]) -> dict[str, dict]:
+    # a router's links are grouped by the kind of peer (its name without trailing digits, e.g.
+    # rl3 -> rs4 is "rl->rs"); balance is max/mean of the bytes sent over the links of a group.
+    groups: dict[str, list[float]] = {}
+    for router, ifaces in after.items():
+        by_peer: dict[str, list[int]] = {}
+        for ifname, now in ifaces.items():
+            if now["alias"] is None or ifname not in before.get(router, {}):
+                continue
+            peer = now["alias"].split(".", 1)[0]
+            kind = f"{re.sub(r'[0-9]+$', '', router)}->{re.sub(r'[0-9]+$', '', peer)}"
+            by_peer.setdefault(kind, []).append(now["tx_bytes"] - before[router][ifname]["tx_bytes"])
+        for kind, sent in by_peer.items():
+            mean = sum(sent) / len(sent)
+            if len(sent) >= 2 and mean > 0:
+                groups.setdefault(kind, []).append(max(sent) / mean)
+    return {kind: {"routers": len(ratios), "mean": round(sum(ratios) / len(ratios), 3), "worst": round(max(ratios), 3)}
+            for kind, ratios in sorted(groups.items())}
+
+def fairness(values: list[float]) -> float | None:
+    # Jain's index: 1 when every flow gets the same share.
+    if len(values) == 0 or sum(values) == 0:
+        return None
+    return sum(values) ** 2 / (len(values) * sum(v * v for v in values))
+
+def trafficall(pattern: str = "all", duration: int = DURATION, per_host: int = PER_HOST, seed: int | None = None,
+               target: str | None = None, senders: int | None = None, balance: bool = True,
+               workers: int = dockernet.WORKERS) -> dict:
+    addressed = sorted(h for h in dockernet.hosts if dockernet.hosts[h] is not None)
+    flows = flows_for(pattern, addressed, seed, target, senders)
+    rounds = schedule(flows, per_host, len(flows) if pattern == "incast" else None)
+    ports: dict[str, int] = {}
+    for current in rounds:
+        for _src, dst, port in current:
+            ports[dst] = max(ports.get(dst, 0), port - BASE_PORT + 1)
+
+    import convergence
+    routers = convergence.routers() if balance else []
+    dockernet.run_map(lambda host: start_servers(host, ports[host]), list(ports), workers)
+    time.sleep(START_GRACE)
+    results: list[dict] = []
+    round_rates: list[float] = []
+    try:
+        before = snapshot_counters(routers, workers)
+        for i, current in enumerate(rounds):
+            print(f"round {i + 1}/{len(rounds)}: {len(current)} flows")
+            finished = dockernet.run_map(lambda flow: run_flow(*flow, duration), current, max(1, len(current)))
+            for result in finished:
+                result["round"] = i
+            results += finished
+            round_rates.append(sum(result["bits_per_second"] for result in finished))
+        after = snapshot_counters(routers, workers)
+    finally:
+        dockernet.run_map(lambda host: stop_servers(host, ports[host]), list(ports), workers)
+
+    rates = [result["bits_per_second"] for result in results if result["error"] is None]
+    retransmits = [result["retransmits"] for result in results if result["retransmits"] is not None]
+    summary = {
+        "pattern": pattern,
+        "duration": duration,
+        "per_host": per_host,
+        "flows": len(results),
+        "failed": len(results) - len(rates),
+        "rounds": len(rounds),
+        "capacity_bps": max(round_rates, default=0.0),
+        "mean_flow_bps": sum(rates) / len(rates) if len(rates) != 0 else 0.0,
+        "min_flow_bps": min(rates, default=0.0),
+        "max_flow_bps": max(rates, default=0.0),
+        "fairness": fairness(rates),
+        "retransmits": sum(retransmits),
+        "round_bps": round_rates,
+        "ecmp_balance": ecmp_balance(before, after) if balance else {},
+    }
+    return {"summary": summary, "flows": results}
+
+def gbps(bps: float) -> str:
+    return f"{bps / 1e9:.2f}Gb/s"
+
+def format_report(report: dict) -> str:
+    s = report["summary"]
+    lines = [f"{s['pattern']}: {s['flows']} flows in {s['rounds']} rounds, {s['failed']} failed, {s['retransmits']} retransmits",
+             f"fabric capacity {gbps(s['capacity_bps'])} (busiest round), per flow mean {gbps(s['mean_flow_bps'])}, "
+             f"min {gbps(s['min_flow_bps'])}, max {gbps(s['max_flow_bps'])}"
+             + ("" if s["fairness"] is None else f", fairness {s['fairness']:.3f}")]
+    for kind, balance in s["ecmp_balance"].items():
+        lines.append(f"ecmp {kind}: max/mean {balance['mean']:.2f} on average, {balance['worst']:.2f} worst over {balance['routers']} routers")
+    for flow in report["flows"]:
+        if flow["error"] is not None:
+            lines.append(f"failed: {flow['src']} -> {flow['dst']}: {flow['error']}")
+    return "\n".join(lines)